@@ -78,10 +78,11 @@ if question:
 
             cypher_query, results, error = retriever.retrieve(question, model=st.session_state.active_retriever_model)
 
-            if error:
-                response = "Error has occurred."
-            else:
-                response = generator.generate(question=question, retrieved_nodes=results, schema_context=retriever.schema_context(), cypher_query=cypher_query, model=st.session_state.active_generator_model)
+        if error:
+            response = "Error has occurred."
+        else:
+            # Stream the answer as it is generated, write_stream returns the full text for history
+            response = st.write_stream(generator.generate_stream(question=question, retrieved_nodes=results, schema_context=retriever.schema_context(), cypher_query=cypher_query, model=st.session_state.active_generator_model))
 
     st.session_state.chat_history_row_text.append({"role": "user", "msg": question})
     if error:
@@ -61,8 +61,10 @@ if question:
                 "generator_model": st.session_state.active_generator_model,
             }
 
-        _, results, _ = retriever.retrieve(question) # retrieval doesn't use model
-        response = generator.generate(question=question, retrieved_nodes=results, schema_context=retriever.schema_context(), model=st.session_state.active_generator_model)
+            _, results, _ = retriever.retrieve(question) # retrieval doesn't use model
+
+        # Stream the answer as it is generated, write_stream returns the full text for history
+        response = st.write_stream(generator.generate_stream(question=question, retrieved_nodes=results, schema_context=retriever.schema_context(), model=st.session_state.active_generator_model))
 
     st.session_state.chat_history_vector.append({"role": "user", "msg": question})
     st.session_state.chat_history_vector.append({"role": "assistant", "msg": response, "raw": results, "config": config_snapshot})
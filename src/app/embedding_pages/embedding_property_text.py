@@ -2,7 +2,7 @@ from app.embedding_pages.helper import load_page, init_history, load_config, loa
 from scopes import PropertyTextScopeGraph
 
 graph = PropertyTextScopeGraph()
-graph.load_chroma()
+graph.load_vectors()
 name = "property_text"
 
 # Page
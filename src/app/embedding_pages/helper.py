@@ -21,6 +21,8 @@ def load_config(name):
             st.session_state[f"embeddings_{name}_threshold"] = None
         if f"embeddings_{name}_allownames" not in st.session_state:
             st.session_state[f"embeddings_{name}_allownames"] = False
+        if f"embeddings_{name}_range" not in st.session_state:
+            st.session_state[f"embeddings_{name}_range"] = False
 
         with st.form("config_form", border=False, enter_to_submit=False):
             k_config = st.number_input(
@@ -43,11 +45,17 @@ def load_config(name):
                 value=False
             )
 
+            range_config = st.checkbox(
+                "Return every match above the threshold (ignores Top-K)",
+                value=False
+            )
+
             submitted = st.form_submit_button("Apply settings for next submit")
             if submitted:
                 st.session_state[f"embeddings_{name}_k"] = k_config
                 st.session_state[f"embeddings_{name}_threshold"] = threshold_config
                 st.session_state[f"embeddings_{name}_allownames"] = allownames_config
+                st.session_state[f"embeddings_{name}_range"] = range_config
 
                 st.success("Settings applied successfully. These will be used on your next query.")
 
@@ -82,29 +90,34 @@ def load_history(name):
                 )
 
 def load_input(name, graph):
-    search = st.chat_input("Enter a search term or passage...")
+    search = st.chat_input("Enter a search term or passage (one per line to search several)...")
     if search:
         with st.chat_message("user", avatar=":material/search:"):
             st.markdown(search)
 
         with st.chat_message("assistant", avatar=":material/keyboard_return:"):
             with st.spinner("Searching..."):
+                range_search = st.session_state[f"embeddings_{name}_range"] and st.session_state[f"embeddings_{name}_threshold"] is not None
                 config_snapshot = {
-                    "k": st.session_state[f"embeddings_{name}_k"],
+                    "k": "all" if range_search else st.session_state[f"embeddings_{name}_k"],
                     "threshold": st.session_state[f"embeddings_{name}_threshold"]
                 }
 
-                records = graph.chroma.query(
-                    query=search.strip(),
-                    k=st.session_state[f"embeddings_{name}_k"],
+                # One phrase per line, all served by a single batched search
+                phrases = [line.strip() for line in search.splitlines() if line.strip()]
+                batches = graph.vectors.query_many(
+                    queries=phrases,
+                    k=None if range_search else st.session_state[f"embeddings_{name}_k"],
                     threshold=st.session_state[f"embeddings_{name}_threshold"],
                     filter_entities=None if st.session_state[f"embeddings_{name}_allownames"] else ["FailureMode", "FailureEffect", "FailureCause", "RecommendedAction", "CurrentControls", "FailureOccurrence", "ControlAction", "Row"]
                 )
 
                 results = pd.DataFrame(
-                    ([record[1], record[2].replace(" ", "\u00A0"), "{:.4f}".format(record[3])] for record in records),
+                    ([record[1], record[2].replace(" ", "\u00A0"), "{:.4f}".format(record[3])] for records in batches for record in records),
                     columns=["Type", "Content", "Score"]
                 )
+                if len(phrases) > 1:
+                    results.insert(0, "Query", [phrase for phrase, records in zip(phrases, batches) for _ in records])
 
         st.session_state[f"embeddings_history_{name}"].append({"role": "user", "search": search})
         st.session_state[f"embeddings_history_{name}"].append({"role": "assistant", "results": results, "config": config_snapshot})
@@ -0,0 +1,500 @@
+import logging
+import sys
+import os
+import csv
+import time
+import random
+import resource
+import hashlib
+import tempfile
+import queue
+import multiprocessing
+from collections import Counter
+from contextlib import contextmanager
+
+import numpy as np
+from chromadb import Documents, Embeddings
+from chromadb.utils.embedding_functions import EmbeddingFunction
+
+from databases.pkl.skb import SKB, SKBNode
+from load import scope_graphs
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="\n=== %(levelname)s [%(name)s] ===\n%(message)s\n"
+)
+
+FMEA_SHEET = "databases/pkl/fmea_dataset_filled.csv"
+INGEST_RESULTS = "benchmark_ingest.csv"
+NEO4J_BENCH_DATABASE = "benchmark" # ingest stages never touch the scope databases
+RANGE_THRESHOLD = 0.05 # hash embeddings are random unit vectors, so about 2.5% of documents pass this
+HIERARCHY = ("Subsystem", "Component", "Sub-Component")
+FAILURE_MODE = ("Potential Failure Mode", "Potential Effect(s) of Failure")
+RATINGS = ("Severity", "Occurrence", "Detection", "RPN")
+
+def synthesise_sheet(filepath: str, outpath: str, scale: int, rename: bool = True) -> int:
+    """Enlarge the FMEA sheet by repeating it `scale` times, under renamed hierarchies unless rename is off. Returns rows written."""
+    with open(filepath, "r", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        fieldnames = reader.fieldnames
+        rows = list(reader)
+
+    written = 0
+    with open(outpath, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        for copy in range(scale):
+            for row in rows:
+                if copy and rename:
+                    row = {**row, **{col: f"{row[col]} #{copy}" for col in ("Subsystem", "Component", "Sub-Component")}}
+                writer.writerow(row)
+                written += 1
+    return written
+
+def learn_fmea_profile(filepath: str) -> dict[str, any]:
+    """Fan-out, text reuse and rating statistics of an FMEA sheet, for generate_fmea_sheet."""
+    with open(filepath, "r", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        fieldnames = reader.fieldnames
+        rows = list(reader)
+
+    # Children per parent at each hierarchy level, then failure modes per sub-component and rows per failure mode
+    levels = [*HIERARCHY, FAILURE_MODE]
+    children: list[dict[tuple, set]] = [{} for _ in levels]
+    rows_per_mode = Counter()
+    for row in rows:
+        path = ()
+        for depth, level in enumerate(levels):
+            key = tuple(row[col] for col in level) if isinstance(level, tuple) else row[level]
+            children[depth].setdefault(path, set()).add(key)
+            path += (key,)
+        rows_per_mode[path] += 1
+
+    text_columns = [col for col in fieldnames if col not in HIERARCHY and col not in FAILURE_MODE and col not in RATINGS]
+    return {
+        "fieldnames": fieldnames,
+        "rows": len(rows),
+        "fan_out": [[len(keys) for keys in level.values()] for level in children],
+        "rows_per_mode": list(rows_per_mode.values()),
+        "names": {col: [row[col] for row in rows] for col in HIERARCHY},
+        "failure_modes": [path[-1] for path in rows_per_mode], # one per sub-component failure mode, as they are generated
+        "texts": {col: [row[col] for row in rows] for col in text_columns},
+        "reuse": {
+            **{col: 1 - len({row[col] for row in rows}) / len(rows) for col in text_columns},
+            FAILURE_MODE: 1 - len({path[-1] for path in rows_per_mode}) / len(rows_per_mode),
+        },
+        "ratings": [tuple(row[col] for col in RATINGS) for row in rows], # sampled jointly, RPN isn't always S*O*D in the sheet
+    }
+
+def generate_fmea_sheet(profile: dict[str, any], outpath: str, scale: int, seed: int = 0) -> int:
+    """Write a synthetic sheet of about scale x the profiled rows, with the same fan-out, reuse rates and rating mix. Returns rows written."""
+    rng = random.Random(seed)
+    target = profile["rows"] * scale
+    emitted: dict[str, list] = {col: [] for col in profile["reuse"]}
+    seen: dict[str, set] = {col: set() for col in profile["reuse"]}
+
+    def text(col, pool):
+        # Reuse an earlier value (frequency weighted) at the learned rate, else introduce a new one
+        if emitted[col] and rng.random() < profile["reuse"][col]:
+            return rng.choice(emitted[col])
+        value = rng.choice(pool)
+        if value in seen[col] and any(value): # blank cells stay blank
+            variant = f" (variant {len(seen[col])})"
+            value = tuple(v + variant for v in value) if isinstance(value, tuple) else value + variant
+        seen[col].add(value)
+        emitted[col].append(value)
+        return value
+
+    def names(col, count):
+        pool = list(dict.fromkeys(profile["names"][col]))
+        picked = rng.sample(pool, min(count, len(pool)))
+        return picked + [f"{rng.choice(pool)} {i}" for i in range(count - len(picked))]
+
+    subsystems = list(dict.fromkeys(profile["names"]["Subsystem"]))
+    written = 0
+    with open(outpath, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=profile["fieldnames"])
+        writer.writeheader()
+        copy = 0
+        while written < target:
+            subsystem = subsystems[copy % len(subsystems)] + (f" #{copy // len(subsystems)}" if copy >= len(subsystems) else "")
+            copy += 1
+            for component in names("Component", rng.choice(profile["fan_out"][1])):
+                for sub_component in names("Sub-Component", rng.choice(profile["fan_out"][2])):
+                    for _ in range(rng.choice(profile["fan_out"][3])):
+                        mode, effect = text(FAILURE_MODE, profile["failure_modes"])
+                        for _ in range(rng.choice(profile["rows_per_mode"])):
+                            row = dict(zip(HIERARCHY, (subsystem, component, sub_component)))
+                            row.update(zip(FAILURE_MODE, (mode, effect)))
+                            row.update(zip(RATINGS, rng.choice(profile["ratings"])))
+                            row.update({col: text(col, pool) for col, pool in profile["texts"].items()})
+                            writer.writerow(row)
+                            written += 1
+    return written
+
+class HashEmbeddingFunction(EmbeddingFunction):
+    """Deterministic local stand-in for text-embedding-3-small: unit vectors seeded from the text hash."""
+    def __init__(self, dimension: int = 1536):
+        self.dimension = dimension
+
+    def __call__(self, input: Documents) -> Embeddings:
+        vectors = []
+        for text in input:
+            rng = np.random.default_rng(int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "little"))
+            vector = rng.standard_normal(self.dimension).astype(np.float32)
+            vectors.append(vector / np.linalg.norm(vector))
+        return vectors
+
+@contextmanager
+def scratch_stores(tmp: str):
+    """Point the Chroma store, the shared embedding store and the vector indexes at tmp, for this process and the stages it spawns.
+    Benchmark collections reuse the scope names, so writing to the real stores would overwrite and later drop those collections' entries."""
+    paths = {
+        "CHROMA_PATH": os.path.join(tmp, "chroma"),
+        "EMBEDDING_STORE_PATH": os.path.join(tmp, "embedding_store.sqlite3"),
+        "VECTOR_INDEX_PATH": os.path.join(tmp, "vector_index"),
+    }
+    previous = {name: os.environ.get(name) for name in paths}
+    os.environ.update(paths)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+@contextmanager
+def legacy_accessors():
+    """Temporarily restore the model_dump based accessors, as a baseline for the precomputed field tables."""
+    def get_props(self):
+        return { k: v for k, v in self.model_dump().items()
+            if not type(self).model_fields[k].json_schema_extra.get("relation", False)}
+
+    def get_relations(self):
+        return { k: v for k, v in self.model_dump().items()
+            if type(self).model_fields[k].json_schema_extra.get("relation", False)}
+
+    def get_identity(self):
+        return { k: v for k, v in self.model_dump().items()
+            if type(self).model_fields[k].json_schema_extra.get("id", False)}
+
+    def get_semantic(self):
+        return { k: v for k, v in self.model_dump().items()
+            if type(self).model_fields[k].json_schema_extra.get("semantic", False)}
+
+    def get_textual(self):
+        return { k: v for k, v in self.model_dump().items()
+            if isinstance(v, str)}
+
+    def compute_id(self):
+        id_vals = self.get_identity().values()
+        return hashlib.sha1("|".join(str(val) for val in id_vals).encode()).hexdigest()
+
+    def add_entity(self, entity):
+        node_id = entity.compute_id()
+        if node_id not in self.nodes:
+            self.nodes[node_id] = entity
+        else:
+            existing = self.nodes[node_id]
+            for k, v in entity.model_dump().items():
+                if type(existing).model_fields[k].json_schema_extra.get("id", False):
+                    continue
+                if isinstance(v, list):
+                    setattr(existing, k, list(set(getattr(existing, k) + v)))
+        return node_id
+
+    patched = {
+        SKBNode: {"get_props": get_props, "get_relations": get_relations, "get_identity": get_identity,
+            "get_semantic": get_semantic, "get_textual": get_textual, "compute_id": compute_id},
+        SKB: {"add_entity": add_entity},
+    }
+    originals = {cls: {name: vars(cls)[name] for name in methods} for cls, methods in patched.items()}
+    try:
+        for cls, methods in patched.items():
+            for name, method in methods.items():
+                setattr(cls, name, method)
+        yield
+    finally:
+        for cls, methods in originals.items():
+            for name, method in methods.items():
+                setattr(cls, name, method)
+
+def time_skb_ingest(scope: str, sheet: str, outpath: str) -> tuple[float, float, int]:
+    """Time setup_skb plus one pass over every accessor Chroma_DB/Neo4j_DB.parse use. Returns (ingest, accessors, nodes)."""
+    graph = scope_graphs[scope]()
+
+    start = time.perf_counter()
+    graph.setup_skb(filepath=sheet, outpath=outpath)
+    ingest = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for node in graph.skb.get_entities().values():
+        node.get_props()
+        node.get_relations()
+        node.get_semantic()
+        node.get_textual()
+        node.compute_id()
+    accessors = time.perf_counter() - start
+
+    return ingest, accessors, len(graph.skb.get_entities())
+
+def bench_skb(scale: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        sheet = os.path.join(tmp, "fmea_synthetic.csv")
+        rows = synthesise_sheet(FMEA_SHEET, sheet, scale)
+        print(f"Synthetic FMEA sheet: {rows} rows ({scale}x)")
+
+        print(f"{'scope':<15}{'nodes':>9}{'legacy ingest':>15}{'ingest':>10}{'speed-up':>10}{'legacy access':>15}{'access':>10}{'speed-up':>10}")
+        for scope in scope_graphs:
+            outpath = os.path.join(tmp, f"{scope}.pkl")
+            with legacy_accessors():
+                legacy_ingest, legacy_access, _ = time_skb_ingest(scope, sheet, outpath)
+            ingest, access, nodes = time_skb_ingest(scope, sheet, outpath)
+            print(f"{scope:<15}{nodes:>9}{legacy_ingest:>14.2f}s{ingest:>9.2f}s{legacy_ingest / ingest:>9.1f}x"
+                f"{legacy_access:>14.2f}s{access:>9.2f}s{legacy_access / access:>9.1f}x")
+
+def bench_merge(rows: int):
+    """setup_skb on sheets of exact duplicate rows, so every row merges into existing nodes. Time per row should stay flat."""
+    base_rows = sum(1 for _ in csv.DictReader(open(FMEA_SHEET, "r", encoding="utf-8")))
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{'scope':<15}{'rows':>10}{'seconds':>10}{'us/row':>10}")
+        for scope in scope_graphs:
+            for target in (rows // 4, rows // 2, rows):
+                sheet = os.path.join(tmp, "fmea_duplicated.csv")
+                written = synthesise_sheet(FMEA_SHEET, sheet, max(1, target // base_rows), rename=False)
+
+                graph = scope_graphs[scope]()
+                start = time.perf_counter()
+                graph.setup_skb(filepath=sheet, outpath=os.path.join(tmp, f"{scope}.pkl"))
+                elapsed = time.perf_counter() - start
+                print(f"{scope:<15}{written:>10}{elapsed:>9.2f}s{elapsed / written * 1e6:>10.1f}")
+
+def bench_snapshot(scale: int):
+    """Compare pickle and snapshot SKB start-up: open, first node lookup and a full pass over the nodes."""
+    with tempfile.TemporaryDirectory() as tmp:
+        sheet = os.path.join(tmp, "fmea_synthetic.csv")
+        rows = synthesise_sheet(FMEA_SHEET, sheet, scale)
+        print(f"Synthetic FMEA sheet: {rows} rows ({scale}x)")
+
+        print(f"{'scope':<15}{'format':<10}{'size MB':>9}{'open':>10}{'lookup':>10}{'full pass':>11}")
+        for scope in scope_graphs:
+            graph = scope_graphs[scope]()
+            graph.setup_skb(filepath=sheet, outpath=os.path.join(tmp, f"{scope}.pkl"))
+            some_id = list(graph.skb.get_entities())[-1]
+            for extension in ("pkl", "skb"):
+                path = os.path.join(tmp, f"{scope}.{extension}")
+                graph.skb.save(path)
+
+                skb = SKB(graph.schema)
+                start = time.perf_counter()
+                skb.load(path)
+                opened = time.perf_counter() - start
+                skb.get_entity_by_id(some_id).compute_id()
+                lookup = time.perf_counter() - start - opened
+                for node in skb.get_entities().values():
+                    node.get_textual()
+                full = time.perf_counter() - start - opened - lookup
+                print(f"{scope:<15}{extension:<10}{os.path.getsize(path) / 1e6:>9.1f}{opened * 1000:>8.1f}ms{lookup * 1000:>8.2f}ms{full:>10.2f}s")
+
+def ingest_stage(stage: str, scope: str, sheet: str, skb_file: str, results: multiprocessing.Queue):
+    """Run one ingest stage in a fresh process, so peak RSS is its own. Puts (items, seconds, baseline RSS, peak RSS, error)."""
+    try:
+        from databases import Neo4j_DB
+        graph = scope_graphs[scope]()
+        graph.embedding_func = HashEmbeddingFunction()
+        if stage != "skb":
+            graph.load_skb(skb_file)
+        baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+        start = time.perf_counter()
+        match stage:
+            case "skb":
+                graph.setup_skb(filepath=sheet, outpath=skb_file)
+                items = len(graph.skb.get_entities())
+            case "chroma":
+                graph.setup_chroma()
+                items = graph.chroma.collection.count()
+            case "neo4j":
+                Neo4j_DB(collection_name=NEO4J_BENCH_DATABASE).parse(graph.skb)
+                items = len(graph.skb.get_entities())
+            case "attach":
+                graph.load_chroma()
+                Neo4j_DB(collection_name=NEO4J_BENCH_DATABASE).attach_chroma_embeddings(graph.chroma)
+                items = graph.chroma.collection.count()
+        elapsed = time.perf_counter() - start
+
+        results.put((items, elapsed, baseline, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024, None))
+    except Exception as e:
+        results.put((0, 0.0, 0, 0, f"{type(e).__name__}: {e}"))
+
+def run_ingest_stage(context, stage: str, scope: str, sheet: str, skb_file: str) -> tuple:
+    results = context.Queue()
+    process = context.Process(target=ingest_stage, args=(stage, scope, sheet, skb_file, results))
+    process.start()
+    try:
+        while True:
+            try:
+                return results.get(timeout=1)
+            except queue.Empty:
+                if not process.is_alive(): # e.g. killed for running out of memory
+                    return (0, 0.0, 0, 0, f"stage process exited with code {process.exitcode}")
+    finally:
+        process.join()
+
+def bench_ingest(scales: list[int], neo4j: bool = False):
+    """Wall time, peak RSS and throughput of each ingest stage per scope, on generated sheets at each scale. Results go to INGEST_RESULTS."""
+    profile = learn_fmea_profile(FMEA_SHEET)
+    stages = ["skb", "chroma"] + (["neo4j", "attach"] if neo4j else [])
+    context = multiprocessing.get_context("spawn")
+
+    records = []
+    print(f"{'scale':>7}{'rows':>10}  {'scope':<15}{'stage':<8}{'items':>10}{'seconds':>10}{'items/s':>10}{'peak MB':>9}{'stage MB':>9}")
+    try:
+        for scale in scales:
+            with tempfile.TemporaryDirectory() as tmp, scratch_stores(tmp): # stages embed into throwaway stores
+                sheet = os.path.join(tmp, "fmea_synthetic.csv")
+                rows = generate_fmea_sheet(profile, sheet, scale)
+
+                for scope in scope_graphs:
+                    skb_file = os.path.join(tmp, f"{scope}.skb")
+                    for stage in stages:
+                        if scope == "row_all" and stage in ("neo4j", "attach"):
+                            continue
+                        items, seconds, baseline, peak, error = run_ingest_stage(context, stage, scope, sheet, skb_file)
+                        records.append({
+                            "scale": scale, "rows": rows, "scope": scope, "stage": stage, "items": items, "seconds": round(seconds, 4),
+                            "items_per_second": round(items / seconds, 1) if seconds else None,
+                            "peak_rss_mb": round(peak / 2**20, 1), "stage_rss_mb": round((peak - baseline) / 2**20, 1), "error": error,
+                        })
+                        if error:
+                            print(f"{scale:>7}{rows:>10}  {scope:<15}{stage:<8} failed: {error}")
+                            break # later stages need this one's output
+                        print(f"{scale:>7}{rows:>10}  {scope:<15}{stage:<8}{items:>10}{seconds:>9.2f}s{items / seconds:>10.0f}"
+                            f"{peak / 2**20:>9.0f}{(peak - baseline) / 2**20:>9.0f}")
+    finally:
+        with open(INGEST_RESULTS, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=["scale", "rows", "scope", "stage", "items", "seconds", "items_per_second", "peak_rss_mb", "stage_rss_mb", "error"])
+            writer.writeheader()
+            writer.writerows(records)
+        print(f"Saved results to {INGEST_RESULTS}")
+
+def vector_stage(stage: str, size: int, tmp: str, queries: list[str], results: multiprocessing.Queue):
+    """Build a synthetic collection, or time one search backend over it from a cold start, in a fresh process."""
+    try:
+        from databases import Chroma_DB, VectorIndex
+        embed_fnc = HashEmbeddingFunction()
+        index_path = os.path.join(tmp, "vector_index")
+        types = ["FailureMode", "FailureCause", "FailureEffect", "RecommendedAction"]
+
+        if stage == "build":
+            chroma = Chroma_DB(collection_name="vectors", embed_fnc=embed_fnc)
+            partitioned = Chroma_DB(collection_name="partitioned", embed_fnc=embed_fnc)
+            version = partitioned.next_version()
+            collection = partitioned.open_version(version, "partitioned")
+            batch_size = chroma.client.get_max_batch_size()
+            for start in range(0, size, batch_size):
+                docs = [f"synthetic document {i}" for i in range(start, min(size, start + batch_size))]
+                batch = {"ids": [f"id{i}" for i in range(start, start + len(docs))], "documents": docs,
+                    "metadatas": [{"type": types[i % len(types)]} for i in range(start, start + len(docs))], "embeddings": embed_fnc(docs)}
+                chroma.collection.add(**batch)
+                collection.add(**batch)
+            partitioned.switch(version, "partitioned")
+            VectorIndex.build(chroma, path=index_path)
+            for dtype in ("float16", "int8"):
+                VectorIndex.build(chroma, path=f"{index_path}-{dtype}", dtype=dtype)
+            results.put({})
+            return
+
+        start = time.perf_counter()
+        if stage == "numpy":
+            backend = VectorIndex("vectors", embed_fnc, path=index_path)
+        elif stage in ("float16", "int8"):
+            backend = VectorIndex("vectors", embed_fnc, path=f"{index_path}-{stage}")
+        else:
+            backend = Chroma_DB(collection_name="vectors" if stage == "chroma" else "partitioned", embed_fnc=embed_fnc)
+        opened = time.perf_counter() - start
+        first = backend.query(queries[0])
+        first_query = time.perf_counter() - start - opened
+
+        start = time.perf_counter()
+        hits = [[match[0] for match in backend.query(query)] for query in queries]
+        query = (time.perf_counter() - start) / len(queries)
+        start = time.perf_counter()
+        filtered_hits = [[match[0] for match in backend.query(text, filter_entities=types[:1])] for text in queries]
+        filtered = (time.perf_counter() - start) / len(queries)
+        start = time.perf_counter()
+        batched_hits = [[match[0] for match in matches] for matches in backend.query_many(queries)]
+        batched = (time.perf_counter() - start) / len(queries)
+        if batched_hits != hits:
+            raise AssertionError("query_many returned different matches than query")
+        start = time.perf_counter()
+        found = sum(len(matches) for matches in backend.query_many(queries, k=None, threshold=RANGE_THRESHOLD)) / len(queries)
+        range_search = (time.perf_counter() - start) / len(queries)
+        # Chroma's HNSW segment keeps float32 vectors, the layout the compact indexes are compared against
+        memory = backend.nbytes if isinstance(backend, VectorIndex) else backend.collection.count() * len(embed_fnc(queries[:1])[0]) * 4
+        disk = backend.disk_bytes if isinstance(backend, VectorIndex) else None # Chroma's files mix vectors with HNSW graph and metadata
+        results.put({"open": opened, "memory": memory, "disk": disk, "first_query": first_query, "query": query, "filtered": filtered, "batched": batched, "range": range_search,
+            "found": found, "expansions": backend.range_stats["expansions"], "hits": hits, "filtered_hits": filtered_hits, "first": first[0][0] if first else None})
+    except Exception as e:
+        results.put({"error": f"{type(e).__name__}: {e}"})
+
+def bench_vectors(sizes: list[int], queries: int = 50):
+    """Chroma HNSW (one collection, and partitioned by type) against the exact NumPy VectorIndex, and its float16 and int8 forms with float32 re-scoring:
+    vector memory scanned, vector bytes on disk (a compact index also keeps its float32 copy), cold open, first query, mean query (plain, type-filtered and batched through query_many),
+    range search (k=None) above RANGE_THRESHOLD with the matches found and k expansions needed, and recall@25 (plain and type-filtered)."""
+    context = multiprocessing.get_context("spawn")
+    texts = [f"synthetic query {i}" for i in range(queries)]
+    print(f"{'size':>8}  {'backend':<12}{'memory':>10}{'disk':>10}{'open':>10}{'first':>10}{'query':>10}{'filtered':>10}{'batched':>10}{'range':>10}{'found':>8}{'expanded':>10}{'recall@25':>11}{'filtered':>10}")
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp, scratch_stores(tmp):
+            measured = {}
+            for stage in ("build", "chroma", "partitioned", "numpy", "float16", "int8"):
+                results = context.Queue()
+                process = context.Process(target=vector_stage, args=(stage, size, tmp, texts, results))
+                process.start()
+                measured[stage] = results.get()
+                process.join()
+                if "error" in measured[stage]:
+                    print(f"{size:>8}  {stage:<12}failed: {measured[stage]['error']}")
+                    break
+            else:
+                for backend in ("chroma", "partitioned", "numpy", "float16", "int8"):
+                    m = measured[backend]
+                    recall, filtered_recall = (
+                        sum(len(set(found) & set(exact)) for found, exact in zip(m[key], measured["numpy"][key])) / sum(len(exact) for exact in measured["numpy"][key])
+                        for key in ("hits", "filtered_hits")
+                    )
+                    disk = f"{m['disk'] / 2**20:>8.1f}MB" if m["disk"] is not None else f"{'-':>10}"
+                    print(f"{size:>8}  {backend:<12}{m['memory'] / 2**20:>8.1f}MB{disk}{m['open'] * 1000:>8.1f}ms{m['first_query'] * 1000:>8.1f}ms{m['query'] * 1000:>8.2f}ms{m['filtered'] * 1000:>8.2f}ms{m['batched'] * 1000:>8.2f}ms{m['range'] * 1000:>8.2f}ms{m['found']:>8.1f}{m['expansions']:>10}{recall:>11.3f}{filtered_recall:>10.3f}")
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Incorrect number of arguments")
+        exit(1)
+
+    action = sys.argv[1]
+    match action:
+        case "skb":
+            scale = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+            bench_skb(scale)
+        case "snapshot":
+            scale = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+            bench_snapshot(scale)
+        case "merge":
+            rows = int(sys.argv[2]) if len(sys.argv) > 2 else 1_000_000
+            bench_merge(rows)
+        case "generate": # write a synthetic sheet for use elsewhere
+            scale = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+            outpath = sys.argv[3] if len(sys.argv) > 3 else f"databases/pkl/fmea_synthetic_{scale}x.csv"
+            print(f"Wrote {generate_fmea_sheet(learn_fmea_profile(FMEA_SHEET), outpath, scale)} rows to {outpath}")
+        case "ingest":
+            scales = [int(arg) for arg in sys.argv[2:] if arg.isdigit()] or [10, 100, 1000]
+            bench_ingest(scales, neo4j="neo4j" in sys.argv[2:])
+        case "vectors":
+            sizes = [int(arg) for arg in sys.argv[2:]] or [1_000, 10_000, 30_000]
+            bench_vectors(sizes)
+        case _:
+            print("Unrecognised action")
+            exit(1)
@@ -1,3 +1,5 @@
 from .chroma_dbs.skb_chroma import Chroma_DB, Te3sEmbeddingFunction
 from .neo4j_dbs.skb_neo4j import Neo4j_DB
+from .cypher_dbs.skb_cypher import SKBCypher_DB
+from .vector_dbs.vector_index import VectorIndex
 from .pkl.skb import SKB
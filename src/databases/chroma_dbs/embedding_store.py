@@ -0,0 +1,103 @@
+import logging
+import os
+import sqlite3
+import hashlib
+import threading
+from array import array
+from dotenv import load_dotenv
+
+load_dotenv()
+EMBEDDING_STORE_PATH = os.getenv("EMBEDDING_STORE_PATH", "databases/cache/embedding_store.sqlite3")
+
+class EmbeddingStore:
+    """Content-addressed document embeddings shared by every scope collection, so each preprocessed text is embedded once."""
+    def __init__(self, path: str = EMBEDDING_STORE_PATH):
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+        self.path = path
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        if path and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path or ":memory:", check_same_thread=False) # empty path keeps the store in-process only
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS vectors (key TEXT PRIMARY KEY, namespace TEXT NOT NULL, vector BLOB NOT NULL)")
+        # The text behind each collection document, for the dedup ratio
+        self.conn.execute("CREATE TABLE IF NOT EXISTS refs (collection TEXT NOT NULL, id TEXT NOT NULL, key TEXT NOT NULL, PRIMARY KEY (collection, id))")
+        self.conn.commit()
+        self.logger.info(f"Embedding store at {path or 'memory'} loaded with {self.conn.execute('SELECT COUNT(*) FROM vectors').fetchone()[0]} texts")
+
+    @staticmethod
+    def key(namespace: str, text: str) -> str:
+        return hashlib.sha256(f"{namespace}\x00{text}".encode()).hexdigest()
+
+    def get_many(self, namespace: str, texts: list[str]) -> dict[str, list[float]]:
+        """Stored vectors for whichever of the texts have one."""
+        keys = {self.key(namespace, text): text for text in texts}
+        found = {}
+        with self.lock:
+            key_list = list(keys)
+            for start in range(0, len(key_list), 500): # stay under SQLite's bound parameter limit
+                chunk = key_list[start:start + 500]
+                rows = self.conn.execute(f"SELECT key, vector FROM vectors WHERE key IN ({', '.join('?' * len(chunk))})", chunk)
+                for key, vector in rows:
+                    found[keys[key]] = array("f", vector).tolist()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, namespace: str, texts: list[str], vectors: list[list[float]]):
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO vectors (key, namespace, vector) VALUES (?, ?, ?)",
+                [(self.key(namespace, text), namespace, array("f", vector).tobytes()) for text, vector in zip(texts, vectors)]
+            )
+            self.conn.commit()
+
+    def add_refs(self, collection: str, namespace: str, ids: list[str], texts: list[str]):
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO refs (collection, id, key) VALUES (?, ?, ?)",
+                [(collection, node_id, self.key(namespace, text)) for node_id, text in zip(ids, texts)]
+            )
+            self.conn.commit()
+
+    def remove_refs(self, collection: str, ids: list[str] = None):
+        """Forget documents removed from a collection (all of them when ids is None)."""
+        with self.lock:
+            if ids is None:
+                self.conn.execute("DELETE FROM refs WHERE collection = ?", (collection,))
+            else:
+                self.conn.executemany("DELETE FROM refs WHERE collection = ? AND id = ?", [(collection, node_id) for node_id in ids])
+            self.conn.commit()
+
+    def stats(self) -> dict[str, any]:
+        """Documents across collections, the distinct texts behind them and the dedup ratio (documents per embedded text)."""
+        with self.lock:
+            stored = self.conn.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+            documents, texts = self.conn.execute("SELECT COUNT(*), COUNT(DISTINCT key) FROM refs").fetchone()
+            shared = self.conn.execute("SELECT COUNT(*) FROM (SELECT key FROM refs GROUP BY key HAVING COUNT(DISTINCT collection) > 1)").fetchone()[0]
+            collections = dict(self.conn.execute("SELECT collection, COUNT(*) FROM refs GROUP BY collection"))
+        return {
+            "documents": documents,
+            "texts": texts,
+            "cross_collection_texts": shared,
+            "dedup_ratio": round(documents / texts, 4) if texts else 0.0,
+            "stored_vectors": stored,
+            "collections": collections,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+_shared_embedding_store: EmbeddingStore = None
+_shared_store_lock = threading.Lock()
+
+def get_embedding_store() -> EmbeddingStore:
+    """Process-wide embedding store, shared by every Chroma_DB."""
+    global _shared_embedding_store
+    with _shared_store_lock:
+        if _shared_embedding_store is None:
+            _shared_embedding_store = EmbeddingStore()
+        return _shared_embedding_store
@@ -0,0 +1,118 @@
+import os
+from dotenv import load_dotenv
+import logging
+import heapq
+from concurrent.futures import ThreadPoolExecutor
+
+from chromadb import Collection, QueryResult, PersistentClient
+
+load_dotenv()
+CHROMA_QUERY_WORKERS = int(os.getenv("CHROMA_QUERY_WORKERS", 4)) # partitions searched concurrently by one query
+
+# Shared by every PartitionedCollection: Chroma_DB opens a new one on each alias switch, and long-running processes must not gain a pool each time
+_query_executor = ThreadPoolExecutor(max_workers=CHROMA_QUERY_WORKERS, thread_name_prefix="chroma-partitions")
+
+class PartitionedCollection:
+    """One Chroma collection per entity type behind the subset of the Collection interface Chroma_DB and its callers use.
+    A type-filtered query only searches the partitions of those types; anything else fans out to every partition and merges by distance."""
+    def __init__(self, client: PersistentClient, name: str, embed_fnc):
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+        self.client = client
+        self.name = name
+        self.embed_fnc = embed_fnc
+        self.partitions: dict[str, Collection] = {}
+        self.discover()
+
+    @staticmethod
+    def prefix(name: str) -> str:
+        return f"{name}-"
+
+    def discover(self):
+        """Open the partitions that already exist for this collection."""
+        prefix = self.prefix(self.name)
+        for collection in self.client.list_collections():
+            if collection.name.startswith(prefix):
+                self.partition(collection.name[len(prefix):])
+
+    def partition(self, type_name: str) -> Collection:
+        if type_name not in self.partitions:
+            self.partitions[type_name] = self.client.get_or_create_collection(
+                name=f"{self.prefix(self.name)}{type_name}",
+                embedding_function=self.embed_fnc,
+                metadata={"hnsw:space": "cosine"}
+            )
+        return self.partitions[type_name]
+
+    def count(self) -> int:
+        return sum(partition.count() for partition in self.partitions.values())
+
+    def by_type(self, ids: list[str], metadatas: list[dict], *columns: list) -> dict[str, tuple[list, ...]]:
+        groups = {}
+        for i, meta in enumerate(metadatas):
+            group = groups.setdefault(meta["type"], ([], [], *([] for _ in columns)))
+            group[0].append(ids[i])
+            group[1].append(meta)
+            for column, values in zip(group[2:], columns):
+                column.append(values[i])
+        return groups
+
+    def add(self, ids: list[str], metadatas: list[dict], documents: list[str], embeddings: list = None):
+        for type_name, (type_ids, type_meta, type_docs, type_embeddings) in self.by_type(ids, metadatas, documents, [None] * len(ids) if embeddings is None else embeddings).items():
+            self.partition(type_name).add(ids=type_ids, metadatas=type_meta, documents=type_docs, embeddings=type_embeddings if embeddings is not None else None)
+
+    def upsert(self, ids: list[str], metadatas: list[dict], documents: list[str], embeddings: list = None):
+        for type_name, (type_ids, type_meta, type_docs, type_embeddings) in self.by_type(ids, metadatas, documents, [None] * len(ids) if embeddings is None else embeddings).items():
+            for other_type, partition in self.partitions.items(): # an id whose node changed type must not stay behind in its old partition
+                if other_type != type_name:
+                    partition.delete(ids=type_ids)
+            self.partition(type_name).upsert(ids=type_ids, metadatas=type_meta, documents=type_docs, embeddings=type_embeddings if embeddings is not None else None)
+
+    def delete(self, ids: list[str]):
+        for partition in self.partitions.values():
+            partition.delete(ids=ids)
+
+    def get(self, ids: list[str] = None, limit: int = None, include: list[str] = None) -> dict[str, list]:
+        """Entries across partitions, in partition order (ids order is not preserved)."""
+        include = ["metadatas", "documents"] if include is None else include
+        merged = {"ids": [], **{field: [] for field in include}}
+        for partition in self.partitions.values():
+            if limit is not None and len(merged["ids"]) >= limit:
+                break
+            entries = partition.get(ids=ids, limit=None if limit is None else limit - len(merged["ids"]), include=include)
+            merged["ids"].extend(entries["ids"])
+            for field in include:
+                merged[field].extend(entries[field])
+        return merged
+
+    def query(self, query_embeddings: list, n_results: int = 10, where: dict = None, ids: list[str] = None) -> QueryResult:
+        """Nearest neighbours per query embedding. Only a {"type": {"$in": [...]}} where clause is supported, and it selects partitions."""
+        if where is None:
+            partitions = list(self.partitions.values())
+        elif list(where) == ["type"] and list(where["type"]) == ["$in"]:
+            if any(type_name not in self.partitions for type_name in where["type"]["$in"]):
+                self.discover() # another process may have added a type since these partitions were opened
+            partitions = [self.partitions[type_name] for type_name in where["type"]["$in"] if type_name in self.partitions]
+        else:
+            raise ValueError(f"Partitioned collection {self.name} only supports filtering by type, got {where}")
+
+        def search(partition: Collection) -> QueryResult | None:
+            partition_ids = ids
+            if ids is not None: # Chroma rejects ids the collection doesn't have
+                partition_ids = partition.get(ids=ids, include=[])["ids"]
+                if not partition_ids:
+                    return None
+            return partition.query(query_embeddings=query_embeddings, n_results=n_results, ids=partition_ids, include=["metadatas", "documents", "distances"])
+
+        results = [result for result in (_query_executor.map(search, partitions) if len(partitions) > 1 else map(search, partitions)) if result is not None]
+        merged = {field: [] for field in ["ids", "distances", "metadatas", "documents"]}
+        for row in range(len(query_embeddings)):
+            matches = heapq.nsmallest(n_results, (
+                (result["distances"][row][i], result["ids"][row][i], result["metadatas"][row][i], result["documents"][row][i])
+                for result in results for i in range(len(result["ids"][row]))
+            ), key=lambda match: match[0])
+            merged["distances"].append([match[0] for match in matches])
+            merged["ids"].append([match[1] for match in matches])
+            merged["metadatas"].append([match[2] for match in matches])
+            merged["documents"].append([match[3] for match in matches])
+        return merged
@@ -3,124 +3,435 @@ from dotenv import load_dotenv
 import logging
 import shutil
 import re
+import json
+import time
+import hashlib
+import contextvars
+import threading
+import fcntl
+from contextlib import contextmanager
+from collections import deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
 
-from chromadb import Collection, QueryResult, Documents, PersistentClient
+from chromadb import Collection, QueryResult, Documents, Embeddings, PersistentClient
 from chromadb.utils.embedding_functions import OpenAIEmbeddingFunction, EmbeddingFunction
+from chromadb.errors import NotFoundError
+import numpy as np
 import sqlite3
 
 from ..pkl.skb import SKB
+from .embedding_store import get_embedding_store
+from .partitioned_collection import PartitionedCollection
+from llm import EmbeddingClient
 
 load_dotenv()
 CHROMA_DB_PATH = os.getenv("CHROMA_PATH")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+CHROMA_BATCH_SIZE = int(os.getenv("CHROMA_BATCH_SIZE", 1000)) # nodes per embed/add batch
+CHROMA_EMBED_WORKERS = int(os.getenv("CHROMA_EMBED_WORKERS", 4)) # batches embedded concurrently
+RANGE_SEARCH_CAP = int(os.getenv("RANGE_SEARCH_CAP", 1000)) # most results a range search (k=None) returns per query
+CHROMA_GC_GRACE = float(os.getenv("CHROMA_GC_GRACE", 60)) # seconds a replaced collection version stays readable before it is deleted
+CHROMA_LAYOUT = os.getenv("CHROMA_LAYOUT", "partitioned") # layout of newly built versions: partitioned (a collection per entity type) or single
 
 class Chroma_DB:
-    def __init__(self, collection_name: str, embed_fnc):
+    def __init__(self, collection_name: str, embed_fnc, layout: str = CHROMA_LAYOUT):
         self.logger = logging.getLogger(self.__class__.__name__)
 
+        if layout not in ("single", "partitioned"):
+            raise ValueError(f"Unknown Chroma layout {layout}, expected single or partitioned")
         self.collection_name = collection_name
         self.embed_fnc = embed_fnc
+        self.layout = layout # for the next version parse builds, the loaded one keeps its own
 
         self.client = PersistentClient(path=CHROMA_DB_PATH)
-        self.collection: Collection = None
+        self.store = get_embedding_store()
+        self.collection: Collection | PartitionedCollection = None
+        self.range_stats = {"searches": 0, "expansions": 0, "capped": 0, "seconds": 0.0}
+        self.gc_thread: threading.Thread = None # deletes what the last switch retired
         self.load()
 
     def load(self):
-        """Load existing database collection."""
-        self.collection = self.client.get_or_create_collection(
-            name=self.collection_name,
+        """Load the collection version the alias currently points to."""
+        self.alias_mtime = self.aliases_mtime()
+        self.collection = self.open_version(*self.current_version())
+
+        self.logger.info(f"Collection {self.collection_name} ({self.collection.name}) loaded with size {self.collection.count()}")
+
+    def collection_layout(self) -> str:
+        return "partitioned" if isinstance(self.collection, PartitionedCollection) else "single"
+
+    def refresh(self):
+        """Follow the alias to a newer version if another parse switched it since this collection was loaded."""
+        if self.aliases_mtime() != self.alias_mtime:
+            self.load()
+
+    def open_version(self, name: str, layout: str) -> Collection | PartitionedCollection:
+        if layout == "partitioned":
+            return PartitionedCollection(self.client, name, self.embed_fnc)
+        return self.client.get_or_create_collection(
+            name=name,
             embedding_function=self.embed_fnc,
             metadata={"hnsw:space": "cosine"}
         )
 
-        self.logger.info(f"Collection {self.collection_name} loaded with size {self.collection.count()}")
+    # The alias file maps each collection name to the versioned Chroma collection readers should use:
+    # {name: {"current": "name.v3", "layout": "partitioned", "version": 3, "retired": {"name.v2": unix time replaced}}}
+    # A name without an entry is its own unversioned collection, as written before versioning.
+    @staticmethod
+    def aliases_path() -> str:
+        return os.path.join(CHROMA_DB_PATH, "aliases.json")
 
-    def clear(self):
-        """Remove database collection."""
-        if not self.collection:
-            return
+    def aliases_mtime(self) -> int | None:
+        try:
+            return os.stat(self.aliases_path()).st_mtime_ns
+        except FileNotFoundError:
+            return None
 
-        self.logger.info(f"Deleting existing collection for {self.collection_name}")
-        self.client.delete_collection(self.collection_name)
+    @contextmanager
+    def aliases_lock(self):
+        """Exclusive lock on the alias file for a read-modify-write, held against other threads and processes (load.py, the app, benchmarks)."""
+        os.makedirs(CHROMA_DB_PATH, exist_ok=True)
+        with open(f"{self.aliases_path()}.lock", "a") as lock_file: # every holder opens its own file, so flock also excludes threads
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def read_aliases(self) -> dict[str, dict[str, any]]:
+        try:
+            with open(self.aliases_path(), "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def write_aliases(self, aliases: dict[str, dict[str, any]]):
+        """Replace the alias file atomically, so readers outside the lock always see a complete version. Call under aliases_lock."""
+        tmp_path = f"{self.aliases_path()}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(aliases, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.aliases_path())
+
+    def current_version(self) -> tuple[str, str]:
+        entry = self.read_aliases().get(self.collection_name, {})
+        return entry.get("current", self.collection_name), entry.get("layout", "single")
 
+    def next_version(self) -> str:
+        return f"{self.collection_name}.v{self.read_aliases().get(self.collection_name, {}).get('version', 0) + 1}"
+
+    def switch(self, version: str, layout: str):
+        """Atomically point the alias at a fully built version, retire the previous one and collect it in the background once the grace period is over."""
+        with self.aliases_lock():
+            aliases = self.read_aliases()
+            entry = aliases.setdefault(self.collection_name, {"current": self.collection_name, "version": 0, "retired": {}})
+            if entry["current"] != version:
+                entry["retired"][entry["current"]] = time.time()
+            entry["current"] = version
+            entry["layout"] = layout
+            entry["version"] = int(version.rsplit(".v", 1)[1])
+            self.write_aliases(aliases)
+
+        self.load()
+        self.logger.info(f"Switched {self.collection_name} to {version}, retired versions are deleted after {CHROMA_GC_GRACE:.0f}s")
+        self.gc_thread = threading.Thread(target=self.collect_garbage, kwargs={"wait": True}, daemon=True, name=f"chroma-gc-{self.collection_name}")
+        self.gc_thread.start()
+
+    def wait_for_garbage_collection(self):
+        """Block until the version retired by the last switch is deleted. Short-lived processes call this so the daemon thread isn't killed at exit."""
+        if self.gc_thread is not None:
+            self.logger.info(f"Waiting up to {CHROMA_GC_GRACE:.0f}s to delete the retired {self.collection_name} version")
+            self.gc_thread.join()
+
+    def collect_garbage(self, wait: bool = False, grace: float = CHROMA_GC_GRACE):
+        """Delete retired versions whose grace period is over (waiting for it first if wait), then their segment folders.
+        Retired versions left behind by a process that exited without wait_for_garbage_collection are collected by the next parse or 'load.py <scope> gc'."""
+        if wait:
+            time.sleep(grace)
+
+        with self.aliases_lock():
+            aliases = self.read_aliases()
+            retired = aliases.get(self.collection_name, {}).get("retired", {})
+            expired = [version for version, retired_at in retired.items() if time.time() - retired_at >= grace]
+            for version in expired:
+                self.logger.info(f"Deleting retired collection version {version}")
+                self.drop_version(version)
+                del retired[version]
+            if expired:
+                self.write_aliases(aliases)
+
+        if expired:
+            self.remove_orphan_segments()
+
+    def drop_version(self, version: str):
+        # A version is either one collection or its per-type partitions
+        names = [collection.name for collection in self.client.list_collections() if collection.name.startswith(PartitionedCollection.prefix(version))]
+        for name in [version, *names]:
+            try:
+                self.client.delete_collection(name)
+            except NotFoundError: # already deleted by another process, or partitioned
+                pass
+        self.store.remove_refs(version)
+
+    def remove_orphan_segments(self, vacuum: bool = False):
         # Remove metadata directories (couldn't find built-in functionality)
+        # Folders are listed before the segments are read, so a version created meanwhile is never mistaken for an orphan
+        subfolders = [f.path for f in os.scandir(CHROMA_DB_PATH) if f.is_dir()]
         conn = sqlite3.connect(os.path.join(CHROMA_DB_PATH, f"{os.path.basename(CHROMA_DB_PATH)}.sqlite3"))
         cursor = conn.cursor()
         cursor.execute("select s.id from segments s where s.scope='VECTOR';")
         current_collections = [row[0] for row in cursor]
 
-        subfolders = [f.path for f in os.scandir(CHROMA_DB_PATH) if f.is_dir()]
         for subfolder in subfolders:
             if os.path.basename(subfolder) not in current_collections:
                 self.logger.info(f"Removing metadata subfolder: {subfolder}")
                 shutil.rmtree(subfolder)
 
-        conn.execute("VACUUM")
+        if vacuum: # rewrites the whole database file, so never while Chroma may be writing to it
+            conn.execute("VACUUM")
         conn.close()
 
+    def clear(self):
+        """Remove database collection. Unlike a parse, this empties the collection under any readers."""
+        if not self.collection:
+            return
+
+        self.logger.info(f"Deleting existing collection for {self.collection_name}")
+        with self.aliases_lock():
+            aliases = self.read_aliases()
+            entry = aliases.pop(self.collection_name, {})
+            for version in [self.collection.name, *entry.get("retired", {})]:
+                self.drop_version(version)
+            if entry:
+                self.write_aliases(aliases)
+
+        self.remove_orphan_segments(vacuum=True)
+
         # Re-initialise the collection
         self.load()
 
-    def query(self, query: str, k: int = 25, threshold: float = None, filter_entities: list[str] = None, filter_ids: list[str] = None):
-        """Vector embedding search."""
+    def query(self, query: str, k: int | None = 25, threshold: float = None, filter_entities: list[str] = None, filter_ids: list[str] = None):
+        """Vector embedding search. With k=None, returns every match above threshold (up to RANGE_SEARCH_CAP)."""
+        return self.query_many([query], k, threshold, filter_entities, filter_ids)[0]
+
+    def query_many(self, queries: list[str], k: int | None | list[int | None] = 25, threshold: float | list[float] = None,
+                   filter_entities: list[str] = None, filter_ids: list[str] = None) -> list[list]:
+        """Vector embedding search for several queries with one embedding call and one Chroma query.
+        k and threshold are either shared or given per query; the filters apply to every query.
+        A query with k=None is a range search: n_results doubles until the last match falls below its threshold."""
+        if not queries:
+            return []
+        ks = k if isinstance(k, list) else [k] * len(queries)
+        thresholds = threshold if isinstance(threshold, list) else [threshold] * len(queries)
+        if len(ks) != len(queries) or len(thresholds) != len(queries):
+            raise ValueError(f"Got {len(queries)} queries but {len(ks)} k values and {len(thresholds)} thresholds")
+        if any(k is None and threshold is None for k, threshold in zip(ks, thresholds)):
+            raise ValueError("A range search (k=None) needs a threshold")
+
         params = {}
         if filter_entities:
             params["where"] = {"type": {"$in": filter_entities}}
         if filter_ids:
             params["ids"] = filter_ids
 
-        query_result: QueryResult = self.collection.query(
-            query_texts=[query.strip().lower()],
-            n_results=k,
-            **params
-        )
+        self.refresh()
+        start = time.perf_counter()
+        texts = [query.strip().lower() for query in queries]
+        unique = list(dict.fromkeys(texts))
+        embeddings = dict(zip(unique, self.embed_fnc(unique)))
+        size = self.collection.count()
 
-        results = []
-        for i in range(len(query_result["ids"][0])):
-            # Thresholding is implemented like this because ChromaDB does not provide this functionality
-            similarity = 1 - query_result["distances"][0][i]
-            if threshold and similarity < threshold:
+        # The first request covers every fixed k; range searches that may have more matches are asked again with twice the results
+        matches: dict[str, list] = {}
+        ranges = {text: threshold for text, k, threshold in zip(texts, ks, thresholds) if k is None}
+        n_results = min(max([k for k in ks if k is not None] + [25 if ranges else 0]), size)
+        pending = unique
+        expansions = 0
+        while pending and n_results > 0:
+            query_result: QueryResult = self.collection.query(
+                query_embeddings=[embeddings[text] for text in pending],
+                n_results=n_results,
+                **params
+            )
+            for row, text in enumerate(pending):
+                matches[text] = [
+                    [node_id, meta["type"], document, 1 - distance]
+                    for node_id, meta, document, distance in zip(query_result["ids"][row], query_result["metadatas"][row], query_result["documents"][row], query_result["distances"][row])
+                ]
+            pending = [text for text in pending if text in ranges and len(matches[text]) == n_results and matches[text][-1][3] >= ranges[text]]
+            if pending and n_results < min(RANGE_SEARCH_CAP, size):
+                n_results = min(n_results * 2, RANGE_SEARCH_CAP, size)
+                expansions += 1
+            else:
                 break
 
-            results.append([
-                query_result["ids"][0][i],
-                query_result["metadatas"][0][i]["type"],
-                query_result["documents"][0][i],
-                similarity
-            ])
+        if ranges:
+            elapsed = time.perf_counter() - start
+            self.range_stats["searches"] += len(ranges)
+            self.range_stats["expansions"] += expansions
+            self.range_stats["capped"] += len([text for text in pending if n_results == RANGE_SEARCH_CAP])
+            self.range_stats["seconds"] += elapsed
+            self.logger.info(f"Range search for {len(ranges)} queries took {expansions} expansions up to {n_results} results in {elapsed * 1000:.1f}ms")
 
-        return results
+        all_results = []
+        for text, k, threshold in zip(texts, ks, thresholds):
+            results = []
+            for match in matches.get(text, [])[:k]:
+                # Thresholding is implemented like this because ChromaDB does not provide this functionality
+                if threshold and match[3] < threshold:
+                    break
+                results.append(match)
+            all_results.append(results)
 
-    def parse(self, skb: SKB, max_nodes: int = None, clear_previous: bool = True, only_semantic: bool = False):
-        """Parse SKB content into Chroma database collection."""
-        if clear_previous:
-            self.clear()
+        return all_results
 
-        docs = []
-        docs_meta = []
-        docs_ids = []
-        for i, (node_id, node) in enumerate(skb.get_entities().items()):
-            if max_nodes is not None and i >= max_nodes:
-                break
+    def parse(self, skb: SKB, max_nodes: int = None, clear_previous: bool = True, only_semantic: bool = False,
+              batch_size: int = CHROMA_BATCH_SIZE, workers: int = CHROMA_EMBED_WORKERS):
+        """Parse SKB content into Chroma database collection, in batches embedded concurrently and checkpointed as they are added.
+        With clear_previous, the documents go into a new collection version that replaces the live one only once it is complete,
+        so readers keep querying the previous version throughout. An interrupted parse of the same SKB resumes from its checkpoint."""
+        nodes = skb.get_entities()
+        total = len(nodes) if max_nodes is None else min(max_nodes, len(nodes))
+        batch_size = max(1, min(batch_size, self.client.get_max_batch_size()))
 
-            semantic_fields = node.get_semantic() if only_semantic else node.get_textual()
-            if not semantic_fields:
-                continue
+        self.collect_garbage()
+        fingerprint = self.parse_fingerprint(nodes, total, only_semantic)
+        checkpoint = self.read_checkpoint()
+        position = 0
+        if checkpoint and checkpoint["fingerprint"] == fingerprint:
+            position = checkpoint["next"]
+            layout = checkpoint.get("layout") or self.collection_layout()
+            target = self.open_version(checkpoint.get("collection", self.collection.name), layout)
+            self.logger.info(f"Resuming {self.collection_name} ({target.name}) from node {position}/{total}")
+        elif clear_previous:
+            version = self.next_version()
+            self.drop_version(version) # left behind by an abandoned build
+            layout = self.layout
+            target = self.open_version(version, layout)
+            self.logger.info(f"Building {self.collection_name} into {version} ({layout}) while {self.collection.name} stays live")
+        else:
+            layout = self.collection_layout()
+            target = self.collection
 
-            text = " | ".join(self.preprocess_string(v) for v in semantic_fields.values())
-            meta = {"type": type(node).__name__}
+        def batches():
+            docs, docs_meta, docs_ids = [], [], []
+            for i, (node_id, node) in enumerate(islice(nodes.items(), position, total), position):
+                text = self.node_document(node, only_semantic)
+                if text is not None:
+                    docs.append(text)
+                    docs_meta.append({"type": type(node).__name__})
+                    docs_ids.append(node_id)
+                if len(docs_ids) == batch_size:
+                    yield i + 1, docs, docs_meta, docs_ids
+                    docs, docs_meta, docs_ids = [], [], []
+            yield total, docs, docs_meta, docs_ids
 
-            docs.append(text)
-            docs_meta.append(meta)
-            docs_ids.append(node_id)
+        # Embed up to `workers` batches ahead while adding finished ones in order, so the checkpoint is always a prefix
+        start = time.perf_counter()
+        added = 0
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            for batch in batches():
+                pending.append((batch, executor.submit(contextvars.copy_context().run, self.embed_documents, batch[1], batch[3], target.name) if batch[1] else None))
+                while len(pending) >= workers or (pending and batch[0] == total):
+                    (end, docs, docs_meta, docs_ids), embeddings = pending.popleft()
+                    if docs_ids:
+                        target.add(documents=docs, metadatas=docs_meta, ids=docs_ids, embeddings=embeddings.result())
+                        added += len(docs_ids)
+                    self.write_checkpoint({"fingerprint": fingerprint, "next": end, "collection": target.name, "layout": layout})
 
-        self.collection.add(
-            documents=docs,
-            metadatas=docs_meta,
-            ids=docs_ids
-        )
+                    elapsed = time.perf_counter() - start
+                    self.logger.info(f"{self.collection_name}: {end}/{total} nodes, {added} documents added ({added / elapsed if elapsed else 0:.0f} docs/s)")
+
+        if target.name != self.collection.name:
+            self.switch(target.name, layout)
+        self.remove_checkpoint()
+        elapsed = time.perf_counter() - start
+        self.logger.info(f"Added {added} documents in {elapsed:.1f}s ({added / elapsed if elapsed else 0:.0f} docs/s). New collection size: {self.collection.count()}")
+        stats = self.store.stats()
+        self.logger.info(f"Embedding store: {stats['documents']} documents across collections from {stats['texts']} distinct texts (dedup ratio {stats['dedup_ratio']})")
+
+    def embed_documents(self, docs: list[str], ids: list[str], version: str = None) -> list[np.ndarray]:
+        """Embeddings for preprocessed documents, only calling the embedding function for texts no collection has embedded yet."""
+        namespace = f"{type(self.embed_fnc).__name__}:{getattr(self.embed_fnc, 'model_name', '')}"
+        vectors = self.store.get_many(namespace, docs)
+        missing = [doc for doc in dict.fromkeys(docs) if doc not in vectors]
+        if missing:
+            embedded = getattr(self.embed_fnc, "embed_documents", self.embed_fnc)(missing) # the store is the documents' only cache
+            self.store.put_many(namespace, missing, embedded)
+            vectors.update(zip(missing, embedded))
+        self.store.add_refs(version or self.collection.name, namespace, ids, docs)
+        return [np.asarray(vectors[doc], dtype=np.float32) for doc in docs]
+
+    def parse_fingerprint(self, nodes, total: int, only_semantic: bool) -> str:
+        """Identifies the documents a parse adds, so a checkpoint is only resumed if the same ids would get the same text."""
+        digest = hashlib.sha1(f"{total}|{only_semantic}".encode())
+        for node_id, node in islice(nodes.items(), total):
+            text = self.node_document(node, only_semantic)
+            digest.update(f"{node_id}\x00{chr(1) if text is None else text}\x00".encode()) # chr(1) marks a node without a document
+        return digest.hexdigest()
 
-        self.logger.info(f"New collection size: {self.collection.count()}")
+    def checkpoint_path(self) -> str:
+        return os.path.join(CHROMA_DB_PATH, f"{self.collection_name}.checkpoint.json")
+
+    def read_checkpoint(self) -> dict[str, any] | None:
+        try:
+            with open(self.checkpoint_path(), "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def write_checkpoint(self, checkpoint: dict[str, any]):
+        tmp_path = f"{self.checkpoint_path()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, self.checkpoint_path())
+
+    def remove_checkpoint(self):
+        if os.path.exists(self.checkpoint_path()):
+            os.remove(self.checkpoint_path())
+
+    def node_document(self, node, only_semantic: bool = False) -> str | None:
+        semantic_fields = node.get_semantic() if only_semantic else node.get_textual()
+        if not semantic_fields:
+            return None
+        return " | ".join(self.preprocess_string(v) for v in semantic_fields.values())
+
+    def apply_diff(self, skb: SKB, diff: dict[str, any], only_semantic: bool = False) -> list[str]:
+        """Delete removed nodes and upsert added/changed ones whose document text differs. Returns the upserted ids."""
+        self.refresh()
+        candidates = diff["added"] + diff["changed"]
+        existing = {}
+        if diff["changed"]:
+            stored = self.collection.get(ids=diff["changed"], include=["documents"])
+            existing = dict(zip(stored["ids"], stored["documents"]))
+
+        docs = []
+        docs_meta = []
+        docs_ids = []
+        stale = list(diff["removed"])
+        for node_id in candidates:
+            node = skb.get_entity_by_id(node_id)
+            text = self.node_document(node, only_semantic)
+            if text is None:
+                stale.append(node_id)
+            elif existing.get(node_id) != text: # only new text gets embedded
+                docs.append(text)
+                docs_meta.append({"type": type(node).__name__})
+                docs_ids.append(node_id)
+
+        if stale:
+            self.collection.delete(ids=stale)
+            self.store.remove_refs(self.collection.name, stale)
+        batch_size = self.client.get_max_batch_size()
+        for start in range(0, len(docs_ids), batch_size):
+            self.collection.upsert(documents=docs[start:start + batch_size], metadatas=docs_meta[start:start + batch_size], ids=docs_ids[start:start + batch_size],
+                embeddings=self.embed_documents(docs[start:start + batch_size], docs_ids[start:start + batch_size]))
+
+        self.logger.info(f"Removed {len(stale)} and upserted {len(docs_ids)} documents, collection size: {self.collection.count()}")
+        return docs_ids
 
     def preprocess_string(self, text: str):
         if not text:
@@ -137,3 +448,16 @@ class Te3sEmbeddingFunction(OpenAIEmbeddingFunction):
             api_key=OPENAI_API_KEY,
             model_name="text-embedding-3-small"
         )
+        self.embedding_client = EmbeddingClient(caller="chroma-embed")
+        self.document_client = EmbeddingClient(use_cache=False, caller="chroma-embed") # documents are kept in the EmbeddingStore instead
+        self.client = self.embedding_client.client # drop the parent's private connection pool in favour of the shared one
+
+    def __call__(self, input: Documents) -> Embeddings:
+        # Route through the shared client so query phrases are deduplicated, cached and embedded in concurrent chunks
+        vectors = self.embedding_client.embed_many(list(input), model=self.model_name)
+        return [np.array(vector, dtype=np.float32) for vector in vectors]
+
+    def embed_documents(self, input: Documents) -> Embeddings:
+        """Like __call__ but skipping the phrase cache, so documents don't flood its LRU or get stored twice."""
+        vectors = self.document_client.embed_many(list(input), model=self.model_name)
+        return [np.array(vector, dtype=np.float32) for vector in vectors]
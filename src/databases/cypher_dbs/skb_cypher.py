@@ -0,0 +1,1055 @@
+import logging
+import re
+import math
+import time
+from typing import Iterator
+from functools import cmp_to_key
+from collections import Counter
+
+import numpy as np
+
+from ..pkl.skb import SKB
+from llm import EmbeddingClient
+
+FULLTEXT_THRESHOLD = 1.0 # full-text score IS_FUZZY_MATCH needs when no threshold is given, as in Neo4j_DB.ftsearch
+
+class CypherError(ValueError):
+    """Raised for queries outside the supported Cypher subset or malformed ones."""
+
+TOKEN_PATTERN = re.compile(r"""
+    (?P<space>\s+|//[^\n]*)
+    |(?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+    |(?P<number>\d+\.\d+(?:[eE][-+]?\d+)?|\d+(?:[eE][-+]?\d+)?)
+    |(?P<param>\$\w+)
+    |(?P<ident>[A-Za-z_]\w*|`[^`]+`)
+    |(?P<op>\.\.|<>|<=|>=|=~|!=|->|<-|[-+*/%^=<>(){}\[\],:.|])
+""", re.VERBOSE)
+
+KEYWORDS = {
+    "MATCH", "OPTIONAL", "WHERE", "WITH", "RETURN", "UNION", "ALL", "DISTINCT", "ORDER", "BY", "ASC", "ASCENDING",
+    "DESC", "DESCENDING", "SKIP", "LIMIT", "AND", "OR", "XOR", "NOT", "IN", "CONTAINS", "STARTS", "ENDS", "IS", "NULL",
+    "TRUE", "FALSE", "AS", "CASE", "WHEN", "THEN", "ELSE", "END", "UNWIND",
+}
+AGGREGATES = {"count", "collect", "avg", "sum", "min", "max"}
+
+def tokenize(query: str) -> list[tuple[str, str, int, int]]:
+    tokens = []
+    pos = 0
+    while pos < len(query):
+        match = TOKEN_PATTERN.match(query, pos)
+        if not match:
+            raise CypherError(f"Unexpected character {query[pos]!r} at position {pos}")
+        kind = match.lastgroup
+        value = match.group()
+        if kind == "string":
+            value = re.sub(r"\\(.)", r"\1", value[1:-1])
+        elif kind == "ident" and value.startswith("`"):
+            value = value[1:-1]
+        elif kind == "ident" and value.upper() in KEYWORDS:
+            kind, value = "keyword", value.upper()
+        if kind != "space":
+            tokens.append((kind, value, match.start(), match.end()))
+        pos = match.end()
+    tokens.append(("eof", "", len(query), len(query)))
+    return tokens
+
+class Parser:
+    """Recursive descent parser for the Cypher subset, producing tuple-based clause and expression trees."""
+    def __init__(self, query: str):
+        self.query = query
+        self.tokens = tokenize(query)
+        self.i = 0
+
+    def peek(self, offset: int = 0) -> tuple[str, str, int, int]:
+        return self.tokens[min(self.i + offset, len(self.tokens) - 1)]
+
+    def at(self, *values: str, offset: int = 0) -> bool:
+        kind, value, _, _ = self.peek(offset)
+        return kind in ("keyword", "op") and value in values
+
+    def accept(self, *values: str) -> bool:
+        if self.at(*values):
+            self.i += 1
+            return True
+        return False
+
+    def expect(self, value: str):
+        if not self.accept(value):
+            kind, found, start, _ = self.peek()
+            raise CypherError(f"Expected {value} but found {found or kind} at position {start}")
+
+    def identifier(self) -> str:
+        kind, value, start, _ = self.peek()
+        if kind != "ident" and not (kind == "keyword" and value not in ("WHERE", "RETURN", "WITH", "MATCH")):
+            raise CypherError(f"Expected a name but found {value or kind} at position {start}")
+        self.i += 1
+        return value
+
+    def parse(self) -> list[tuple[list, bool]]:
+        """Returns [(clauses, union_all)] per UNION branch."""
+        branches = [(self.single_query(), False)]
+        while self.accept("UNION"):
+            union_all = self.accept("ALL")
+            branches.append((self.single_query(), union_all))
+        if self.peek()[0] != "eof":
+            _, value, start, _ = self.peek()
+            raise CypherError(f"Unsupported or unexpected {value!r} at position {start}")
+        return branches
+
+    def single_query(self) -> list[tuple]:
+        clauses = []
+        while True:
+            if self.at("MATCH") or (self.at("OPTIONAL") and self.at("MATCH", offset=1)):
+                optional = self.accept("OPTIONAL")
+                self.expect("MATCH")
+                patterns = [self.pattern()]
+                while self.accept(","):
+                    patterns.append(self.pattern())
+                where = self.expression() if self.accept("WHERE") else None
+                clauses.append(("match", patterns, where, optional))
+            elif self.accept("UNWIND"):
+                expr = self.expression()
+                self.expect("AS")
+                clauses.append(("unwind", expr, self.identifier()))
+            elif self.accept("WITH"):
+                projection = self.projection()
+                where = self.expression() if self.accept("WHERE") else None
+                clauses.append(("with", projection, where))
+            elif self.accept("RETURN"):
+                clauses.append(("return", self.projection()))
+                break
+            else:
+                _, value, start, _ = self.peek()
+                raise CypherError(f"Unsupported clause {value!r} at position {start}")
+        return clauses
+
+    def projection(self) -> dict[str, any]:
+        distinct = self.accept("DISTINCT")
+        items = None
+        if not self.accept("*"):
+            items = [self.projection_item()]
+            while self.accept(","):
+                items.append(self.projection_item())
+
+        order = []
+        if self.accept("ORDER"):
+            self.expect("BY")
+            while True:
+                expr = self.expression()
+                descending = False
+                if self.accept("DESC", "DESCENDING"):
+                    descending = True
+                else:
+                    self.accept("ASC", "ASCENDING")
+                order.append((expr, descending))
+                if not self.accept(","):
+                    break
+        skip = self.expression() if self.accept("SKIP") else None
+        limit = self.expression() if self.accept("LIMIT") else None
+        return {"distinct": distinct, "items": items, "order": order, "skip": skip, "limit": limit}
+
+    def projection_item(self) -> tuple[tuple, str]:
+        expr = self.expression()
+        if self.accept("AS"):
+            return expr, self.identifier()
+        return expr, expr[-1] # column named by its source text, as Neo4j does
+
+    def pattern(self) -> list[tuple]:
+        elements = [self.node_pattern()]
+        while self.at("-", "<-"):
+            elements.append(self.relationship_pattern())
+            elements.append(self.node_pattern())
+        return elements
+
+    def node_pattern(self) -> tuple:
+        self.expect("(")
+        var = None
+        if self.peek()[0] == "ident":
+            var = self.identifier()
+        labels = []
+        while self.accept(":"):
+            labels.append(self.identifier())
+        props = self.map_literal() if self.at("{") else {}
+        self.expect(")")
+        return ("node", var, labels, props)
+
+    def relationship_pattern(self) -> tuple:
+        incoming = self.accept("<-")
+        if not incoming:
+            self.expect("-")
+        var = None
+        types = []
+        length = None
+        props = {}
+        if self.accept("["):
+            if self.peek()[0] == "ident":
+                var = self.identifier()
+            if self.accept(":"):
+                types.append(self.identifier())
+                while self.accept("|"):
+                    self.accept(":")
+                    types.append(self.identifier())
+            if self.accept("*"):
+                low, high = 1, None
+                if self.peek()[0] == "number":
+                    low = high = int(self.peek()[1])
+                    self.i += 1
+                if self.accept(".."):
+                    high = None
+                    if self.peek()[0] == "number":
+                        high = int(self.peek()[1])
+                        self.i += 1
+                length = (low, high)
+            if self.at("{"):
+                props = self.map_literal()
+            self.expect("]")
+        outgoing = self.accept("->")
+        if not outgoing:
+            self.expect("-")
+        if incoming and outgoing:
+            raise CypherError("Relationship can't point both ways")
+        direction = "in" if incoming else "out" if outgoing else "both"
+        return ("rel", var, [t.lower() for t in types], direction, length, props)
+
+    def map_literal(self) -> dict[str, tuple]:
+        self.expect("{")
+        values = {}
+        if not self.at("}"):
+            while True:
+                key = self.identifier()
+                self.expect(":")
+                values[key] = self.expression()
+                if not self.accept(","):
+                    break
+        self.expect("}")
+        return values
+
+    # Expressions, lowest precedence first. Every node ends with its source text.
+    def spanned(self, start: int, node: tuple) -> tuple:
+        end = self.tokens[self.i - 1][3]
+        return (*node, self.query[start:end].strip())
+
+    def expression(self) -> tuple:
+        return self.binary_level(0)
+
+    LEVELS = [("OR",), ("XOR",), ("AND",)]
+
+    def binary_level(self, level: int) -> tuple:
+        if level == len(self.LEVELS):
+            return self.not_expression()
+        start = self.peek()[2]
+        left = self.binary_level(level + 1)
+        while self.at(*self.LEVELS[level]):
+            op = self.peek()[1].lower()
+            self.i += 1
+            right = self.binary_level(level + 1)
+            left = self.spanned(start, ("bin", op, left, right))
+        return left
+
+    def not_expression(self) -> tuple:
+        start = self.peek()[2]
+        if self.accept("NOT"):
+            return self.spanned(start, ("unary", "not", self.not_expression()))
+        return self.comparison()
+
+    def comparison(self) -> tuple:
+        start = self.peek()[2]
+        left = self.additive()
+        while True:
+            if self.at("=", "<>", "!=", "<", ">", "<=", ">=", "=~"):
+                op = self.peek()[1]
+                self.i += 1
+                left = self.spanned(start, ("bin", "<>" if op == "!=" else op, left, self.additive()))
+            elif self.accept("IN"):
+                left = self.spanned(start, ("bin", "in", left, self.additive()))
+            elif self.accept("CONTAINS"):
+                left = self.spanned(start, ("bin", "contains", left, self.additive()))
+            elif self.at("STARTS", "ENDS"):
+                op = self.peek()[1].lower()
+                self.i += 1
+                self.expect("WITH")
+                left = self.spanned(start, ("bin", op, left, self.additive()))
+            elif self.accept("IS"):
+                negate = self.accept("NOT")
+                self.expect("NULL")
+                left = self.spanned(start, ("isnull", left, negate))
+            else:
+                return left
+
+    def additive(self) -> tuple:
+        start = self.peek()[2]
+        left = self.multiplicative()
+        while self.at("+", "-"):
+            op = self.peek()[1]
+            self.i += 1
+            left = self.spanned(start, ("bin", op, left, self.multiplicative()))
+        return left
+
+    def multiplicative(self) -> tuple:
+        start = self.peek()[2]
+        left = self.power()
+        while self.at("*", "/", "%"):
+            op = self.peek()[1]
+            self.i += 1
+            left = self.spanned(start, ("bin", op, left, self.power()))
+        return left
+
+    def power(self) -> tuple:
+        start = self.peek()[2]
+        left = self.unary()
+        if self.accept("^"):
+            left = self.spanned(start, ("bin", "^", left, self.power()))
+        return left
+
+    def unary(self) -> tuple:
+        start = self.peek()[2]
+        if self.accept("-"):
+            return self.spanned(start, ("unary", "-", self.unary()))
+        self.accept("+")
+        return self.postfix()
+
+    def postfix(self) -> tuple:
+        start = self.peek()[2]
+        expr = self.atom()
+        while True:
+            if self.accept("."):
+                expr = self.spanned(start, ("prop", expr, self.identifier()))
+            elif self.accept("["):
+                low = None if self.at("..") else self.expression()
+                if self.accept(".."):
+                    high = None if self.at("]") else self.expression()
+                    self.expect("]")
+                    expr = self.spanned(start, ("slice", expr, low, high))
+                else:
+                    self.expect("]")
+                    expr = self.spanned(start, ("index", expr, low))
+            else:
+                return expr
+
+    def atom(self) -> tuple:
+        kind, value, start, _ = self.peek()
+        if kind == "number":
+            self.i += 1
+            return self.spanned(start, ("lit", float(value) if any(c in value for c in ".eE") else int(value)))
+        if kind == "string":
+            self.i += 1
+            return self.spanned(start, ("lit", value))
+        if kind == "param":
+            self.i += 1
+            return self.spanned(start, ("param", value[1:]))
+        if self.accept("TRUE", "FALSE"):
+            return self.spanned(start, ("lit", value == "TRUE"))
+        if self.accept("NULL"):
+            return self.spanned(start, ("lit", None))
+        if self.accept("("):
+            expr = self.expression()
+            self.expect(")")
+            return self.spanned(start, expr[:-1])
+        if self.accept("["):
+            items = []
+            if not self.at("]"):
+                items.append(self.expression())
+                while self.accept(","):
+                    items.append(self.expression())
+            self.expect("]")
+            return self.spanned(start, ("list", items))
+        if self.accept("CASE"):
+            return self.case_expression(start)
+        if kind == "ident":
+            self.i += 1
+            if self.accept("("):
+                return self.call(value, start)
+            return self.spanned(start, ("var", value))
+        raise CypherError(f"Unexpected {value or kind} at position {start}")
+
+    def call(self, name: str, start: int) -> tuple:
+        name = name.lower()
+        distinct = self.accept("DISTINCT")
+        args = []
+        if self.accept("*"):
+            args.append(("star", "*"))
+        elif not self.at(")"):
+            args.append(self.expression())
+            while self.accept(","):
+                args.append(self.expression())
+        self.expect(")")
+        return self.spanned(start, ("call", name, args, distinct))
+
+    def case_expression(self, start: int) -> tuple:
+        subject = None if self.at("WHEN") else self.expression()
+        branches = []
+        while self.accept("WHEN"):
+            condition = self.expression()
+            self.expect("THEN")
+            branches.append((condition, self.expression()))
+        default = self.expression() if self.accept("ELSE") else None
+        self.expect("END")
+        return self.spanned(start, ("case", subject, branches, default))
+
+class Node:
+    """A bound node variable: position in the SKB adjacency index."""
+    __slots__ = ("pos",)
+
+    def __init__(self, pos: int):
+        self.pos = pos
+
+    def __eq__(self, other):
+        return isinstance(other, Node) and other.pos == self.pos
+
+    def __hash__(self):
+        return hash(("node", self.pos))
+
+class Relationship:
+    __slots__ = ("source", "type", "target")
+
+    def __init__(self, source: int, type: str, target: int):
+        self.source, self.type, self.target = source, type, target
+
+    def __eq__(self, other):
+        return isinstance(other, Relationship) and (other.source, other.type, other.target) == (self.source, self.type, self.target)
+
+    def __hash__(self):
+        return hash((self.source, self.type, self.target))
+
+def calls(tree) -> Iterator[tuple]:
+    """Every function call node anywhere in a parsed clause, expression or pattern."""
+    if isinstance(tree, tuple):
+        if tree and tree[0] == "call":
+            yield tree
+        for part in tree:
+            yield from calls(part)
+    elif isinstance(tree, list):
+        for part in tree:
+            yield from calls(part)
+    elif isinstance(tree, dict):
+        for part in tree.values():
+            yield from calls(part)
+
+def contains_aggregate(expr: tuple) -> bool:
+    return any(call[1] in AGGREGATES for call in calls(expr))
+
+def hashable(value):
+    if isinstance(value, list):
+        return tuple(hashable(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, hashable(v)) for k, v in value.items()))
+    return value
+
+def compare_values(a, b) -> int:
+    # Cypher ordering: nulls last, numbers before strings, otherwise natural order
+    if a is None or b is None:
+        return (a is None) - (b is None)
+    rank = lambda v: 0 if isinstance(v, (int, float)) and not isinstance(v, bool) else 1 if isinstance(v, str) else 2
+    if rank(a) != rank(b):
+        return rank(a) - rank(b)
+    try:
+        return (a > b) - (a < b)
+    except TypeError:
+        return (str(a) > str(b)) - (str(a) < str(b))
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+def unit_vector(vector: list[float]) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    return vector / (np.linalg.norm(vector) or 1.0)
+
+def words(text: str) -> list[str]:
+    return re.findall(r"\w+", text.replace("-", " ").lower())
+
+class FullTextIndex:
+    """BM25 scores over node names/descriptions, approximating Neo4j's 'names' full-text index queried with fuzzy terms (term~),
+    so the scopes' FUZZY_THRESHOLD values mean the same on both backends."""
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self, texts: list[str]):
+        docs = [words(text) for text in texts]
+        self.count = len(docs)
+        self.avgdl = sum(len(doc) for doc in docs) / len(docs) if docs else 1.0
+        self.df = Counter(word for doc in docs for word in set(doc))
+
+    def score(self, search: str, text: str) -> float:
+        """Sum over search terms of the best BM25 score of a word within 2 edits, boosted by 1 - edits / shorter length like Lucene's FuzzyQuery."""
+        terms = words(search)
+        doc = words(text) if text else []
+        if not terms or not doc:
+            return 0.0
+        tfs = Counter(doc)
+        norm = self.k1 * (1 - self.b + self.b * len(doc) / self.avgdl)
+        total = 0.0
+        for term in terms:
+            best = 0.0
+            for word, tf in tfs.items():
+                edits = 0 if word == term else edit_distance(term, word, 2)
+                boost = 1 - edits / min(len(term), len(word))
+                if edits > 2 or boost <= 0:
+                    continue
+                df = self.df.get(word, 0)
+                idf = math.log(1 + (self.count - df + 0.5) / (df + 0.5))
+                best = max(best, boost * idf * tf / (tf + norm))
+            total += best
+        return total
+
+class SKBCypher_DB:
+    """In-process executor for the Cypher subset the retrieval prompts produce, over an SKB's adjacency index."""
+    extended_functions = True # evaluates IS_SEMANTIC_MATCH / IS_FUZZY_MATCH itself
+
+    def __init__(self, skb: SKB, chroma=None, embedding_client=None, semantic_threshold: float = 0.65, fuzzy_threshold: float = FULLTEXT_THRESHOLD):
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+        self.skb = skb
+        self.adjacency = skb.adjacency
+        self.chroma = chroma
+        self.embedding_client = embedding_client or EmbeddingClient(caller="semantic-match")
+        self.semantic_threshold = semantic_threshold
+        self.fuzzy_threshold = fuzzy_threshold
+
+        self.nodes = [skb.get_entity_by_id(node_id) for node_id in self.adjacency.ids[:len(skb.get_entities())]]
+        self.labels: dict[str, list[int]] = {}
+        for pos, node in enumerate(self.nodes):
+            self.labels.setdefault(type(node).__name__, []).append(pos)
+
+        self.node_vectors: np.ndarray = None # unit-normalised Chroma embeddings by node position, loaded on first semantic match
+        self.has_vector: np.ndarray = None # False for nodes with no text to embed
+        self.fulltext: FullTextIndex = None # term statistics over node names/descriptions, built on first fuzzy match
+        self.parsed: dict[str, list] = {}
+
+    def load_node_vectors(self):
+        if self.chroma is None:
+            raise CypherError("IS_SEMANTIC_MATCH needs node embeddings, but no Chroma collection was given")
+        entries = self.chroma.collection.get(include=["embeddings"])
+        rows = [(pos, embedding) for node_id, embedding in zip(entries["ids"], entries["embeddings"])
+            if (pos := self.adjacency.positions.get(node_id)) is not None and pos < len(self.nodes)]
+        dim = len(rows[0][1]) if rows else 0
+        self.node_vectors = np.zeros((len(self.nodes), dim), dtype=np.float32)
+        self.has_vector = np.zeros(len(self.nodes), dtype=bool)
+        for pos, embedding in rows:
+            self.node_vectors[pos] = unit_vector(embedding)
+            self.has_vector[pos] = True
+
+    def fulltext_index(self) -> FullTextIndex:
+        if self.fulltext is None:
+            self.fulltext = FullTextIndex([text for _, text in self.indexed_texts()])
+        return self.fulltext
+
+    def indexed_texts(self) -> Iterator[tuple[any, str]]:
+        """SKB nodes with the text the full-text index holds for them, as COALESCE(node.name, node.description) in Neo4j_DB.ftsearch."""
+        for node in self.nodes:
+            text = getattr(node, "name", None) or getattr(node, "description", None)
+            if isinstance(text, str):
+                yield node, text
+
+    def query(self, query: str, filter_ids: list[str] = None, other_params: dict[str, any] = None,
+              semantic_threshold: float = None, fuzzy_threshold: float = None, allow_semantic: bool = True, allow_fuzzy: bool = True) -> list[dict[str, any]]:
+        """allow_semantic/allow_fuzzy mirror which extended functions a scope rewrites for Neo4j; a disabled one fails as an unknown function there."""
+        start = time.perf_counter()
+        if query not in self.parsed:
+            self.parsed[query] = Parser(query).parse()
+        branches = self.parsed[query]
+        disabled = {name for name, allowed in (("is_semantic_match", allow_semantic), ("is_fuzzy_match", allow_fuzzy)) if not allowed}
+        for call in calls(branches):
+            if call[1] in disabled:
+                raise CypherError(f"Unknown function '{call[4].split('(')[0].strip()}'")
+
+        params = {**({"ids": filter_ids} if filter_ids else {}), **(other_params or {})}
+        context = {
+            "params": params,
+            "semantic_threshold": self.semantic_threshold if semantic_threshold is None else semantic_threshold,
+            "fuzzy_threshold": self.fuzzy_threshold if fuzzy_threshold is None else fuzzy_threshold,
+            "phrase_scores": self.embed_phrases(branches),
+        }
+
+        results = None
+        columns = None
+        for clauses, union_all in branches:
+            rows = self.run_clauses(clauses, context)
+            if results is None:
+                results, columns = rows, list(rows[0]) if rows else None
+                distinct_union = False
+                continue
+            if rows and columns is not None and list(rows[0]) != columns:
+                raise CypherError("All sub queries in an UNION must have the same return column names")
+            columns = columns or (list(rows[0]) if rows else None)
+            results += rows
+            distinct_union = distinct_union or not union_all
+        if len(branches) > 1 and distinct_union:
+            seen = set()
+            results = [row for row in results if not (key := hashable(row)) in seen and not seen.add(key)]
+
+        self.logger.debug(f"Local Cypher returned {len(results)} records in {(time.perf_counter() - start) * 1000:.2f}ms")
+        return results
+
+    def embed_phrases(self, branches: list) -> dict[str, np.ndarray]:
+        # Every IS_SEMANTIC_MATCH phrase in the query is embedded in one batched request and scored against every node at once.
+        # vector.similarity.cosine in the Neo4j rewrite is normalised to (1 + cosine) / 2, and the scope thresholds are on that scale
+        phrases = [str(call[2][1][1]).strip().lower()
+            for clauses, _ in branches
+            for call in calls(clauses)
+            if call[1] == "is_semantic_match" and len(call[2]) == 2 and call[2][1][0] == "lit"]
+        phrases = list(dict.fromkeys(phrases))
+        if not phrases:
+            return {}
+        if self.node_vectors is None:
+            self.load_node_vectors()
+        phrase_vectors = np.stack([unit_vector(vector) for vector in self.embedding_client.embed_many(phrases)])
+        scores = (1 + self.node_vectors @ phrase_vectors.T) / 2
+        return {phrase: scores[:, i] for i, phrase in enumerate(phrases)}
+
+    def run_clauses(self, clauses: list[tuple], context: dict[str, any]) -> list[dict[str, any]]:
+        rows = [{}]
+        for clause in clauses:
+            match clause[0]:
+                case "match":
+                    _, patterns, where, optional = clause
+                    rows = self.run_match(rows, patterns, where, optional, context)
+                case "unwind":
+                    _, expr, var = clause
+                    rows = [{**row, var: item} for row in rows for item in (self.evaluate(expr, row, context) or [])]
+                case "with":
+                    _, projection, where = clause
+                    rows = self.project(rows, projection, context)
+                    if where is not None:
+                        rows = [row for row in rows if self.evaluate(where, row, context) is True]
+                case "return":
+                    rows = self.project(rows, clause[1], context)
+                    return [{column: self.output(value) for column, value in row.items()} for row in rows]
+        raise CypherError("Query must end with RETURN")
+
+    # MATCH
+
+    def run_match(self, rows: list[dict], patterns: list[list[tuple]], where: tuple, optional: bool, context: dict[str, any]) -> list[dict]:
+        matched_rows = []
+        for row in rows:
+            matches = [row]
+            for pattern in patterns:
+                matches = [extended for partial in matches for extended in self.match_pattern(partial, pattern, context)]
+            if where is not None:
+                matches = [match for match in matches if self.evaluate(where, match, context) is True]
+            if not matches and optional:
+                new_vars = {element[1] for pattern in patterns for element in pattern if element[1]}
+                matches = [{**row, **{var: None for var in new_vars if var not in row}}]
+            matched_rows.extend(matches)
+        return matched_rows
+
+    def node_candidates(self, spec: tuple, row: dict) -> list[int]:
+        _, var, labels, _ = spec
+        if var and var in row:
+            bound = row[var]
+            return [bound.pos] if isinstance(bound, Node) else []
+        if labels:
+            return self.labels.get(labels[0], [])
+        return range(len(self.nodes))
+
+    def node_fits(self, pos: int, spec: tuple, row: dict, context: dict[str, any]) -> bool:
+        _, var, labels, props = spec
+        if var and var in row and row[var] != Node(pos):
+            return False
+        node = self.nodes[pos]
+        if any(type(node).__name__ != label for label in labels):
+            return False
+        return all(self.property(Node(pos), key) == self.evaluate(expr, row, context) for key, expr in props.items())
+
+    def match_pattern(self, row: dict, pattern: list[tuple], context: dict[str, any]) -> list[dict]:
+        # Anchor on a bound node if there is one, else the node spec with the fewest candidates, and expand both ways
+        node_indices = range(0, len(pattern), 2)
+        anchor = next((i for i in node_indices if pattern[i][1] and pattern[i][1] in row),
+            min(node_indices, key=lambda i: len(self.node_candidates(pattern[i], row))))
+        right = pattern[anchor:]
+        left = [self.flip(element) for element in reversed(pattern[:anchor + 1])]
+
+        results = []
+        for start in self.node_candidates(pattern[anchor], row):
+            if not self.node_fits(start, pattern[anchor], row, context):
+                continue
+            bound = {**row, pattern[anchor][1]: Node(start)} if pattern[anchor][1] else dict(row)
+            for right_row in self.expand(bound, start, right, 1, context):
+                results.extend(self.expand(right_row, start, left, 1, context))
+        return results
+
+    def flip(self, element: tuple) -> tuple:
+        if element[0] != "rel":
+            return element
+        kind, var, types, direction, length, props = element
+        return (kind, var, types, {"in": "out", "out": "in"}.get(direction, direction), length, props)
+
+    def expand(self, row: dict, current: int, chain: list[tuple], index: int, context: dict[str, any]):
+        if index >= len(chain):
+            yield row
+            return
+        rel, node_spec = chain[index], chain[index + 1]
+        _, rel_var, types, direction, length, rel_props = rel
+        for target, relationships in self.traverse(current, types, direction, length):
+            if not self.node_fits(target, node_spec, row, context):
+                continue
+            if rel_props: # SKB relationships carry no properties
+                continue
+            next_row = dict(row)
+            if node_spec[1]:
+                next_row[node_spec[1]] = Node(target)
+            if rel_var:
+                value = relationships if length else relationships[0]
+                if rel_var in row and row[rel_var] != value:
+                    continue
+                next_row[rel_var] = value
+            yield from self.expand(next_row, target, chain, index + 2, context)
+
+    def steps(self, pos: int, types: list[str], direction: str):
+        relation_types = types or list(self.adjacency.forward)
+        for rel_type in relation_types:
+            if rel_type not in self.adjacency.forward:
+                continue
+            if direction in ("out", "both"):
+                indptr, indices = self.adjacency.forward[rel_type]
+                for target in indices[indptr[pos]:indptr[pos + 1]]:
+                    yield target, Relationship(pos, rel_type, target)
+            if direction in ("in", "both"):
+                indptr, indices = self.adjacency.reverse[rel_type]
+                for source in indices[indptr[pos]:indptr[pos + 1]]:
+                    yield source, Relationship(source, rel_type, pos)
+
+    def traverse(self, pos: int, types: list[str], direction: str, length: tuple[int, int] | None):
+        if length is None:
+            for target, relationship in self.steps(pos, types, direction):
+                yield target, [relationship]
+            return
+        low, high = length
+        # Variable length: depth-first over paths without repeating relationships
+        stack = [(pos, [])]
+        while stack:
+            current, path = stack.pop()
+            if len(path) >= low and path:
+                yield current, path
+            if high is not None and len(path) >= high:
+                continue
+            for target, relationship in self.steps(current, types, direction):
+                if relationship not in path:
+                    stack.append((target, path + [relationship]))
+        if low == 0:
+            yield pos, []
+
+    # Projection (WITH / RETURN)
+
+    def project(self, rows: list[dict], projection: dict[str, any], context: dict[str, any]) -> list[dict]:
+        items = projection["items"]
+        if items is None: # WITH * / RETURN *
+            projected = [(dict(row), row) for row in rows]
+        elif any(contains_aggregate(expr) for expr, _ in items):
+            groups: dict[tuple, list[dict]] = {}
+            keys = [(expr, column) for expr, column in items if not contains_aggregate(expr)]
+            for row in rows:
+                groups.setdefault(tuple(hashable(self.evaluate(expr, row, context)) for expr, _ in keys), []).append(row)
+            if not groups and not keys: # aggregating over no rows still returns one row
+                groups[()] = []
+            projected = []
+            for group_rows in groups.values():
+                first = group_rows[0] if group_rows else {}
+                out = {column: self.evaluate(expr, first, context, group_rows) for expr, column in items}
+                projected.append((out, first))
+        else:
+            projected = [({column: self.evaluate(expr, row, context) for expr, column in items}, row) for row in rows]
+
+        if projection["distinct"]:
+            seen = set()
+            projected = [(out, row) for out, row in projected if not (key := hashable(out)) in seen and not seen.add(key)]
+
+        if projection["order"]:
+            def sort_key(entry):
+                out, row = entry
+                scope = {**row, **out}
+                return [out[expr[-1]] if expr[-1] in out else self.evaluate(expr, scope, context) for expr, _ in projection["order"]]
+            keyed = [(sort_key(entry), entry) for entry in projected]
+            def compare(a, b):
+                for (expr, descending), x, y in zip(projection["order"], a[0], b[0]):
+                    result = compare_values(x, y)
+                    if result:
+                        if descending and (x is None) == (y is None):
+                            result = -result
+                        return result
+                return 0
+            keyed.sort(key=cmp_to_key(compare))
+            projected = [entry for _, entry in keyed]
+
+        skip = self.evaluate(projection["skip"], {}, context) if projection["skip"] is not None else 0
+        limit = self.evaluate(projection["limit"], {}, context) if projection["limit"] is not None else None
+        projected = projected[int(skip):] if limit is None else projected[int(skip):int(skip) + int(limit)]
+        return [out for out, _ in projected]
+
+    # Expressions
+
+    def property(self, value, key: str):
+        if value is None:
+            return None
+        if isinstance(value, Node):
+            if key == "external_id":
+                return self.adjacency.ids[value.pos]
+            node = self.nodes[value.pos]
+            return getattr(node, key) if key in node.prop_fields else None
+        if isinstance(value, dict):
+            return value.get(key)
+        raise CypherError(f"Can't read property {key} of {type(value).__name__}")
+
+    def output(self, value):
+        # Mirror neo4j's record.data(): nodes become property maps
+        if isinstance(value, Node):
+            return {**self.nodes[value.pos].get_props(), "external_id": self.adjacency.ids[value.pos]}
+        if isinstance(value, Relationship):
+            return (self.output(Node(value.source)), value.type.upper(), self.output(Node(value.target)))
+        if isinstance(value, list):
+            return [self.output(item) for item in value]
+        return value
+
+    def evaluate(self, expr: tuple, row: dict, context: dict[str, any], group: list[dict] = None):
+        kind = expr[0]
+        match kind:
+            case "lit":
+                return expr[1]
+            case "param":
+                if expr[1] not in context["params"]:
+                    raise CypherError(f"Missing parameter ${expr[1]}")
+                return context["params"][expr[1]]
+            case "var":
+                if expr[1] not in row:
+                    raise CypherError(f"Variable {expr[1]} not defined")
+                return row[expr[1]]
+            case "prop":
+                return self.property(self.evaluate(expr[1], row, context, group), expr[2])
+            case "index":
+                value = self.evaluate(expr[1], row, context, group)
+                index = self.evaluate(expr[2], row, context, group)
+                if value is None or index is None:
+                    return None
+                try:
+                    return value[index]
+                except (IndexError, KeyError):
+                    return None
+            case "slice":
+                value = self.evaluate(expr[1], row, context, group)
+                low = self.evaluate(expr[2], row, context, group) if expr[2] is not None else None
+                high = self.evaluate(expr[3], row, context, group) if expr[3] is not None else None
+                return None if value is None else value[low:high]
+            case "list":
+                return [self.evaluate(item, row, context, group) for item in expr[1]]
+            case "unary":
+                value = self.evaluate(expr[2], row, context, group)
+                if expr[1] == "not":
+                    return None if value is None else not value
+                return None if value is None else -value
+            case "isnull":
+                value = self.evaluate(expr[1], row, context, group)
+                return (value is not None) if expr[2] else (value is None)
+            case "case":
+                return self.evaluate_case(expr, row, context, group)
+            case "bin":
+                return self.evaluate_binary(expr, row, context, group)
+            case "call":
+                return self.evaluate_call(expr, row, context, group)
+        raise CypherError(f"Unsupported expression {expr[-1]}")
+
+    def evaluate_case(self, expr: tuple, row: dict, context: dict[str, any], group: list[dict]):
+        _, subject, branches, default, _ = expr
+        subject_value = self.evaluate(subject, row, context, group) if subject is not None else None
+        for condition, result in branches:
+            value = self.evaluate(condition, row, context, group)
+            if (subject is not None and value == subject_value) or (subject is None and value is True):
+                return self.evaluate(result, row, context, group)
+        return self.evaluate(default, row, context, group) if default is not None else None
+
+    def evaluate_binary(self, expr: tuple, row: dict, context: dict[str, any], group: list[dict]):
+        _, op, left_expr, right_expr, _ = expr
+        left = self.evaluate(left_expr, row, context, group)
+        if op in ("and", "or", "xor"):
+            right = self.evaluate(right_expr, row, context, group)
+            if op == "and":
+                return False if left is False or right is False else None if left is None or right is None else True
+            if op == "or":
+                return True if left is True or right is True else None if left is None or right is None else False
+            return None if left is None or right is None else bool(left) != bool(right)
+
+        right = self.evaluate(right_expr, row, context, group)
+        if op == "in":
+            if right is None:
+                return None
+            return left in right if left is not None else None
+        if left is None or right is None:
+            return None
+        match op:
+            case "=":
+                return left == right
+            case "<>":
+                return left != right
+            case "<" | ">" | "<=" | ">=":
+                try:
+                    return {"<": left < right, ">": left > right, "<=": left <= right, ">=": left >= right}[op]
+                except TypeError:
+                    return None
+            case "contains":
+                return str(right) in str(left)
+            case "starts":
+                return str(left).startswith(str(right))
+            case "ends":
+                return str(left).endswith(str(right))
+            case "=~":
+                return re.fullmatch(str(right), str(left)) is not None
+            case "+":
+                if isinstance(left, list) or isinstance(right, list):
+                    return (left if isinstance(left, list) else [left]) + (right if isinstance(right, list) else [right])
+                if isinstance(left, str) or isinstance(right, str):
+                    return f"{left}{right}"
+                return left + right
+            case "-":
+                return left - right
+            case "*":
+                return left * right
+            case "/":
+                if isinstance(left, int) and isinstance(right, int):
+                    return int(left / right) if right else None
+                return left / right if right else None
+            case "%":
+                return left % right if right else None
+            case "^":
+                return float(left) ** float(right)
+        raise CypherError(f"Unsupported operator {op}")
+
+    def evaluate_call(self, expr: tuple, row: dict, context: dict[str, any], group: list[dict]):
+        _, name, args, distinct, source = expr
+        if name in AGGREGATES:
+            if group is None:
+                raise CypherError(f"Aggregate {source} used outside RETURN/WITH")
+            return self.aggregate(name, args, distinct, group, context)
+
+        if name == "is_semantic_match":
+            return self.semantic_match(args, row, context, group)
+        values = [self.evaluate(arg, row, context, group) for arg in args]
+        if name == "is_fuzzy_match":
+            text, search = values
+            return self.fulltext_index().score(str(search), text) > context["fuzzy_threshold"] if isinstance(text, str) else False
+        if name == "coalesce":
+            return next((value for value in values if value is not None), None)
+        if any(value is None for value in values[:1]) and name not in ("labels", "type"):
+            return None
+
+        match name:
+            case "tolower" | "lower":
+                return str(values[0]).lower()
+            case "toupper" | "upper":
+                return str(values[0]).upper()
+            case "trim":
+                return str(values[0]).strip()
+            case "ltrim":
+                return str(values[0]).lstrip()
+            case "rtrim":
+                return str(values[0]).rstrip()
+            case "tostring":
+                return str(values[0]).lower() if isinstance(values[0], bool) else str(values[0])
+            case "tointeger" | "toint":
+                try:
+                    return int(float(values[0]))
+                except (TypeError, ValueError):
+                    return None
+            case "tofloat":
+                try:
+                    return float(values[0])
+                except (TypeError, ValueError):
+                    return None
+            case "size" | "length":
+                return len(values[0])
+            case "abs":
+                return abs(values[0])
+            case "round":
+                if len(values) > 1:
+                    return round(values[0], int(values[1]))
+                return float(math.floor(values[0] + 0.5))
+            case "ceil":
+                return float(math.ceil(values[0]))
+            case "floor":
+                return float(math.floor(values[0]))
+            case "sqrt":
+                return math.sqrt(values[0])
+            case "substring":
+                start = int(values[1])
+                return values[0][start:] if len(values) < 3 else values[0][start:start + int(values[2])]
+            case "left":
+                return values[0][:int(values[1])]
+            case "right":
+                return values[0][-int(values[1]):] if int(values[1]) else ""
+            case "replace":
+                return str(values[0]).replace(str(values[1]), str(values[2]))
+            case "split":
+                return str(values[0]).split(str(values[1]))
+            case "reverse":
+                return values[0][::-1]
+            case "head":
+                return values[0][0] if values[0] else None
+            case "last":
+                return values[0][-1] if values[0] else None
+            case "labels":
+                return [type(self.nodes[values[0].pos]).__name__] if isinstance(values[0], Node) else None
+            case "type":
+                return values[0].type.upper() if isinstance(values[0], Relationship) else None
+            case "id" | "elementid":
+                return self.adjacency.ids[values[0].pos] if isinstance(values[0], Node) else None
+            case "keys":
+                return list(self.output(values[0]).keys()) if isinstance(values[0], Node) else list(values[0])
+            case "properties":
+                return self.output(values[0]) if isinstance(values[0], Node) else values[0]
+            case "exists":
+                return values[0] is not None
+        raise CypherError(f"Unsupported function {name}")
+
+    def semantic_match(self, args: list[tuple], row: dict, context: dict[str, any], group: list[dict]) -> bool:
+        # Like the Neo4j rewrite, compares the phrase against the embedding of the node that owns the property
+        if len(args) != 2 or args[1][0] != "lit":
+            raise CypherError("IS_SEMANTIC_MATCH expects a property and a string literal")
+        target = args[0]
+        while target[0] == "prop":
+            target = target[1]
+        node = self.evaluate(target, row, context, group)
+        if not isinstance(node, Node):
+            return None
+        if not self.has_vector[node.pos]: # node has no text to embed
+            return False
+        return bool(context["phrase_scores"][str(args[1][1]).strip().lower()][node.pos] > context["semantic_threshold"])
+
+    def aggregate(self, name: str, args: list[tuple], distinct: bool, group: list[dict], context: dict[str, any]):
+        if name == "count" and args and args[0][0] == "star":
+            return len(group)
+        values = [self.evaluate(args[0], row, context) for row in group]
+        values = [value for value in values if value is not None]
+        if distinct:
+            seen = set()
+            values = [value for value in values if not (key := hashable(value)) in seen and not seen.add(key)]
+        match name:
+            case "count":
+                return len(values)
+            case "collect":
+                return values
+            case "sum":
+                return sum(values) if values else 0
+            case "avg":
+                return sum(values) / len(values) if values else None
+            case "min":
+                return min(values, key=cmp_to_key(compare_values)) if values else None
+            case "max":
+                return max(values, key=cmp_to_key(compare_values)) if values else None
+
+    def ftsearch(self, query: str) -> list[dict[str, any]]:
+        """Fuzzy name/description search, standing in for Neo4j_DB.ftsearch's full-text index."""
+        index = self.fulltext_index()
+        results = []
+        for node, text in self.indexed_texts():
+            score = index.score(query, text)
+            if score > FULLTEXT_THRESHOLD:
+                results.append({"EntityType": type(node).__name__, "TextValue": text, "FullTextScore": round(score, 2)})
+        results.sort(key=lambda r: (-r["FullTextScore"], len(r["TextValue"])))
+        return results[:4]
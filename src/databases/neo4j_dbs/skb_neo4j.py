@@ -1,6 +1,9 @@
 import os
 from dotenv import load_dotenv
 import logging
+import time
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
 
 import neo4j
 
@@ -10,8 +13,12 @@ from ..chroma_dbs.skb_chroma import Chroma_DB
 load_dotenv()
 NEO4J_URI = os.getenv("NEO4J_URI")
 NEO4J_AUTH = (os.getenv("NEO4J_USER"), os.getenv("NEO4J_PASS"))
+NEO4J_BATCH_SIZE = int(os.getenv("NEO4J_BATCH_SIZE", 1000)) # rows per UNWIND transaction when loading a database
+NEO4J_WRITERS = int(os.getenv("NEO4J_WRITERS", 4)) # node label groups written concurrently
 
 class Neo4j_DB:
+    extended_functions = False # IS_SEMANTIC_MATCH / IS_FUZZY_MATCH must be rewritten by the retriever first
+
     def __init__(self, collection_name: str):
         self.logger = logging.getLogger(self.__class__.__name__)
         self.driver = neo4j.GraphDatabase.driver(uri=NEO4J_URI, auth=NEO4J_AUTH)
@@ -33,46 +40,113 @@ class Neo4j_DB:
         with self.driver.session(database=self.database_name) as session:
             session.run("MATCH (n) DETACH DELETE n")
 
-    def template_insert_node(self, entity_label: str, props: dict[str, any]):
-        prop_keys = ', '.join(f'{k}: ${k}' for k in props)
-        return f"MERGE (n:{entity_label} {{{prop_keys}}})"
-
-    def template_insert_relation(self, from_label, rel_name, to_label):
-        return f"MATCH (a:{from_label} {{external_id: $from_id}}) MATCH (b:{to_label} {{external_id: $to_id}}) MERGE (a)-[r:{rel_name.upper()}]->(b)"
-
-    def parse(self, skb: SKB, max_entities: int = None, clear_previous: bool = True):
+    def template_unwind_nodes(self, entity_label: str):
+        return f"UNWIND $batch AS row MERGE (n:{entity_label} {{external_id: row.external_id}}) SET n += row.props"
+
+    def template_unwind_relations(self, from_label, rel_name, to_label):
+        return (f"UNWIND $batch AS row MATCH (a:{from_label} {{external_id: row.from_id}}) MATCH (b:{to_label} {{external_id: row.to_id}}) "
+            f"MERGE (a)-[r:{rel_name.upper()}]->(b)")
+
+    def write_groups(self, groups: dict[str, list[dict[str, any]]], batch_size: int, workers: int) -> int:
+        """Write each {query: rows} group in transactions of batch_size rows, up to `workers` groups at once. Returns the rows written."""
+        def write(query: str, rows: list[dict[str, any]]) -> int:
+            # Each writer needs its own session; execute_write retries transient errors such as lock timeouts
+            with self.driver.session(database=self.database_name) as session:
+                for start in range(0, len(rows), batch_size):
+                    session.execute_write(lambda tx, batch: tx.run(query, batch=batch).consume(), rows[start:start + batch_size])
+            return len(rows)
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            return sum(executor.map(write, groups.keys(), groups.values()))
+
+    def parse(self, skb: SKB, max_entities: int = None, clear_previous: bool = True,
+              batch_size: int = NEO4J_BATCH_SIZE, workers: int = NEO4J_WRITERS):
+        """Load SKB nodes grouped by label, then relations grouped by (from label, type, to label), with batched UNWIND statements.
+        Node label groups are independent and written concurrently; relation groups are written one after another."""
+        if batch_size < 1: # checked before the database is cleared
+            raise ValueError(f"Neo4j batch size must be at least 1, got {batch_size}")
         if clear_previous:
             self.clear()
+        nodes = list(islice(skb.get_entities().items(), max_entities))
+
+        node_groups: dict[str, list[dict[str, any]]] = {}
+        for node_id, node in nodes:
+            node_groups.setdefault(node.__class__.__name__, []).append({"external_id": node_id, "props": node.get_props()})
 
+        # Relations are matched by external_id, so index it for every label before any are written
         with self.driver.session(database=self.database_name) as session:
-            # First pass: create entities
-            for i, (node_id, node) in enumerate(skb.get_entities().items()):
-                if max_entities is not None and i >= max_entities:
-                    break
-
-                entity = node.__class__.__name__
-                props = node.get_props()
-                props['external_id'] = node_id
-                query = self.template_insert_node(entity, props)
-                session.run(query, props)
-
-            # Second pass: create relations
-            for i, (node_id, node) in enumerate(skb.get_entities().items()):
-                if max_entities is not None and i >= max_entities:
-                    break
-
-                from_label = node.__class__.__name__
-                relations = node.get_relations()
-                for rel_name, rel_targets in relations.items():
-                    for target_id in rel_targets:
-                        to_node = skb.get_entity_by_id(target_id)
-                        to_label = to_node.__class__.__name__
-                        query = self.template_insert_relation(from_label, rel_name, to_label)
-                        session.run(query, {"from_id": node_id, "to_id": target_id})
-
-    def attach_chroma_embeddings(self, chromadb: Chroma_DB, max_rows: int = None):
+            for entity_label in node_groups:
+                session.run(f"CREATE INDEX {entity_label.lower()}_external_id IF NOT EXISTS FOR (n:{entity_label}) ON (n.external_id)")
+            session.run("CALL db.awaitIndexes()")
+
+        start = time.perf_counter()
+        written = self.write_groups({self.template_unwind_nodes(label): rows for label, rows in node_groups.items()}, batch_size, workers)
+        elapsed = time.perf_counter() - start
+        self.logger.info(f"Wrote {written} nodes in {len(node_groups)} label groups in {elapsed:.1f}s ({written / elapsed if elapsed else 0:.0f} rows/s)")
+
+        relation_groups: dict[str, list[dict[str, any]]] = {}
+        for node_id, node in nodes:
+            from_label = node.__class__.__name__
+            for rel_name, rel_targets in node.get_relations().items():
+                for target_id in rel_targets:
+                    to_label = skb.get_entity_by_id(target_id).__class__.__name__
+                    relation_groups.setdefault(self.template_unwind_relations(from_label, rel_name, to_label), []).append({"from_id": node_id, "to_id": target_id})
+
+        # Relation groups share endpoint nodes, so writing them concurrently would only contend for node locks
+        start = time.perf_counter()
+        written = self.write_groups(relation_groups, batch_size, workers=1)
+        elapsed = time.perf_counter() - start
+        self.logger.info(f"Wrote {written} relations in {len(relation_groups)} groups in {elapsed:.1f}s ({written / elapsed if elapsed else 0:.0f} rows/s)")
+
+    def apply_diff(self, skb: SKB, diff: dict[str, any], batch_size: int = NEO4J_BATCH_SIZE, workers: int = NEO4J_WRITERS):
+        """Apply an SKB.diff: drop removed nodes, create added ones, update changed props and add/remove relation edges.
+        Each kind of change is written in grouped UNWIND batches, as in parse."""
+        if batch_size < 1:
+            raise ValueError(f"Neo4j batch size must be at least 1, got {batch_size}")
+        start = time.perf_counter()
+        if diff["removed"]:
+            self.write_groups({"UNWIND $batch AS id MATCH (n {external_id: id}) DETACH DELETE n": diff["removed"]}, batch_size, workers=1)
+
+        # Added and changed nodes both MERGE on external_id and take the node's current props
+        node_groups: dict[str, list[dict[str, any]]] = {}
+        for node_id in [*diff["added"], *diff["changed"]]:
+            node = skb.get_entity_by_id(node_id)
+            node_groups.setdefault(node.__class__.__name__, []).append({"external_id": node_id, "props": node.get_props()})
+        if diff["added"]: # a label new to this database needs its index before relations look nodes up by it
+            with self.driver.session(database=self.database_name) as session:
+                for entity_label in node_groups:
+                    session.run(f"CREATE INDEX {entity_label.lower()}_external_id IF NOT EXISTS FOR (n:{entity_label}) ON (n.external_id)")
+                session.run("CALL db.awaitIndexes()")
+        self.write_groups({self.template_unwind_nodes(label): rows for label, rows in node_groups.items()}, batch_size, workers)
+
+        removed_groups: dict[str, list[dict[str, any]]] = {}
+        for from_id, rel_name, to_id in diff["relations_removed"]:
+            from_label = skb.get_entity_by_id(from_id).__class__.__name__
+            query = f"UNWIND $batch AS row MATCH (a:{from_label} {{external_id: row.from_id}})-[r:{rel_name.upper()}]->(b {{external_id: row.to_id}}) DELETE r"
+            removed_groups.setdefault(query, []).append({"from_id": from_id, "to_id": to_id})
+
+        added_groups: dict[str, list[dict[str, any]]] = {}
+        for from_id, rel_name, to_id in diff["relations_added"]:
+            from_label = skb.get_entity_by_id(from_id).__class__.__name__
+            to_label = skb.get_entity_by_id(to_id).__class__.__name__
+            added_groups.setdefault(self.template_unwind_relations(from_label, rel_name, to_label), []).append({"from_id": from_id, "to_id": to_id})
+
+        # Relation groups share endpoint nodes, so they are written one after another
+        self.write_groups(removed_groups, batch_size, workers=1)
+        self.write_groups(added_groups, batch_size, workers=1)
+
+        self.logger.info(
+            f"Applied SKB changes to {self.database_name} in {time.perf_counter() - start:.1f}s: {len(diff['added'])} added, {len(diff['removed'])} removed, {len(diff['changed'])} changed nodes, "
+            f"{len(diff['relations_added'])} relations added, {len(diff['relations_removed'])} removed"
+        )
+
+    def attach_chroma_embeddings(self, chromadb: Chroma_DB, max_rows: int = None, ids: list[str] = None):
         self.logger.info(f"Retrieving embeddings from Chroma collection {chromadb.collection_name}")
-        if max_rows:
+        if ids is not None: # only the given nodes, e.g. those re-embedded by an incremental update
+            if not ids:
+                return
+            entries = chromadb.collection.get(ids=ids, include=["embeddings"])
+        elif max_rows:
             entries = chromadb.collection.get(limit=max_rows, include=["embeddings"])
             self.logger.debug(f"Limited set of chroma entries: {entries}")
         else:
@@ -83,10 +157,11 @@ class Neo4j_DB:
             for id_val, embedding in zip(entries["ids"], entries["embeddings"])
         ]
 
+        # SET would store the list as 64-bit floats; the procedure keeps Chroma's float32 values as a float32 array, half the size and no less precise
         cypher_query = f"""
         UNWIND $batch as item
         MATCH (n {{external_id: item.id}})
-        SET n.embedding = item.embedding
+        CALL db.create.setNodeVectorProperty(n, 'embedding', item.embedding)
         """
 
         self.logger.info(f"Attaching embeddings from Chroma collection {chromadb.collection_name} to Neo4j database")
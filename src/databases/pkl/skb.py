@@ -1,7 +1,21 @@
 from pydantic import BaseModel
+from typing import ClassVar, Iterator
+import logging
+import os
+import csv
+import time
+import multiprocessing
+import queue
 import hashlib
 import pickle
 import json
+from array import array
+from dotenv import load_dotenv
+
+load_dotenv()
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "neo4j") # neo4j, or local for the in-process Cypher engine over the SKB snapshot
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma") # chroma, or numpy for the exact VectorIndex exported from it
+SKB_PATH = "databases/pkl/{name}.skb" # each scope's SKB snapshot, written by load.py and read back by the local query backend
 
 class SKBSchema:
     @classmethod
@@ -38,56 +52,224 @@ class SKBSchema:
         return json.dumps(cls.schema_to_jsonlike(tag_uniqueness, tag_semantic), indent=4).replace('"', '')
 
 class SKBNode(BaseModel):
+    # Field categories, computed once per schema class from the Field(...) metadata
+    prop_fields: ClassVar[tuple[str, ...]] = ()
+    relation_fields: ClassVar[tuple[str, ...]] = ()
+    id_fields: ClassVar[tuple[str, ...]] = ()
+    semantic_fields: ClassVar[tuple[str, ...]] = ()
+    text_fields: ClassVar[tuple[str, ...]] = ()
+
+    @classmethod
+    def __pydantic_init_subclass__(cls, **kwargs):
+        super().__pydantic_init_subclass__(**kwargs)
+
+        extras = {name: field.json_schema_extra or {} for name, field in cls.model_fields.items()}
+        cls.prop_fields = tuple(name for name, extra in extras.items() if not extra.get("relation", False))
+        cls.relation_fields = tuple(name for name, extra in extras.items() if extra.get("relation", False))
+        cls.id_fields = tuple(name for name, extra in extras.items() if extra.get("id", False))
+        cls.semantic_fields = tuple(name for name, extra in extras.items() if extra.get("semantic", False))
+        cls.text_fields = tuple(name for name, field in cls.model_fields.items() if field.annotation is str)
+
     def get_props(self) -> dict[str, any]:
-        return { k: v for k, v in self.model_dump().items()
-            if not self.model_fields[k].json_schema_extra.get("relation", False)}
+        return { k: getattr(self, k) for k in self.prop_fields }
 
     def get_relations(self) -> dict[str, any]:
-        return { k: v for k, v in self.model_dump().items()
-            if self.model_fields[k].json_schema_extra.get("relation", False)}
+        return { k: list(getattr(self, k)) for k in self.relation_fields }
 
     def get_identity(self) -> dict[str, any]:
-        return { k: v for k, v in self.model_dump().items()
-            if self.model_fields[k].json_schema_extra.get("id", False)}
+        return { k: getattr(self, k) for k in self.id_fields }
 
     def get_semantic(self) -> dict[str, any]:
-        return { k: v for k, v in self.model_dump().items()
-            if self.model_fields[k].json_schema_extra.get("semantic", False)}
+        return { k: getattr(self, k) for k in self.semantic_fields }
 
     def get_textual(self) -> dict[str, any]:
-        return { k: v for k, v in self.model_dump().items()
-            if isinstance(v, str)}
+        return { k: v for k in self.text_fields
+            if isinstance(v := getattr(self, k), str)}
 
     def compute_id(self) -> str:
         id_vals = self.get_identity().values()
         return hashlib.sha1("|".join(str(val) for val in id_vals).encode()).hexdigest()
 
+class SKBAdjacency:
+    """Forward and reverse CSR adjacency per relation field, over integer node positions."""
+    def __init__(self, ids: list[str], edges: dict[str, tuple[array, array]]):
+        self.ids = ids
+        self.positions = {node_id: pos for pos, node_id in enumerate(ids)}
+        self.forward = {rel_name: self.csr(sources, targets) for rel_name, (sources, targets) in edges.items()}
+        self.reverse = {rel_name: self.csr(targets, sources) for rel_name, (sources, targets) in edges.items()}
+
+    @classmethod
+    def from_nodes(cls, nodes: dict[str, SKBNode]) -> "SKBAdjacency":
+        ids = list(nodes)
+        positions = {node_id: pos for pos, node_id in enumerate(ids)}
+        edges: dict[str, tuple[array, array]] = {}
+        for pos, node in enumerate(nodes.values()):
+            for rel_name in node.relation_fields:
+                sources, targets = edges.setdefault(rel_name, (array("i"), array("i")))
+                for target in getattr(node, rel_name):
+                    if target in positions: # skip dangling targets
+                        sources.append(pos)
+                        targets.append(positions[target])
+        return cls(ids, edges)
+
+    def csr(self, sources: array, targets: array) -> tuple[array, array]:
+        # Counting sort by source, stable so neighbours keep relation order
+        indptr = array("i", [0]) * (len(self.ids) + 1)
+        for source in sources:
+            indptr[source + 1] += 1
+        for pos in range(len(self.ids)):
+            indptr[pos + 1] += indptr[pos]
+        fill = indptr[:-1]
+        indices = array("i", [0]) * len(targets)
+        for source, target in zip(sources, targets):
+            indices[fill[source]] = target
+            fill[source] += 1
+        return indptr, indices
+
+    def neighbours(self, node_id: str, relation: str = None, reverse: bool = False) -> list[str]:
+        """Targets of node_id's relation (or nodes pointing at it when reverse), across all relations if none given."""
+        pos = self.positions.get(node_id)
+        if pos is None:
+            return []
+        index = self.reverse if reverse else self.forward
+        relations = [relation] if relation is not None else list(index)
+        neighbours = []
+        for rel_name in relations:
+            if rel_name not in index:
+                continue
+            indptr, indices = index[rel_name]
+            neighbours.extend(self.ids[target] for target in indices[indptr[pos]:indptr[pos + 1]])
+        return neighbours
+
+    def degree(self, node_id: str, relation: str, reverse: bool = False) -> int:
+        pos = self.positions.get(node_id)
+        if pos is None or relation not in self.forward:
+            return 0
+        indptr, _ = (self.reverse if reverse else self.forward)[relation]
+        return indptr[pos + 1] - indptr[pos]
+
 class SKB:
     def __init__(self, schema: SKBSchema):
         self.schema = schema
         self.nodes: dict[str, dict[str, any]] = {}
+        # Insertion-ordered membership (dict keys) of merged relation lists, built on a node's first merge
+        self.relation_members: dict[tuple[str, str], dict[str, None]] = {}
+        self.adjacency_index: SKBAdjacency = None # rebuilt on demand after nodes change
 
     def add_entity(self, entity: SKBNode) -> str:
         node_id = entity.compute_id()
+        self.adjacency_index = None
         if node_id not in self.nodes:
             self.nodes[node_id] = entity
         else: # Merge non-identity fields
             existing = self.nodes[node_id]
-            for k, v in entity.model_dump().items():
-                if existing.model_fields[k].json_schema_extra.get("id", False):
+            for k in existing.relation_fields: # Only adding for list items for now
+                if k in existing.id_fields:
                     continue
-                if isinstance(v, list): # Only adding for list items for now
-                    existing_list = getattr(existing, k)
-                    merged = list(set(existing_list + v)) # Add only new unique items
-                    setattr(existing, k, merged)
+                self.merge_relation(node_id, k, getattr(entity, k))
         return node_id
 
+    def merge_relation(self, node_id: str, field: str, targets: list[str]):
+        """Append targets not already in the node's relation, keeping first-seen order. O(1) per edge."""
+        self.adjacency_index = None
+        existing_list = getattr(self.nodes[node_id], field)
+        members = self.relation_members.get((node_id, field))
+        if members is None:
+            members = self.relation_members[(node_id, field)] = dict.fromkeys(existing_list)
+            if len(members) != len(existing_list):
+                existing_list[:] = members
+        for target in targets:
+            if target not in members: # Add only new unique items
+                members[target] = None
+                existing_list.append(target)
+
     def get_entities(self):
         return self.nodes
 
+    def diff(self, previous: "SKB") -> dict[str, any]:
+        """Node ids added, removed and changed (non-identity props or relations) since previous, plus relation edges as (from_id, relation, to_id)."""
+        added = [node_id for node_id in self.nodes if node_id not in previous.nodes]
+        removed = [node_id for node_id in previous.nodes if node_id not in self.nodes]
+        changed = []
+        relations_added = []
+        relations_removed = []
+
+        for node_id in added:
+            for rel_name, targets in self.nodes[node_id].get_relations().items():
+                relations_added.extend((node_id, rel_name, target) for target in targets)
+
+        for node_id, node in self.nodes.items():
+            if node_id not in previous.nodes:
+                continue
+            old_node = previous.nodes[node_id]
+            if type(old_node) is not type(node): # same identity values under another entity type
+                removed.append(node_id)
+                added.append(node_id)
+                relations_added.extend((node_id, rel_name, target) for rel_name, targets in node.get_relations().items() for target in targets)
+                continue
+
+            props_changed = old_node.get_props() != node.get_props()
+            relations_changed = False
+            old_relations = old_node.get_relations()
+            for rel_name, targets in node.get_relations().items():
+                old_targets = set(old_relations[rel_name])
+                new_targets = set(targets)
+                relations_added.extend((node_id, rel_name, target) for target in targets if target not in old_targets)
+                relations_removed.extend((node_id, rel_name, target) for target in old_relations[rel_name] if target not in new_targets)
+                relations_changed = relations_changed or old_targets != new_targets
+            if props_changed or relations_changed:
+                changed.append(node_id)
+
+        return {
+            "added": added,
+            "removed": removed,
+            "changed": changed,
+            "relations_added": relations_added,
+            "relations_removed": relations_removed,
+        }
+
     def get_entity_by_id(self, id: str):
         return self.nodes[id]
 
+    @property
+    def adjacency(self) -> SKBAdjacency:
+        if self.adjacency_index is None:
+            if hasattr(self.nodes, "relation_edges"): # snapshots can index straight from their CSR columns
+                self.adjacency_index = SKBAdjacency(list(self.nodes), self.nodes.relation_edges())
+            else:
+                self.adjacency_index = SKBAdjacency.from_nodes(self.nodes)
+        return self.adjacency_index
+
+    def neighbours(self, node_id: str, relation: str = None, reverse: bool = False) -> list[SKBNode]:
+        """Nodes related to node_id in O(degree), e.g. neighbours(component_id, "part_of", reverse=True) for its subcomponents."""
+        return [self.nodes[target] for target in self.adjacency.neighbours(node_id, relation, reverse)]
+
+    def save(self, path: str):
+        """Save as a columnar snapshot for .skb paths, otherwise as a pickle."""
+        from .snapshot import SNAPSHOT_EXTENSION
+        if path.endswith(SNAPSHOT_EXTENSION):
+            self.save_snapshot(path)
+        else:
+            self.save_pickle(path)
+
+    def load(self, path: str):
+        from .snapshot import SNAPSHOT_EXTENSION
+        if path.endswith(SNAPSHOT_EXTENSION):
+            self.load_snapshot(path)
+        else:
+            self.load_pickle(path)
+
+    def save_snapshot(self, path: str):
+        from .snapshot import write_snapshot
+        write_snapshot(self.nodes, self.schema, path)
+
+    def load_snapshot(self, path: str):
+        """Memory-map a snapshot. The loaded SKB is read-only: nodes are built on access and can't be added."""
+        from .snapshot import SKBSnapshot
+        self.nodes = SKBSnapshot(path, self.schema)
+        self.relation_members = {}
+        self.adjacency_index = None
+
     def save_pickle(self, filepath: str):
         with open(filepath, 'wb') as f:
             pickle.dump(self.nodes, f)
@@ -95,27 +277,179 @@ class SKB:
     def load_pickle(self, path: str):
         with open(path, "rb") as f:
             self.nodes = pickle.load(f)
+        self.relation_members = {}
+        self.adjacency_index = None
+
+def read_rows(filepath: str, max_rows: int = None) -> Iterator[dict[str, str]]:
+    """Stream spreadsheet rows as dicts of raw cell values."""
+    with open(filepath, 'r', encoding="utf-8") as file:
+        reader = csv.DictReader(file)
+        for i, row in enumerate(reader):
+            if max_rows is not None and i >= max_rows:
+                break
+            yield row
+
+def build_skb_worker(scope: str, graph_class: type["SKBGraph"], rows: multiprocessing.Queue, outpath: str, results: multiprocessing.Queue):
+    graph = graph_class()
+    graph.skb = SKB(graph.schema)
+    while (chunk := rows.get()) is not None:
+        for row in pickle.loads(chunk):
+            graph.add_row(row)
+    graph.skb.save(outpath)
+    results.put((scope, len(graph.skb.get_entities())))
+
+def build_skbs(graph_classes: dict[str, type["SKBGraph"]], filepath: str, outpaths: dict[str, str], max_rows: int = None,
+    processes: bool = False, chunk_size: int = 10_000) -> dict[str, int]:
+    """Build every scope's SKB from one pass over the spreadsheet, optionally with one process per scope. Returns node counts."""
+    logger = logging.getLogger("SKBBuilder")
+    start = time.perf_counter()
+
+    if not processes:
+        graphs = {scope: graph_class() for scope, graph_class in graph_classes.items()}
+        for graph in graphs.values():
+            graph.skb = SKB(graph.schema)
+        for row in read_rows(filepath, max_rows):
+            for graph in graphs.values():
+                graph.add_row(row)
+        for scope, graph in graphs.items():
+            graph.skb.save(outpaths[scope])
+        counts = {scope: len(graph.skb.get_entities()) for scope, graph in graphs.items()}
+        logger.info(f"Built SKBs for {', '.join(graph_classes)} in {time.perf_counter() - start:.2f}s: {counts}")
+        return counts
+
+    # The parent streams the sheet once and hands every chunk of rows to each scope's worker
+    rows = {scope: multiprocessing.Queue(maxsize=4) for scope in graph_classes}
+    results = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(target=build_skb_worker, args=(scope, graph_class, rows[scope], outpaths[scope], results))
+        for scope, graph_class in graph_classes.items()
+    ]
+    for worker in workers:
+        worker.start()
+
+    def check_workers():
+        if any(worker.exitcode for worker in workers):
+            for worker in workers:
+                worker.terminate()
+            raise RuntimeError("An SKB build worker failed")
+
+    def put(scope_rows: multiprocessing.Queue, item):
+        while True:
+            try:
+                return scope_rows.put(item, timeout=1)
+            except queue.Full:
+                check_workers()
+
+    chunk = []
+    for row in read_rows(filepath, max_rows):
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            payload = pickle.dumps(chunk) # serialised once, not once per scope
+            for scope_rows in rows.values():
+                put(scope_rows, payload)
+            chunk = []
+    payload = pickle.dumps(chunk)
+    for scope_rows in rows.values():
+        if chunk:
+            put(scope_rows, payload)
+        put(scope_rows, None)
+
+    counts = {}
+    while len(counts) < len(workers):
+        try:
+            scope, count = results.get(timeout=1)
+            counts[scope] = count
+        except queue.Empty:
+            check_workers()
+    for worker in workers:
+        worker.join()
+
+    logger.info(f"Built SKBs for {', '.join(graph_classes)} on {len(workers)} processes in {time.perf_counter() - start:.2f}s: {counts}")
+    return counts
 
 class SKBGraph:
+    def setup_skb(self, filepath: str, outpath: str, max_rows: int = None):
+        self.skb = SKB(self.schema)
+        for row in read_rows(filepath, max_rows):
+            self.add_row(row)
+        self.skb.save(outpath)
+
+    def add_row(self, row: dict[str, str]):
+        """Add the entities for one spreadsheet row to self.skb."""
+        raise NotImplementedError
+
     def load_skb(self, skb_file: str):
         self.skb = SKB(self.schema)
-        self.skb.load_pickle(skb_file)
+        self.skb.load(skb_file)
 
     def setup_chroma(self):
-        from databases import Chroma_DB
+        from databases import Chroma_DB, VectorIndex
         self.chroma = Chroma_DB(collection_name=self.name, embed_fnc=self.embedding_func)
         self.chroma.parse(self.skb)
+        if VECTOR_BACKEND == "numpy":
+            VectorIndex.build(self.chroma)
 
     def load_chroma(self):
         from databases import Chroma_DB
         self.chroma = Chroma_DB(collection_name=self.name, embed_fnc=self.embedding_func)
 
+    def load_vectors(self):
+        """Vector search backend: the Chroma collection, or with VECTOR_BACKEND=numpy the exact index exported from it (built on first use)."""
+        from databases import VectorIndex
+        if VECTOR_BACKEND == "numpy":
+            if not VectorIndex.exists(self.name):
+                self.load_chroma()
+                VectorIndex.build(self.chroma)
+            self.vectors = VectorIndex(collection_name=self.name, embed_fnc=self.embedding_func)
+        else:
+            self.load_chroma()
+            self.vectors = self.chroma
+
     def setup_neo4j(self):
         from databases import Neo4j_DB
         self.neo4j = Neo4j_DB(collection_name=self.name.replace("_", "-"))
         self.neo4j.parse(self.skb)
         self.neo4j.attach_chroma_embeddings(self.chroma)
 
+    def update(self, filepath: str, skb_file: str, neo4j: bool = True) -> dict[str, any]:
+        """Rebuild the SKB from filepath, push only its differences from skb_file to Chroma (and Neo4j), then replace skb_file."""
+        previous = SKB(self.schema)
+        previous.load(skb_file)
+
+        base, extension = os.path.splitext(skb_file)
+        next_file = f"{base}.next{extension}"
+        self.setup_skb(filepath=filepath, outpath=next_file)
+
+        diff = self.skb.diff(previous)
+        self.logger.info(
+            f"SKB changes: {len(diff['added'])} added, {len(diff['removed'])} removed, {len(diff['changed'])} changed nodes; "
+            f"{len(diff['relations_added'])} added, {len(diff['relations_removed'])} removed relations"
+        )
+
+        self.load_chroma()
+        embedded = self.chroma.apply_diff(self.skb, diff)
+        if VECTOR_BACKEND == "numpy":
+            from databases import VectorIndex
+            VectorIndex.build(self.chroma)
+        if neo4j:
+            self.load_neo4j()
+            self.neo4j.apply_diff(self.skb, diff)
+            self.neo4j.attach_chroma_embeddings(self.chroma, ids=embedded)
+
+        os.replace(next_file, skb_file)
+        return diff
+
     def load_neo4j(self):
         from databases import Neo4j_DB
         self.neo4j = Neo4j_DB(collection_name=self.name.replace("_", "-"))
+
+    def load_cypher(self):
+        """Query backend for the retrievers: Neo4j, or with RETRIEVAL_BACKEND=local the in-process engine over the SKB and Chroma."""
+        if RETRIEVAL_BACKEND == "local":
+            from databases import SKBCypher_DB
+            self.load_skb(SKB_PATH.format(name=self.name))
+            self.load_chroma()
+            self.cypher = SKBCypher_DB(self.skb, chroma=self.chroma)
+        else:
+            self.load_neo4j()
+            self.cypher = self.neo4j
@@ -0,0 +1,294 @@
+import logging
+import os
+import sys
+import mmap
+import json
+import struct
+import bisect
+import time
+from array import array
+from collections.abc import Mapping, ItemsView, ValuesView
+
+from .skb import SKBSchema, SKBNode
+
+SNAPSHOT_MAGIC = b"SKBSNAP\x00"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_EXTENSION = ".skb"
+ID_WIDTH = 40 # hex sha1 from SKBNode.compute_id
+
+# File layout: magic | version (u32) | header length (u64) | JSON header | sections, each 8-byte aligned.
+# The header maps section names to [offset from data start, byte length, array typecode]:
+#   ids                   every node id in insertion order, ID_WIDTH ascii bytes each, then dangling relation targets
+#   sorted_ids/sorted_pos ids in byte order and their positions, for binary search without building a dict
+#   order_type/order_row  entity type index and row within that type for each node position
+#   heap                  utf-8 string heap shared by all string columns
+#   {Type}.{field}        int64 column, int64 heap offsets (rows + 1) for strings,
+#   {Type}.{field}.indptr/.indices  CSR relation targets as node positions
+PREAMBLE = struct.Struct("<8sIQ")
+
+def node_types(schema: SKBSchema) -> dict[str, type[SKBNode]]:
+    return {name: cls for name, cls in vars(schema).items() if isinstance(cls, type) and issubclass(cls, SKBNode)}
+
+def field_kind(cls: type[SKBNode], field: str) -> str:
+    if field in cls.relation_fields:
+        return "relation"
+    annotation = cls.model_fields[field].annotation
+    if annotation is int:
+        return "int"
+    if annotation is str:
+        return "str"
+    raise TypeError(f"Field {cls.__name__}.{field} of type {annotation} can't be stored in a snapshot")
+
+def align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+def write_snapshot(nodes: Mapping[str, SKBNode], schema: SKBSchema, path: str):
+    """Write SKB nodes to a columnar snapshot at path (atomically, via a temporary file)."""
+    types = node_types(schema)
+    type_index = {name: i for i, name in enumerate(types)}
+
+    ids = list(nodes)
+    positions = {node_id: pos for pos, node_id in enumerate(ids)}
+    rows: dict[str, list[SKBNode]] = {name: [] for name in types}
+    order_type = array("i")
+    order_row = array("i")
+    for node in nodes.values():
+        name = type(node).__name__
+        order_type.append(type_index[name])
+        order_row.append(len(rows[name]))
+        rows[name].append(node)
+
+    sections: dict[str, array | bytes] = {}
+    heap = bytearray()
+    for name, cls in types.items():
+        for field in cls.model_fields:
+            kind = field_kind(cls, field)
+            values = [getattr(node, field) for node in rows[name]]
+            if kind == "int":
+                sections[f"{name}.{field}"] = array("q", values)
+            elif kind == "str":
+                offsets = array("q", [len(heap)])
+                for value in values:
+                    heap += value.encode()
+                    offsets.append(len(heap))
+                sections[f"{name}.{field}"] = offsets
+            else:
+                indptr = array("q", [0])
+                indices = array("i")
+                for targets in values:
+                    for target in targets:
+                        if target not in positions: # dangling target, kept so its id survives the round trip
+                            positions[target] = len(ids)
+                            ids.append(target)
+                        indices.append(positions[target])
+                    indptr.append(len(indices))
+                sections[f"{name}.{field}.indptr"] = indptr
+                sections[f"{name}.{field}.indices"] = indices
+
+    if any(len(node_id) != ID_WIDTH for node_id in ids):
+        raise ValueError(f"Snapshot ids must be {ID_WIDTH} character hashes")
+    sorted_pos = array("i", sorted(range(len(ids)), key=ids.__getitem__))
+    sections["ids"] = "".join(ids).encode("ascii")
+    sections["sorted_ids"] = "".join(ids[pos] for pos in sorted_pos).encode("ascii")
+    sections["sorted_pos"] = sorted_pos
+    sections["order_type"] = order_type
+    sections["order_row"] = order_row
+    sections["heap"] = bytes(heap)
+
+    layout = {}
+    offset = 0
+    for section, data in sections.items():
+        nbytes = len(data) * data.itemsize if isinstance(data, array) else len(data)
+        layout[section] = [offset, nbytes, data.typecode if isinstance(data, array) else "B"]
+        offset = align(offset + nbytes)
+
+    header = json.dumps({
+        "version": SNAPSHOT_VERSION,
+        "byteorder": sys.byteorder,
+        "schema": schema.__name__,
+        "types": list(types),
+        "nodes": len(nodes),
+        "sections": layout,
+    }).encode()
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(PREAMBLE.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(header)))
+        f.write(header)
+        data_start = align(PREAMBLE.size + len(header))
+        for section, data in sections.items():
+            f.write(b"\x00" * (data_start + layout[section][0] - f.tell()))
+            f.write(data.tobytes() if isinstance(data, array) else data)
+    os.replace(tmp_path, path)
+
+class SortedIds:
+    """Sequence view of the sorted id section, so bisect can search it in place."""
+    def __init__(self, buffer: memoryview):
+        self.buffer = buffer
+
+    def __len__(self):
+        return len(self.buffer) // ID_WIDTH
+
+    def __getitem__(self, i: int) -> bytes:
+        return self.buffer[i * ID_WIDTH:(i + 1) * ID_WIDTH].tobytes()
+
+class SnapshotItems(ItemsView):
+    def __iter__(self):
+        snapshot = self._mapping
+        for pos in range(len(snapshot)):
+            yield snapshot.node_id(pos), snapshot.node_at(pos)
+
+class SnapshotValues(ValuesView):
+    def __iter__(self):
+        snapshot = self._mapping
+        for pos in range(len(snapshot)):
+            yield snapshot.node_at(pos)
+
+class SKBSnapshot(Mapping):
+    """Read-only, memory-mapped view of an SKB snapshot. Nodes are only built (without revalidation) when accessed."""
+    def __init__(self, path: str, schema: SKBSchema):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        start = time.perf_counter()
+
+        self.path = path
+        self.file = open(path, "rb")
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.buffer = memoryview(self.mmap)
+
+        magic, version, header_length = PREAMBLE.unpack_from(self.buffer)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not an SKB snapshot")
+        if version != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported SKB snapshot version {version} in {path} (expected {SNAPSHOT_VERSION})")
+        self.header = json.loads(self.buffer[PREAMBLE.size:PREAMBLE.size + header_length].tobytes())
+        if self.header["byteorder"] != sys.byteorder:
+            raise ValueError(f"SKB snapshot {path} was written on a {self.header['byteorder']}-endian machine")
+        self.data_start = align(PREAMBLE.size + header_length)
+
+        classes = node_types(schema)
+        missing = [name for name in self.header["types"] if name not in classes]
+        if missing:
+            raise ValueError(f"Snapshot {path} has entity types {missing} not in schema {schema.__name__}")
+        self.classes = [classes[name] for name in self.header["types"]]
+
+        self.views: list[memoryview] = [self.buffer]
+        self.ids = self.section("ids")
+        self.sorted_ids = SortedIds(self.section("sorted_ids"))
+        self.sorted_pos = self.section("sorted_pos")
+        self.order_type = self.section("order_type")
+        self.order_row = self.section("order_row")
+        self.heap = self.section("heap")
+        self.columns: dict[str, dict[str, tuple]] = {}
+        self.materialised: dict[int, SKBNode] = {}
+
+        self.logger.info(f"Opened SKB snapshot {path} with {len(self)} nodes in {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    def section(self, name: str) -> memoryview:
+        offset, nbytes, typecode = self.header["sections"][name]
+        view = self.buffer[self.data_start + offset:self.data_start + offset + nbytes]
+        if typecode != "B":
+            view = view.cast(typecode)
+        self.views.append(view)
+        return view
+
+    def type_columns(self, cls: type[SKBNode]) -> dict[str, tuple]:
+        # Column views for one entity type, opened on first access
+        name = cls.__name__
+        if name not in self.columns:
+            columns = {}
+            for field in cls.model_fields:
+                kind = field_kind(cls, field)
+                if kind == "relation":
+                    columns[field] = (kind, self.section(f"{name}.{field}.indptr"), self.section(f"{name}.{field}.indices"))
+                else:
+                    columns[field] = (kind, self.section(f"{name}.{field}"))
+            self.columns[name] = columns
+        return self.columns[name]
+
+    def node_id(self, pos: int) -> str:
+        return self.ids[pos * ID_WIDTH:(pos + 1) * ID_WIDTH].tobytes().decode("ascii")
+
+    def position(self, node_id: str) -> int | None:
+        key = node_id.encode("ascii", errors="replace")
+        i = bisect.bisect_left(self.sorted_ids, key)
+        if i < len(self.sorted_ids) and self.sorted_ids[i] == key:
+            pos = self.sorted_pos[i]
+            return pos if pos < len(self) else None # dangling targets aren't nodes
+        return None
+
+    def node_at(self, pos: int) -> SKBNode:
+        if pos not in self.materialised:
+            cls = self.classes[self.order_type[pos]]
+            row = self.order_row[pos]
+            values = {}
+            for field, (kind, *column) in self.type_columns(cls).items():
+                if kind == "int":
+                    values[field] = column[0][row]
+                elif kind == "str":
+                    offsets = column[0]
+                    values[field] = self.heap[offsets[row]:offsets[row + 1]].tobytes().decode()
+                else:
+                    indptr, indices = column
+                    values[field] = [self.node_id(target) for target in indices[indptr[row]:indptr[row + 1]]]
+            self.materialised[pos] = cls.model_construct(**values)
+        return self.materialised[pos]
+
+    def relation_edges(self) -> dict[str, tuple[array, array]]:
+        """(source, target) node positions per relation field, read from the CSR columns without building nodes."""
+        type_positions = [array("i") for _ in self.classes]
+        for pos in range(len(self)):
+            type_positions[self.order_type[pos]].append(pos)
+
+        edges: dict[str, tuple[array, array]] = {}
+        for type_index, cls in enumerate(self.classes):
+            for field, (kind, *column) in self.type_columns(cls).items():
+                if kind != "relation":
+                    continue
+                indptr, indices = column
+                sources, targets = edges.setdefault(field, (array("i"), array("i")))
+                for row, pos in enumerate(type_positions[type_index]):
+                    for target in indices[indptr[row]:indptr[row + 1]]:
+                        if target < len(self): # skip dangling targets
+                            sources.append(pos)
+                            targets.append(target)
+        return edges
+
+    def __getitem__(self, node_id: str) -> SKBNode:
+        pos = self.position(node_id)
+        if pos is None:
+            raise KeyError(node_id)
+        return self.node_at(pos)
+
+    def __contains__(self, node_id) -> bool:
+        return isinstance(node_id, str) and self.position(node_id) is not None
+
+    def __len__(self) -> int:
+        return self.header["nodes"]
+
+    def __iter__(self):
+        for pos in range(len(self)):
+            yield self.node_id(pos)
+
+    def items(self) -> SnapshotItems:
+        return SnapshotItems(self)
+
+    def values(self) -> SnapshotValues:
+        return SnapshotValues(self)
+
+    def close(self):
+        self.materialised.clear()
+        self.columns.clear()
+        for view in reversed(self.views):
+            view.release()
+        self.views.clear()
+        self.mmap.close()
+        self.file.close()
+
+def convert_pickle(pickle_path: str, schema: SKBSchema, snapshot_path: str = None) -> str:
+    """Convert an existing .pkl SKB into a snapshot next to it (or at snapshot_path). Returns the snapshot path."""
+    from .skb import SKB
+    skb = SKB(schema)
+    skb.load_pickle(pickle_path)
+    snapshot_path = snapshot_path or f"{os.path.splitext(pickle_path)[0]}{SNAPSHOT_EXTENSION}"
+    write_snapshot(skb.get_entities(), schema, snapshot_path)
+    return snapshot_path
@@ -0,0 +1,215 @@
+import os
+from dotenv import load_dotenv
+import logging
+import json
+import time
+
+import numpy as np
+
+from ..chroma_dbs.skb_chroma import RANGE_SEARCH_CAP
+
+load_dotenv()
+VECTOR_INDEX_PATH = os.getenv("VECTOR_INDEX_PATH", "databases/vector_index")
+VECTOR_INDEX_DTYPE = os.getenv("VECTOR_INDEX_DTYPE", "float32") # float32, float16 to halve the scanned matrix, or int8 to quarter it
+VECTOR_RESCORE_FACTOR = int(os.getenv("VECTOR_RESCORE_FACTOR", 4)) # compact-score candidates re-scored at float32 per requested result
+
+class VectorIndex:
+    """Exact cosine search over a memory-mapped embedding matrix exported from a Chroma collection. Same query interface as Chroma_DB.
+    A float16 or int8 index is scanned in its compact form, then the best candidates are re-scored against a memory-mapped float32 copy."""
+    def __init__(self, collection_name: str, embed_fnc, path: str = VECTOR_INDEX_PATH):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        start = time.perf_counter()
+
+        self.collection_name = collection_name
+        self.embed_fnc = embed_fnc
+        self.range_stats = {"searches": 0, "expansions": 0, "capped": 0, "seconds": 0.0} # expansions stay 0, the scan is exact
+
+        matrix_path, sidecar_path = self.paths(collection_name, path)
+        scale_path, full_path = self.compact_paths(collection_name, path)
+        with open(sidecar_path, "r", encoding="utf-8") as f:
+            sidecar = json.load(f)
+        self.matrix: np.ndarray = np.load(matrix_path, mmap_mode="r") # rows are unit length, so a dot product is the cosine
+        if self.matrix.shape[0] != len(sidecar["ids"]):
+            raise ValueError(f"Vector index {matrix_path} has {self.matrix.shape[0]} rows but its sidecar lists {len(sidecar['ids'])} ids")
+        # int8 rows are unit rows divided by a per-row scale; float16 indexes written before re-scoring have no float32 copy and are searched as is
+        self.scale: np.ndarray | None = np.load(scale_path) if self.matrix.dtype == np.int8 else None
+        self.full: np.ndarray | None = np.load(full_path, mmap_mode="r") if self.matrix.dtype != np.float32 and os.path.exists(full_path) else None
+
+        self.ids: list[str] = sidecar["ids"]
+        self.documents: list[str] = sidecar["documents"]
+        self.type_names: list[str] = sidecar["type_names"]
+        self.types = np.asarray(sidecar["types"], dtype=np.int16)
+        self.rows = {node_id: row for row, node_id in enumerate(self.ids)}
+
+        self.logger.info(f"Vector index {collection_name} loaded with {len(self.ids)} {self.matrix.dtype} rows ({self.nbytes / 2**20:.1f}MB scanned) in {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    @staticmethod
+    def paths(collection_name: str, path: str = VECTOR_INDEX_PATH) -> tuple[str, str]:
+        return os.path.join(path, f"{collection_name}.npy"), os.path.join(path, f"{collection_name}.json")
+
+    @staticmethod
+    def compact_paths(collection_name: str, path: str = VECTOR_INDEX_PATH) -> tuple[str, str]:
+        return os.path.join(path, f"{collection_name}.scale.npy"), os.path.join(path, f"{collection_name}.float32.npy")
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes every full scan reads. The float32 copy of a compact index is only paged in for re-scored rows."""
+        return self.matrix.nbytes + (self.scale.nbytes if self.scale is not None else 0)
+
+    @property
+    def disk_bytes(self) -> int:
+        """Vector bytes on disk, counting the float32 copy a compact index keeps for re-scoring."""
+        return self.nbytes + (self.full.nbytes if self.full is not None else 0)
+
+    @classmethod
+    def exists(cls, collection_name: str, path: str = VECTOR_INDEX_PATH) -> bool:
+        return all(os.path.exists(p) for p in cls.paths(collection_name, path))
+
+    @classmethod
+    def build(cls, chroma, path: str = VECTOR_INDEX_PATH, dtype: str = VECTOR_INDEX_DTYPE):
+        """Export a Chroma_DB collection's embeddings, types and documents into an index at path."""
+        entries = chroma.collection.get(include=["embeddings", "metadatas", "documents"])
+        type_names = list(dict.fromkeys(meta["type"] for meta in entries["metadatas"]))
+        type_codes = {name: code for code, name in enumerate(type_names)}
+
+        if entries["ids"]:
+            matrix = np.asarray(entries["embeddings"], dtype=np.float32).reshape(len(entries["ids"]), -1)
+        else: # an empty collection has no embedding width to reshape to
+            matrix = np.empty((0, 0), dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = matrix / np.where(norms == 0, 1, norms)
+
+        os.makedirs(path, exist_ok=True)
+        matrix_path, sidecar_path = cls.paths(chroma.collection_name, path)
+        scale_path, full_path = cls.compact_paths(chroma.collection_name, path)
+        compact = {}
+        if dtype == "int8":
+            # Symmetric scalar quantisation: each row's largest component maps to +-127
+            scale = np.abs(matrix).max(axis=1, initial=0) / 127
+            scale[scale == 0] = 1
+            compact[scale_path] = scale.astype(np.float32)
+            compact[full_path] = matrix
+            matrix = np.rint(matrix / scale[:, None]).astype(np.int8)
+        elif dtype != "float32":
+            compact[full_path] = matrix
+            matrix = matrix.astype(dtype)
+        for extra_path, extra in compact.items():
+            with open(f"{extra_path}.tmp", "wb") as f:
+                np.save(f, extra)
+        with open(f"{matrix_path}.tmp", "wb") as f:
+            np.save(f, matrix)
+        with open(f"{sidecar_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump({
+                "ids": entries["ids"],
+                "documents": entries["documents"],
+                "type_names": type_names,
+                "types": [type_codes[meta["type"]] for meta in entries["metadatas"]],
+            }, f)
+        for extra_path in compact:
+            os.replace(f"{extra_path}.tmp", extra_path)
+        os.replace(f"{matrix_path}.tmp", matrix_path)
+        os.replace(f"{sidecar_path}.tmp", sidecar_path)
+        logging.getLogger(cls.__name__).info(f"Built vector index {matrix_path} with {len(entries['ids'])} {dtype} rows")
+
+    def candidate_rows(self, filter_entities: list[str] = None, filter_ids: list[str] = None) -> np.ndarray | None:
+        """Row numbers passing the filters, or None for every row."""
+        rows = None
+        if filter_ids:
+            rows = np.fromiter((self.rows[node_id] for node_id in filter_ids if node_id in self.rows), dtype=np.int64)
+        if filter_entities:
+            codes = [code for code, name in enumerate(self.type_names) if name in filter_entities]
+            if rows is None:
+                rows = np.flatnonzero(np.isin(self.types, codes))
+            else:
+                rows = rows[np.isin(self.types[rows], codes)]
+        return rows
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        vectors = np.asarray(self.embed_fnc(texts), dtype=np.float32).reshape(len(texts), -1)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def similarities(self, candidates: np.ndarray, vectors: np.ndarray, scale: np.ndarray = None, block: int = 8192) -> np.ndarray:
+        if candidates.dtype == np.float32:
+            return candidates @ vectors
+        # Half precision and int8 have no BLAS kernel, so upcast a block of rows at a time
+        similarities = np.concatenate([candidates[i:i + block].astype(np.float32) @ vectors for i in range(0, len(candidates), block)])
+        return similarities if scale is None else similarities * scale[:, None]
+
+    def score_error(self, vectors: np.ndarray) -> np.ndarray:
+        """Upper bound per query on how far a compact similarity can be from the float32 one."""
+        if self.scale is not None: # each component is off by at most half its row's scale
+            return np.abs(vectors).sum(axis=1) * float(self.scale.max()) / 2
+        return np.full(len(vectors), 2.0 ** -11) # float16 rounding is relative, and both rows are unit length
+
+    def shortlist(self, column: np.ndarray, k: int | None, threshold: float, error: float) -> np.ndarray:
+        """Positions in column worth re-scoring at float32: the best VECTOR_RESCORE_FACTOR * k, or every one that may clear the threshold."""
+        if k is None:
+            top = np.flatnonzero(column >= threshold - error)
+            limit = RANGE_SEARCH_CAP * VECTOR_RESCORE_FACTOR
+        else:
+            top = np.arange(len(column))
+            limit = k * VECTOR_RESCORE_FACTOR
+        if len(top) <= limit:
+            return top
+        return top[np.argpartition(-column[top], limit - 1)[:limit]] if limit > 0 else top[:0]
+
+    def query(self, query: str, k: int | None = 25, threshold: float = None, filter_entities: list[str] = None, filter_ids: list[str] = None):
+        """Vector embedding search. With k=None, returns every match above threshold (up to RANGE_SEARCH_CAP)."""
+        return self.query_many([query], k, threshold, filter_entities, filter_ids)[0]
+
+    def query_many(self, queries: list[str], k: int | None | list[int | None] = 25, threshold: float | list[float] = None,
+                   filter_entities: list[str] = None, filter_ids: list[str] = None) -> list[list]:
+        """Vector embedding search for several queries with one embedding call and one matrix product. Same interface as Chroma_DB.query_many,
+        except that range searches (k=None) are an exact scan for every row above the threshold."""
+        if not queries:
+            return []
+        ks = k if isinstance(k, list) else [k] * len(queries)
+        thresholds = threshold if isinstance(threshold, list) else [threshold] * len(queries)
+        if len(ks) != len(queries) or len(thresholds) != len(queries):
+            raise ValueError(f"Got {len(queries)} queries but {len(ks)} k values and {len(thresholds)} thresholds")
+        if any(k is None and threshold is None for k, threshold in zip(ks, thresholds)):
+            raise ValueError("A range search (k=None) needs a threshold")
+
+        start = time.perf_counter()
+        rows = self.candidate_rows(filter_entities, filter_ids)
+        candidates = self.matrix if rows is None else self.matrix[rows]
+        if not len(candidates):
+            return [[] for _ in queries]
+
+        vectors = self.embed([query.strip().lower() for query in queries])
+        similarities = self.similarities(candidates, vectors.T, None if self.scale is None else (self.scale if rows is None else self.scale[rows])) # candidates x queries
+        errors = self.score_error(vectors) if self.full is not None else None
+
+        all_results = []
+        for q, (column, k, threshold) in enumerate(zip(similarities.T, ks, thresholds)):
+            # A compact index ranks a shortlist by its float32 rows, so column becomes exact scores for those positions only
+            positions = None
+            if self.full is not None:
+                positions = self.shortlist(column, k, threshold, errors[q])
+                full_rows = positions if rows is None else rows[positions]
+                column = self.full[full_rows] @ vectors[q]
+            if k is None:
+                top = np.flatnonzero(column >= threshold)
+                self.range_stats["searches"] += 1
+                self.range_stats["capped"] += int(len(top) > RANGE_SEARCH_CAP)
+                k = min(len(top), RANGE_SEARCH_CAP)
+                if k < len(top):
+                    top = top[np.argpartition(-column[top], k - 1)[:k]]
+            else:
+                k = min(k, len(column))
+                top = np.argpartition(-column, k - 1)[:k] if k > 0 else np.empty(0, dtype=np.int64)
+            top = top[np.argsort(-column[top], kind="stable")]
+
+            results = []
+            for i in top:
+                similarity = float(column[i])
+                if threshold and similarity < threshold:
+                    break
+                i = i if positions is None else positions[i]
+                row = int(i) if rows is None else int(rows[i])
+                results.append([self.ids[row], self.type_names[self.types[row]], self.documents[row], similarity])
+            all_results.append(results)
+        if None in ks:
+            self.range_stats["seconds"] += time.perf_counter() - start
+        return all_results
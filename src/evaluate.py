@@ -3,6 +3,7 @@ import sys
 
 from scopes import retriever_factory, retriever_choices
 from evaluation import QASet
+from llm import get_embedding_cache, get_response_cache
 
 logging.basicConfig(
     level=logging.CRITICAL,
@@ -27,6 +28,13 @@ if __name__ == "__main__":
             qa_set.run_rag(retriever, run_file_path, model=rag_model)
             print(f"Running evaluation for strategy: {strategy}, entity linking: {allow_linking}")
             qa_set.run_match_nuggets(run_file_path)
+        print(f"Embedding cache: {get_embedding_cache().stats()}")
+        exit(0)
+
+    # Explicit invalidation of deterministic-mode responses, optionally for one model only
+    if len(sys.argv) in (2, 3) and sys.argv[1] == "clear_cache":
+        removed = get_response_cache().invalidate(model=sys.argv[2] if len(sys.argv) == 3 else None)
+        print(f"Removed {removed} cached responses")
         exit(0)
 
     if not len(sys.argv) == 3 and not len(sys.argv) == 4:
@@ -55,6 +63,10 @@ if __name__ == "__main__":
             print(f"Running evaluation of RAG run for strategy: {strategy}, entity linking: {allow_linking}")
             run_file_path = f"evaluation/experiment_runs/{strategy}{"_link" if allow_linking else ""}.xlsx"
             qa_set.run_match_nuggets(run_file_path)
+        case "profile":
+            print(f"Profiling retrieval and generation for strategy: {strategy}, entity linking: {allow_linking}")
+            profile_file_path = f"evaluation/experiment_runs/{strategy}{"_link" if allow_linking else ""}.prof"
+            qa_set.run_profile(retriever, profile_file_path, model=rag_model)
         case "metric":
             print(f"Running metric calculation of created nuggets run for strategy: {strategy}, entity linking: {allow_linking}")
             run_file_path = f"evaluation/experiment_runs/{strategy}{"_link" if allow_linking else ""}.xlsx"
@@ -1,11 +1,16 @@
 import logging
+import os
+import asyncio
+import time
+import cProfile
+import pstats
 import pandas as pd
 import tiktoken
 import json
 from typing import List, Literal
 from pydantic import BaseModel
 
-from llm import ChatClient
+from llm import ChatClient, AsyncChatClient, usage_tracker, run_async
 from generators import FinalGenerator
 
 QA_PATH = "evaluation/fmea_qa_model.xlsx"
@@ -32,9 +37,12 @@ class QASet:
     def __init__(self, nugget_extraction_prompt_path=NUGGET_EXTRACTION_PROMPT, nugget_matching_prompt=NUGGET_MATCHING_PROMPT):
         self.logger = logging.getLogger(self.__class__.__name__)
 
-        self.chat_client = ChatClient()
+        self.chat_client = ChatClient(caller="nugget-match")
+        self.async_chat_client = AsyncChatClient(caller="nugget-match")
         self.generator = FinalGenerator()
 
+        self.nugget_extraction_prompt_path = nugget_extraction_prompt_path
+        self.nugget_matching_prompt_path = nugget_matching_prompt
         with open(nugget_extraction_prompt_path, 'r') as f:
             self.nugget_extraction_prompt = f.read()
         with open(nugget_matching_prompt, 'r') as f:
@@ -43,29 +51,106 @@ class QASet:
     def run_rag(self, retriever, run_file_path: str, model: str = None, model_answers_path=QA_PATH):
         df_model = pd.read_excel(model_answers_path).to_dict(orient="records")
 
+        # Entity extraction and final generation run concurrently; retrieval runs in order (retrievers keep per-question state)
+        strategy = self.run_name(run_file_path)
         rag_run = []
+        generations = []
+        with usage_tracker.scope(strategy=strategy):
+            extractions = {}
+            if retriever.allow_linking:
+                extracted = run_async(self.gather([self.tagged(retriever.linker.aextract(entry["Question"]), question_id=entry["ID"]) for entry in df_model]))
+                extractions = {entry["ID"]: extraction for entry, extraction in zip(df_model, extracted)}
+
+            for entry in df_model:
+                question_id = entry["ID"]
+                question = entry["Question"]
+
+                with usage_tracker.scope(question_id=question_id):
+                    if retriever.allow_linking:
+                        cypher_query, retrieved_records, error = retriever.retrieve(question, model=model, extraction=extractions[question_id])
+                    else:
+                        cypher_query, retrieved_records, error = retriever.retrieve(question, model=model)
+                if error:
+                    rag_run.append({"ID": question_id, "Question": question, "Model_Answer": entry["Answer"], "Query": cypher_query, "Final_Response": f"EXECUTION ERROR: {error}", "Retrieved_Tok_Length": 0})
+                    continue
+
+                linker_list = retriever.linker.linker_list_prev if retriever.allow_linking else None
+                generation = self.generator.agenerate(question=question, retrieved_nodes=retrieved_records, schema_context=retriever.schema_context(), model=model, cypher_query=cypher_query, linker_list=linker_list)
+                generations.append(self.tagged(generation, question_id=question_id))
+
+                retrieved_records_str = "\n".join([str(r) for r in retrieved_records])
+                retrieved_records_length = self.metric_tok_length(retrieved_records_str)
+
+                rag_run.append({"ID": question_id, "Question": question, "Model_Answer": entry["Answer"], "Query": cypher_query, "Final_Response": None, "Retrieved_Tok_Length": retrieved_records_length})
+
+            final_responses = iter(run_async(self.gather(generations)))
+        for run_entry in rag_run:
+            if run_entry["Final_Response"] is None:
+                run_entry["Final_Response"] = next(final_responses)
+            run_entry.update(self.usage_columns(usage_tracker.select(strategy=strategy, question_id=run_entry["ID"])))
+
+        df = pd.DataFrame(rag_run)
+        df.to_excel(run_file_path, index=False)
+        self.write_usage_summary(strategy, run_file_path)
+
+    def run_name(self, run_file_path: str):
+        return os.path.splitext(os.path.basename(run_file_path))[0]
+
+    def usage_columns(self, records: list[dict], prefix: str = ""):
+        """Per-question LLM usage totals, plus a per-caller breakdown, as run file columns."""
+        totals = usage_tracker.summarise(records, by=()).get((), {"calls": 0, "latency": 0.0, "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0})
+        by_caller = {caller: caller_totals for (caller,), caller_totals in usage_tracker.summarise(records, by=("caller",)).items()}
+        return {
+            f"{prefix}LLM_Calls": totals["calls"],
+            f"{prefix}LLM_Latency": totals["latency"],
+            f"{prefix}Prompt_Tokens": totals["prompt_tokens"],
+            f"{prefix}Completion_Tokens": totals["completion_tokens"],
+            f"{prefix}Estimated_Cost": totals["cost"],
+            f"{prefix}LLM_Usage_By_Caller": json.dumps(by_caller),
+        }
+
+    def write_usage_summary(self, strategy: str, run_file_path: str):
+        """Per-strategy totals by caller and model, written next to the run file."""
+        summary = usage_tracker.summarise(usage_tracker.select(strategy=strategy), by=("caller", "model", "source"))
+        rows = [{"Strategy": strategy, "Caller": caller, "Model": model, "Source": source, **totals} for (caller, model, source), totals in summary.items()]
+        pd.DataFrame(rows).to_excel(f"{os.path.splitext(run_file_path)[0]}_usage.xlsx", index=False)
+
+    async def tagged(self, coroutine, **tags):
+        with usage_tracker.scope(**tags):
+            return await coroutine
+
+    def run_profile(self, retriever, profile_file_path: str, model: str = None, model_answers_path=QA_PATH):
+        """Time retrieval and generation per question under cProfile. Pair with LLM_CASSETTE_MODE=replay to run offline."""
+        df_model = pd.read_excel(model_answers_path).to_dict(orient="records")
+
+        timings = []
+        profiler = cProfile.Profile()
         for entry in df_model:
-            question_id = entry["ID"]
             question = entry["Question"]
 
+            profiler.enable()
+            start = time.perf_counter()
             cypher_query, retrieved_records, error = retriever.retrieve(question, model=model)
-            if error:
-                rag_run.append({"ID": question_id, "Question": question, "Model_Answer": entry["Answer"], "Query": cypher_query, "Final_Response": f"EXECUTION ERROR: {error}", "Retrieved_Tok_Length": 0})
-                continue
+            retrieve_time = time.perf_counter() - start
 
-            if retriever.allow_linking:
-                linker_list = retriever.linker.linker_list_prev
-                final_response = self.generator.generate(question=question, retrieved_nodes=retrieved_records, schema_context=retriever.schema_context(), model=model, cypher_query=cypher_query, linker_list=linker_list)
-            else:
-                final_response = self.generator.generate(question=question, retrieved_nodes=retrieved_records, schema_context=retriever.schema_context(), model=model, cypher_query=cypher_query)
+            start = time.perf_counter()
+            if not error:
+                linker_list = retriever.linker.linker_list_prev if retriever.allow_linking else None
+                self.generator.generate(question=question, retrieved_nodes=retrieved_records, schema_context=retriever.schema_context(), model=model, cypher_query=cypher_query, linker_list=linker_list)
+            generate_time = time.perf_counter() - start
+            profiler.disable()
 
-            retrieved_records_str = "\n".join([str(r) for r in retrieved_records])
-            retrieved_records_length = self.metric_tok_length(retrieved_records_str)
+            timings.append({"ID": entry["ID"], "Retrieve_Seconds": round(retrieve_time, 4), "Generate_Seconds": round(generate_time, 4), "Error": bool(error)})
 
-            rag_run.append({"ID": question_id, "Question": question, "Model_Answer": entry["Answer"], "Query": cypher_query, "Final_Response": final_response, "Retrieved_Tok_Length": retrieved_records_length})
+        profiler.dump_stats(profile_file_path)
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
 
-        df = pd.DataFrame(rag_run)
-        df.to_excel(run_file_path, index=False)
+        df = pd.DataFrame(timings)
+        print(df.describe())
+        return df
+
+    async def gather(self, coroutines):
+        return await asyncio.gather(*coroutines)
 
     def metric_tok_length(self, text: str):
         enc = tiktoken.get_encoding("o200k_base") # tokeniser for gpt-4.1
@@ -74,17 +159,18 @@ class QASet:
     def run_extract_nuggets(self, model_answers_path=QA_PATH):
         df_model = pd.read_excel(model_answers_path).to_dict(orient="records")
 
-        extracted = []
+        prompts = []
         for entry in df_model:
-            question = entry["Question"]
-            model_answer = entry["Answer"]
-
             prompt = self.nugget_extraction_prompt.format(
-                question=question,
-                model_answer=model_answer
+                question=entry["Question"],
+                model_answer=entry["Answer"]
             )
             self.logger.info(f"Prompting LLM using: {prompt}")
-            response = self.chat_client.chat(prompt=prompt, response_format=NuggetExtractionResponse)
+            prompts.append(prompt)
+        responses = run_async(self.async_chat_client.chat_many(prompts, response_format=NuggetExtractionResponse, prompt_template=self.nugget_extraction_prompt_path, caller="nugget-extract"))
+
+        extracted = []
+        for entry, response in zip(df_model, responses):
             self.logger.info(f"Received response: {response}")
 
             # Process response
@@ -99,12 +185,28 @@ class QASet:
         df_run = pd.read_excel(run_file_path).to_dict(orient="records")
         df_model = pd.read_excel(model_answers_path).to_dict(orient="records")
 
-        results = []
-        for run_entry, model_entry in zip(df_run, df_model):
-            question = model_entry["Question"]
+        # Build all matching prompts first so they can be judged concurrently
+        entries = list(zip(df_run, df_model))
+        prompts = {}
+        for i, (run_entry, model_entry) in enumerate(entries):
             candidate_answer = run_entry["Final_Response"]
-
             if candidate_answer[:15] == "EXECUTION ERROR":
+                continue
+
+            prompt = self.nugget_matching_prompt.format(
+                question=model_entry["Question"],
+                model_nuggets=model_entry["Model_Nuggets"],
+                generated_answer=candidate_answer
+            )
+            self.logger.info(f"Prompting LLM using: {prompt}")
+            prompts[i] = self.tagged(self.async_chat_client.chat(prompt, response_format=NuggetMatchingResponse, prompt_template=self.nugget_matching_prompt_path), question_id=run_entry["ID"])
+        strategy = self.run_name(run_file_path)
+        with usage_tracker.scope(strategy=strategy):
+            responses = dict(zip(prompts, run_async(self.gather(prompts.values()))))
+
+        results = []
+        for i in range(len(entries)):
+            if i not in responses:
                 results.append({
                     "Nugget_Results": None,
                     "Extra_Claims": None,
@@ -113,13 +215,7 @@ class QASet:
                 })
                 continue
 
-            prompt = self.nugget_matching_prompt.format(
-                question=question,
-                model_nuggets=model_entry["Model_Nuggets"],
-                generated_answer=candidate_answer
-            )
-            self.logger.info(f"Prompting LLM using: {prompt}")
-            response = self.chat_client.chat(prompt=prompt, response_format=NuggetMatchingResponse)
+            response = responses[i]
             self.logger.info(f"Received response: {response}")
 
             # Process response
@@ -130,7 +226,8 @@ class QASet:
                 "Nugget_Results": json.dumps(response_json["nugget_results"], ensure_ascii=False),
                 "Extra_Claims": json.dumps(response_json["extra_claims"], ensure_ascii=False),
                 "Precision": precision,
-                "Recall": recall
+                "Recall": recall,
+                **self.usage_columns(usage_tracker.select(strategy=strategy, question_id=entries[i][0]["ID"], caller="nugget-match"), prefix="Judge_")
             })
 
         df_results = pd.DataFrame(results)
@@ -1,7 +1,7 @@
 import logging
 import tiktoken
 
-from llm import ChatClient, chat_model_choices
+from llm import ChatClient, AsyncChatClient, chat_model_choices
 
 # Prompts
 PROMPT_PATH = "generators/generator_prompt.txt"
@@ -10,16 +10,44 @@ PROMPT_PATH = "generators/generator_prompt.txt"
 class FinalGenerator:
     def __init__(self, prompt_path: str = PROMPT_PATH):
         self.logger = logging.getLogger(self.__class__.__name__)
-        self.client = ChatClient()
+        self.client = ChatClient(caller="generator")
+        self.async_client = AsyncChatClient(caller="generator")
 
+        self.prompt_path = prompt_path
         with open(prompt_path) as f:
             self.prompt = f.read()
 
     def generate(self, question: str, retrieved_nodes: list[dict], schema_context: str, model: str = chat_model_choices[0], cypher_query: str = None, linker_list: str = None):
+        prompt, prewritten_response = self.build_prompt(question, retrieved_nodes, schema_context, cypher_query, linker_list)
+        if prewritten_response:
+            return prewritten_response
+
+        # Generate final response from LLM
+        final_response = self.client.chat(prompt=prompt, model=model, prompt_template=self.prompt_path)
+        return final_response
+
+    def generate_stream(self, question: str, retrieved_nodes: list[dict], schema_context: str, model: str = chat_model_choices[0], cypher_query: str = None, linker_list: str = None):
+        """Streaming variant of generate, yielding the response in pieces as it is produced."""
+        prompt, prewritten_response = self.build_prompt(question, retrieved_nodes, schema_context, cypher_query, linker_list)
+        if prewritten_response:
+            yield prewritten_response
+            return
+
+        yield from self.client.chat_stream(prompt=prompt, model=model, prompt_template=self.prompt_path)
+
+    async def agenerate(self, question: str, retrieved_nodes: list[dict], schema_context: str, model: str = chat_model_choices[0], cypher_query: str = None, linker_list: str = None):
+        prompt, prewritten_response = self.build_prompt(question, retrieved_nodes, schema_context, cypher_query, linker_list)
+        if prewritten_response:
+            return prewritten_response
+
+        return await self.async_client.chat(prompt=prompt, model=model, prompt_template=self.prompt_path)
+
+    def build_prompt(self, question: str, retrieved_nodes: list[dict], schema_context: str, cypher_query: str = None, linker_list: str = None):
+        """Returns the generator prompt, or a pre-written response when no LLM call should be made."""
         # Cases to use prewritten answers
         if len(retrieved_nodes) == 0:
             self.logger.info("No nodes retrieved, returning pre-written response.")
-            return "No records could be found. Either the answer is that there are no such entities, or that the context given was insufficient to retrieve the right records. If you believe it is the latter, try rephrasing your question."
+            return None, "No records could be found. Either the answer is that there are no such entities, or that the context given was insufficient to retrieve the right records. If you believe it is the latter, try rephrasing your question."
 
         context_string = "\n".join([str(r) for r in retrieved_nodes]) if retrieved_nodes else "No relevant records found."
         enc = tiktoken.get_encoding("o200k_base")
@@ -27,7 +55,7 @@ class FinalGenerator:
         self.logger.info(f"Num tokens: {num_tokens}")
         if num_tokens > 5000:
             self.logger.info(f"Too much information retrieved: {len(retrieved_nodes)} nodes with {num_tokens} tokens, returning pre-written response.")
-            return "Too many records were retrieved. Either the answer contains that many entities, or the model gave a bad plan of retrieval. If you believe it is the latter, try entering the question again."
+            return None, "Too many records were retrieved. Either the answer contains that many entities, or the model gave a bad plan of retrieval. If you believe it is the latter, try entering the question again."
 
         # Build prompt
         prompt = self.prompt.format(
@@ -41,7 +69,4 @@ class FinalGenerator:
             prompt += f"\n### Entity linking\n\nThis RAG strategy also involved using entity linking. This fuzzy matched list of entities was provided to the retriever before they generated the cypher query. They were instructed to pick critically.\n\nThe user asking the question may be mistaken about the right type, in which case the retriever was instructed to retrieve for other reasonable types if they contained very similar names. The user may also link together names that should be split across multiple entity types, in which case the retriever was asked to check combinations of entities that make up the right names:\n\n{linker_list}"
 
         self.logger.info(f"Prompting LLM using: {prompt}")
-
-        # Generate final response from LLM
-        final_response = self.client.chat(prompt=prompt, model=model)
-        return final_response
+        return prompt, None
@@ -1,7 +1,7 @@
 import logging
 import json
 
-from llm import ChatClient
+from llm import ChatClient, AsyncChatClient
 from databases import Neo4j_DB
 
 LINKER_PROMPT_PATH = "linking/linker_prompt.txt"
@@ -12,11 +12,13 @@ class EntityLinker:
     def __init__(self, graph: Neo4j_DB, prompt_path: str = LINKER_PROMPT_PATH, retrieval_prompt_ex_path: str = RETRIEVAL_PROMPT_EXTENSION):
         self.logger = logging.getLogger(self.__class__.__name__)
 
-        self.client = ChatClient()
+        self.client = ChatClient(caller="linker")
+        self.async_client = AsyncChatClient(caller="linker")
         self.graph = graph
 
         self.linker_list_prev = None
 
+        self.prompt_path = prompt_path
         with open(prompt_path) as f:
             self.prompt = f.read()
 
@@ -29,7 +31,18 @@ class EntityLinker:
         )
         self.logger.debug(f"Prompting entity extraction LLM using {prompt}")
 
-        response = self.client.chat(prompt=prompt, model=model)
+        response = self.client.chat(prompt=prompt, model=model, prompt_template=self.prompt_path)
+        self.logger.info(f"Retrieved raw response from LLM: {response}")
+
+        return json.loads(response)
+
+    async def aextract(self, question: str, model: str = "gpt-4.1-mini-2025-04-14"):
+        prompt = self.prompt.format(
+            phrase=question
+        )
+        self.logger.debug(f"Prompting entity extraction LLM using {prompt}")
+
+        response = await self.async_client.chat(prompt=prompt, model=model, prompt_template=self.prompt_path)
         self.logger.info(f"Retrieved raw response from LLM: {response}")
 
         return json.loads(response)
@@ -40,12 +53,14 @@ class EntityLinker:
 
         matches = ""
         for phrase in phrases:
-            matches += f"For '{phrase}':\n" + "\n".join(str(m) for m in self.graph.neo4j.ftsearch(phrase)) + "\n\n"
+            matches += f"For '{phrase}':\n" + "\n".join(str(m) for m in self.graph.cypher.ftsearch(phrase)) + "\n\n"
 
         return matches
 
-    def get_linked_context(self, question: str, model: str = "gpt-4.1-mini-2025-04-14"):
-        extraction = self.extract(question, model)
+    def get_linked_context(self, question: str, model: str = "gpt-4.1-mini-2025-04-14", extraction: list[str] = None):
+        """Pass an extraction from aextract to skip the synchronous LLM call (e.g. when a run gathers them up front)."""
+        if extraction is None:
+            extraction = self.extract(question, model)
         extraction = [e.replace("(", "").replace(")", "") for e in extraction]
         matches = self.fuzzy_search(extraction)
 
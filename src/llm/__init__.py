@@ -0,0 +1,5 @@
+from .clients import ChatClient, AsyncChatClient, EmbeddingClient, chat_model_choices
+from .cache import EmbeddingCache, ResponseCache, get_embedding_cache, get_response_cache
+from .cassette import Cassette, CassetteMissError, get_cassette
+from .usage import UsageTracker, usage_tracker, estimate_cost
+from .registry import get_openai_client, get_async_openai_client, close_async_openai_client, run_async
@@ -0,0 +1,259 @@
+import logging
+import os
+import re
+import sqlite3
+import hashlib
+import threading
+import time
+import json
+from array import array
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "databases/cache/embeddings.sqlite3")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", 200_000))
+EMBEDDING_CACHE_MEMORY_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MEMORY_ENTRIES", 4096))
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "databases/cache/responses.sqlite3")
+
+class EmbeddingCache:
+    """Content-addressed embedding cache: in-process LRU in front of an SQLite store."""
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES, memory_entries: int = EMBEDDING_CACHE_MEMORY_ENTRIES):
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+        self.path = path
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+
+        self.memory: OrderedDict[str, list[float]] = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.conn: sqlite3.Connection = None
+        if path: # empty path keeps the cache in-process only
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, model TEXT NOT NULL, text TEXT NOT NULL, vector BLOB NOT NULL, last_access REAL NOT NULL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings (last_access)")
+            self.conn.commit()
+            self.disk_entries = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            self.logger.info(f"Embedding cache at {path} loaded with {self.disk_entries} entries")
+
+    @staticmethod
+    def normalise(text: str) -> str:
+        return re.sub(r"\s+", " ", text.strip().lower())
+
+    def key(self, model: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\x00{self.normalise(text)}".encode()).hexdigest()
+
+    def get(self, model: str, text: str) -> list[float] | None:
+        key = self.key(model, text)
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.memory_hits += 1
+                return self.memory[key]
+
+            if self.conn is not None:
+                row = self.conn.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self.conn.execute("UPDATE embeddings SET last_access = ? WHERE key = ?", (time.time(), key))
+                    self.conn.commit()
+                    vector = array("f", row[0]).tolist()
+                    self._remember(key, vector)
+                    self.disk_hits += 1
+                    return vector
+
+            self.misses += 1
+            return None
+
+    def put(self, model: str, text: str, vector: list[float]):
+        key = self.key(model, text)
+        with self.lock:
+            self._remember(key, vector)
+            if self.conn is None:
+                return
+
+            # rowcount also counts a REPLACE, so only a row the IGNORE actually inserted is a new entry
+            vector_blob = array("f", vector).tobytes()
+            cursor = self.conn.execute(
+                "INSERT OR IGNORE INTO embeddings (key, model, text, vector, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, model, self.normalise(text), vector_blob, time.time())
+            )
+            if cursor.rowcount:
+                self.disk_entries += 1
+            else:
+                self.conn.execute("UPDATE embeddings SET vector = ?, last_access = ? WHERE key = ?", (vector_blob, time.time(), key))
+            self.conn.commit()
+            if self.disk_entries > self.max_entries:
+                self._evict()
+
+    def _remember(self, key: str, vector: list[float]):
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def _evict(self):
+        # Drop least recently used rows down to 90% of the bound so eviction doesn't run on every insert
+        target = int(self.max_entries * 0.9)
+        excess = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] - target
+        if excess <= 0:
+            return
+
+        self.conn.execute(
+            "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+            (excess,)
+        )
+        self.conn.commit()
+        self.evictions += excess
+        self.disk_entries = target
+        self.logger.info(f"Evicted {excess} least recently used embeddings from cache")
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            if self.conn is not None:
+                self.conn.execute("DELETE FROM embeddings")
+                self.conn.commit()
+                self.conn.execute("VACUUM")
+                self.disk_entries = 0
+
+    def stats(self) -> dict[str, any]:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "memory_entries": len(self.memory),
+            "disk_entries": self.disk_entries if self.conn is not None else 0,
+        }
+
+_shared_embedding_cache: EmbeddingCache = None
+_shared_cache_lock = threading.Lock()
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Process-wide embedding cache, shared by every EmbeddingClient."""
+    global _shared_embedding_cache
+    with _shared_cache_lock:
+        if _shared_embedding_cache is None:
+            _shared_embedding_cache = EmbeddingCache()
+        return _shared_embedding_cache
+
+class ResponseCache:
+    """Persistent chat response cache keyed on (model, prompt, response_format schema, prompt template file)."""
+    def __init__(self, path: str = RESPONSE_CACHE_PATH):
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+        self.path = path
+        self.lock = threading.Lock()
+        self.template_hashes: dict[str, tuple[float, str]] = {}
+
+        self.hits = 0
+        self.misses = 0
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, model TEXT NOT NULL, prompt_hash TEXT NOT NULL, schema_hash TEXT NOT NULL, template_hash TEXT NOT NULL, response TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self.conn.commit()
+
+    @staticmethod
+    def hash_text(text: str) -> str:
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    @staticmethod
+    def hash_schema(response_format) -> str:
+        if response_format is None:
+            return ""
+        return ResponseCache.hash_text(json.dumps(response_format.model_json_schema(), sort_keys=True))
+
+    def hash_template(self, template_path: str) -> str:
+        """Hash of the prompt template file contents, recomputed only when the file changes."""
+        if not template_path:
+            return ""
+
+        mtime = os.path.getmtime(template_path)
+        if template_path not in self.template_hashes or self.template_hashes[template_path][0] != mtime:
+            with open(template_path, "rb") as f:
+                self.template_hashes[template_path] = (mtime, hashlib.sha256(f.read()).hexdigest())
+        return self.template_hashes[template_path][1]
+
+    def key(self, model: str, prompt: str, response_format=None, template_path: str = None) -> tuple[str, dict[str, str]]:
+        parts = {
+            "model": model,
+            "prompt_hash": self.hash_text(prompt),
+            "schema_hash": self.hash_schema(response_format),
+            "template_hash": self.hash_template(template_path),
+        }
+        return self.hash_text("\x00".join(parts.values())), parts
+
+    def get(self, key: str) -> str | None:
+        with self.lock:
+            row = self.conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, parts: dict[str, str], response: str):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, prompt_hash, schema_hash, template_hash, response, created) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, parts["model"], parts["prompt_hash"], parts["schema_hash"], parts["template_hash"], response, time.time())
+            )
+            self.conn.commit()
+
+    def invalidate(self, model: str = None, template_path: str = None) -> int:
+        """Remove cached responses, optionally only for one model and/or prompt template. Returns rows removed."""
+        conditions = []
+        params = []
+        if model:
+            conditions.append("model = ?")
+            params.append(model)
+        if template_path:
+            conditions.append("template_hash = ?")
+            params.append(self.hash_template(template_path))
+
+        with self.lock:
+            cursor = self.conn.execute(f"DELETE FROM responses {'WHERE ' + ' AND '.join(conditions) if conditions else ''}", params)
+            self.conn.commit()
+        self.logger.info(f"Invalidated {cursor.rowcount} cached responses")
+        return cursor.rowcount
+
+    def stats(self) -> dict[str, any]:
+        lookups = self.hits + self.misses
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries": entries,
+        }
+
+_shared_response_cache: ResponseCache = None
+
+def get_response_cache() -> ResponseCache:
+    """Process-wide response cache, shared by every deterministic ChatClient."""
+    global _shared_response_cache
+    with _shared_cache_lock:
+        if _shared_response_cache is None:
+            _shared_response_cache = ResponseCache()
+        return _shared_response_cache
@@ -0,0 +1,107 @@
+import logging
+import os
+import json
+import hashlib
+import threading
+import time
+import asyncio
+from dotenv import load_dotenv
+
+load_dotenv()
+LLM_CASSETTE_MODE = os.getenv("LLM_CASSETTE_MODE", "off").lower() # off | record | replay
+LLM_CASSETTE_PATH = os.getenv("LLM_CASSETTE_PATH", "databases/cassettes/default.jsonl")
+LLM_REPLAY_LATENCY = os.getenv("LLM_REPLAY_LATENCY", "0") # seconds per replayed call, or "recorded" to reuse the live latency
+
+class CassetteMissError(KeyError):
+    """Raised in replay mode when a request was never recorded."""
+
+class Cassette:
+    """Record/replay layer for LLM requests, stored as JSONL entries keyed by request hash."""
+    def __init__(self, path: str = LLM_CASSETTE_PATH, mode: str = LLM_CASSETTE_MODE, latency: str | float = LLM_REPLAY_LATENCY):
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+        if mode not in ("off", "record", "replay"):
+            raise ValueError(f"Unrecognised cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.latency = latency if latency == "recorded" else float(latency)
+
+        self.entries: dict[str, dict[str, any]] = {}
+        self.lock = threading.Lock()
+        self.replayed = 0
+        self.recorded = 0
+
+        if mode == "off":
+            return
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries[entry["key"]] = entry
+        elif mode == "replay":
+            raise FileNotFoundError(f"No cassette to replay at {path}")
+        self.logger.info(f"Cassette at {path} opened in {mode} mode with {len(self.entries)} entries")
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == "record"
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    @staticmethod
+    def key(kind: str, **request) -> str:
+        # Requests are hashed before any timestamp prefix is added, so the same run replays identically
+        return hashlib.sha256(json.dumps({"kind": kind, **request}, sort_keys=True).encode()).hexdigest()
+
+    def lookup(self, key: str) -> dict[str, any]:
+        entry = self.entries.get(key)
+        if entry is None:
+            raise CassetteMissError(f"Request {key} not found in cassette {self.path}")
+        with self.lock:
+            self.replayed += 1
+        return entry
+
+    def delay(self, entry: dict[str, any]) -> float:
+        return entry["latency"] if self.latency == "recorded" else self.latency
+
+    def replay(self, key: str) -> dict[str, any]:
+        entry = self.lookup(key)
+        time.sleep(self.delay(entry))
+        return entry
+
+    def replay_many(self, keys: list[str]) -> list[dict[str, any]]:
+        # One batched request, so one synthetic delay
+        entries = [self.lookup(key) for key in keys]
+        time.sleep(max((self.delay(entry) for entry in entries), default=0))
+        return entries
+
+    async def areplay(self, key: str) -> dict[str, any]:
+        entry = self.lookup(key)
+        await asyncio.sleep(self.delay(entry))
+        return entry
+
+    def record(self, key: str, kind: str, response, latency: float, usage: dict[str, int] = None):
+        entry = {"key": key, "kind": kind, "latency": round(latency, 4), "usage": usage or {}, "response": response}
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = entry
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+            self.recorded += 1
+
+_shared_cassette: Cassette = None
+_shared_cassette_lock = threading.Lock()
+
+def get_cassette() -> Cassette:
+    """Process-wide cassette, configured from the environment."""
+    global _shared_cassette
+    with _shared_cassette_lock:
+        if _shared_cassette is None:
+            _shared_cassette = Cassette()
+        return _shared_cassette
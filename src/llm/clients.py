@@ -0,0 +1,356 @@
+import logging
+import os
+import asyncio
+import random
+import weakref
+import time
+import contextvars
+from pydantic import BaseModel, RootModel
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+import openai
+
+from .cache import EmbeddingCache, ResponseCache, get_embedding_cache, get_response_cache
+from .cassette import Cassette, get_cassette
+from .usage import usage_tracker
+from .registry import get_openai_client, get_async_openai_client
+
+chat_model_choices = [
+    "gpt-4.1-2025-04-14", # main experiments in paper
+    "gpt-5.2-2025-12-11"
+]
+
+# Provider limits for a single embeddings request (2048 inputs, 300k tokens), kept with some headroom
+EMBEDDING_CHUNK_SIZE = 1024
+EMBEDDING_CHUNK_TOKENS = 250_000
+EMBEDDING_MAX_WORKERS = 4
+
+# Async chat defaults, overridable per client
+CHAT_MAX_CONCURRENCY = int(os.getenv("CHAT_MAX_CONCURRENCY", 8))
+CHAT_MAX_RETRIES = int(os.getenv("CHAT_MAX_RETRIES", 6))
+CHAT_TIMEOUT = float(os.getenv("CHAT_TIMEOUT", 120))
+
+# Deterministic mode drops the timestamp prefix and serves repeated prompts from the response cache
+CHAT_DETERMINISTIC = os.getenv("CHAT_DETERMINISTIC", "false").lower() in ("1", "true", "yes")
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+    asyncio.TimeoutError,
+)
+
+class ChatClient:
+    def __init__(self, deterministic: bool = CHAT_DETERMINISTIC, bypass_cache: bool = False, cache: ResponseCache = None, cassette: Cassette = None, caller: str = "chat"):
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+        load_dotenv()
+        self.client = get_openai_client()
+        self.cassette = cassette or get_cassette()
+        self.caller = caller # tag for usage accounting, e.g. linker, cypher-gen, generator
+
+        # bypass_cache keeps the paper-reproduction behaviour (timestamped prompts, no cache) regardless of mode
+        self.deterministic = deterministic and not bypass_cache
+        self.cache = (cache or get_response_cache()) if self.deterministic else None
+
+    def chat(self, prompt: str, model: str = chat_model_choices[0], response_format: BaseModel | RootModel = None, prompt_template: str = None, caller: str = None) -> str:
+        if model is None:
+            model = chat_model_choices[0]
+        caller = caller or self.caller
+        start = time.perf_counter()
+
+        if self.deterministic:
+            cache_key, cache_parts = self.cache.key(model, prompt, response_format, prompt_template)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                self.logger.info(f"Response cache hit at OpenAI model {model}")
+                usage_tracker.record(caller, model, time.perf_counter() - start, source="cache")
+                return cached
+
+        cassette_key = self.cassette.key("chat", model=model, prompt=prompt, schema=ResponseCache.hash_schema(response_format))
+        if self.cassette.replaying:
+            self.logger.info(f"Replaying Chat LLM response for OpenAI model {model}")
+            entry = self.cassette.replay(cassette_key)
+            content = entry["response"]
+            usage_tracker.record(caller, model, time.perf_counter() - start, **entry["usage"], source="replay")
+        else:
+            if not self.deterministic:
+                prompt = f"{str(datetime.now())}\n{prompt}" # prevents prompt caching
+            self.logger.info(f"Prompting Chat LLM at OpenAI model {model}")
+
+            response = self.client.beta.chat.completions.parse(
+                model=model,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0,
+                seed=12345, # shouldn't matter, just in case
+                **({"response_format": response_format} if response_format is not None else {})
+            )
+            content = response.choices[0].message.content.strip()
+            latency = time.perf_counter() - start
+            usage = self.usage_tokens(response)
+            usage_tracker.record(caller, model, latency, **usage)
+
+            if self.cassette.recording:
+                self.cassette.record(cassette_key, "chat", content, latency, usage)
+
+        if self.deterministic:
+            self.cache.put(cache_key, cache_parts, content)
+        return content
+
+    def chat_stream(self, prompt: str, model: str = chat_model_choices[0], prompt_template: str = None, caller: str = None):
+        """Streaming variant of chat, yielding content deltas as they arrive. Cached and replayed responses arrive whole."""
+        if model is None:
+            model = chat_model_choices[0]
+        caller = caller or self.caller
+        start = time.perf_counter()
+
+        if self.deterministic:
+            cache_key, cache_parts = self.cache.key(model, prompt, None, prompt_template)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                self.logger.info(f"Response cache hit at OpenAI model {model}")
+                usage_tracker.record(caller, model, time.perf_counter() - start, source="cache")
+                yield cached
+                return
+
+        cassette_key = self.cassette.key("chat", model=model, prompt=prompt, schema=ResponseCache.hash_schema(None))
+        if self.cassette.replaying:
+            self.logger.info(f"Replaying Chat LLM response for OpenAI model {model}")
+            entry = self.cassette.replay(cassette_key)
+            content = entry["response"]
+            usage_tracker.record(caller, model, time.perf_counter() - start, **entry["usage"], source="replay")
+            yield content
+        else:
+            if not self.deterministic:
+                prompt = f"{str(datetime.now())}\n{prompt}" # prevents prompt caching
+            self.logger.info(f"Streaming Chat LLM at OpenAI model {model}")
+
+            stream = self.client.chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0,
+                seed=12345, # shouldn't matter, just in case
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+
+            parts = []
+            usage = {}
+            for chunk in stream:
+                if chunk.usage is not None:
+                    usage = self.usage_tokens(chunk)
+                if not chunk.choices or not chunk.choices[0].delta.content:
+                    continue
+
+                delta = chunk.choices[0].delta.content
+                if not parts: # match the stripped output of chat()
+                    delta = delta.lstrip()
+                    if not delta:
+                        continue
+                    self.logger.info(f"Time to first token: {time.perf_counter() - start:.3f}s")
+                parts.append(delta)
+                yield delta
+
+            content = "".join(parts).strip()
+            latency = time.perf_counter() - start
+            usage_tracker.record(caller, model, latency, **usage)
+
+            if self.cassette.recording:
+                self.cassette.record(cassette_key, "chat", content, latency, usage)
+
+        if self.deterministic:
+            self.cache.put(cache_key, cache_parts, content)
+
+    @staticmethod
+    def usage_tokens(response) -> dict[str, int]:
+        if response.usage is None:
+            return {}
+        return {"prompt_tokens": response.usage.prompt_tokens, "completion_tokens": response.usage.completion_tokens}
+
+class AsyncChatClient:
+    """Asyncio counterpart of ChatClient with bounded concurrency, per-call timeouts and jittered backoff."""
+    def __init__(self, max_concurrency: int = CHAT_MAX_CONCURRENCY, max_retries: int = CHAT_MAX_RETRIES, timeout: float = CHAT_TIMEOUT, backoff_base: float = 1.0, backoff_max: float = 60.0, deterministic: bool = CHAT_DETERMINISTIC, bypass_cache: bool = False, cache: ResponseCache = None, cassette: Cassette = None, caller: str = "chat"):
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+        load_dotenv()
+        self.caller = caller
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.cassette = cassette or get_cassette()
+
+        self.deterministic = deterministic and not bypass_cache
+        self.cache = (cache or get_response_cache()) if self.deterministic else None
+
+        # Semaphores and async connection pools are bound to an event loop, so keep one set per running loop
+        self.loop_state: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, tuple[openai.AsyncOpenAI, asyncio.Semaphore]] = weakref.WeakKeyDictionary()
+
+    def get_loop_state(self):
+        loop = asyncio.get_running_loop()
+        if loop not in self.loop_state:
+            client = get_async_openai_client().with_options(max_retries=0) # retries are handled here, pool is shared
+            self.loop_state[loop] = (client, asyncio.Semaphore(self.max_concurrency))
+        return self.loop_state[loop]
+
+    async def chat(self, prompt: str, model: str = chat_model_choices[0], response_format: BaseModel | RootModel = None, prompt_template: str = None, caller: str = None) -> str:
+        if model is None:
+            model = chat_model_choices[0]
+        caller = caller or self.caller
+        client, semaphore = self.get_loop_state()
+        start = time.perf_counter()
+
+        if self.deterministic:
+            cache_key, cache_parts = self.cache.key(model, prompt, response_format, prompt_template)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                self.logger.info(f"Response cache hit at OpenAI model {model}")
+                usage_tracker.record(caller, model, time.perf_counter() - start, source="cache")
+                return cached
+
+        cassette_key = self.cassette.key("chat", model=model, prompt=prompt, schema=ResponseCache.hash_schema(response_format))
+        if self.cassette.replaying:
+            async with semaphore:
+                self.logger.info(f"Replaying Chat LLM response for OpenAI model {model}")
+                entry = await self.cassette.areplay(cassette_key)
+            content = entry["response"]
+            usage_tracker.record(caller, model, time.perf_counter() - start, **entry["usage"], source="replay")
+            if self.deterministic:
+                self.cache.put(cache_key, cache_parts, content)
+            return content
+
+        if not self.deterministic:
+            prompt = f"{str(datetime.now())}\n{prompt}" # prevents prompt caching
+
+        async with semaphore:
+            for attempt in range(self.max_retries + 1):
+                self.logger.info(f"Prompting Chat LLM at OpenAI model {model} (attempt {attempt + 1})")
+                try:
+                    attempt_start = time.perf_counter()
+                    response = await asyncio.wait_for(
+                        client.beta.chat.completions.parse(
+                            model=model,
+                            messages=[{"role": "user", "content": prompt}],
+                            temperature=0,
+                            seed=12345, # shouldn't matter, just in case
+                            timeout=self.timeout,
+                            **({"response_format": response_format} if response_format is not None else {})
+                        ),
+                        timeout=self.timeout + 5 # hard cap in case the client timeout doesn't fire
+                    )
+                    content = response.choices[0].message.content.strip()
+                    usage = ChatClient.usage_tokens(response)
+                    usage_tracker.record(caller, model, time.perf_counter() - start, **usage) # includes time spent waiting and retrying
+                    if self.cassette.recording:
+                        self.cassette.record(cassette_key, "chat", content, time.perf_counter() - attempt_start, usage)
+                    if self.deterministic:
+                        self.cache.put(cache_key, cache_parts, content)
+                    return content
+                except RETRYABLE_ERRORS as e:
+                    if attempt == self.max_retries:
+                        raise
+                    delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt)) # full jitter
+                    self.logger.warning(f"Retryable error from OpenAI ({type(e).__name__}), retrying in {delay:.2f}s")
+                    await asyncio.sleep(delay)
+
+    async def chat_many(self, prompts: list[str], model: str = chat_model_choices[0], response_format: BaseModel | RootModel = None, prompt_template: str = None, caller: str = None) -> list[str]:
+        """Run prompts concurrently (bounded by the semaphore), returning responses in prompt order."""
+        return await asyncio.gather(*(self.chat(prompt, model=model, response_format=response_format, prompt_template=prompt_template, caller=caller) for prompt in prompts))
+
+class EmbeddingClient:
+    def __init__(self, use_cache: bool = True, cache: EmbeddingCache = None, cassette: Cassette = None, caller: str = "embedding"):
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+        load_dotenv()
+        self.client = get_openai_client()
+        self.cache = (cache or get_embedding_cache()) if use_cache else None
+        self.cassette = cassette or get_cassette()
+        self.caller = caller
+
+    def embed(self, text: str, model: str = "text-embedding-3-small"):
+        if self.cache is not None:
+            vector = self.cache.get(model, text)
+            if vector is not None:
+                self.logger.info(f"Embedding cache hit at OpenAI model {model}")
+                return vector
+            text = self.cache.normalise(text) # embed exactly what the cache key describes
+
+        self.logger.info(f"Prompting Embedding LLM at OpenAI model {model}")
+        vector = self.embed_chunk([text], model)[0]
+
+        if self.cache is not None:
+            self.cache.put(model, text, vector)
+        return vector
+
+    def embed_many(self, texts: list[str], model: str = "text-embedding-3-small", chunk_size: int = EMBEDDING_CHUNK_SIZE, max_workers: int = EMBEDDING_MAX_WORKERS):
+        """Embed several texts, deduplicated and sent as concurrent provider-sized chunks. Output is in input order."""
+        if self.cache is not None:
+            texts = [self.cache.normalise(text) for text in texts]
+
+        vectors = {}
+        missing = []
+        for text in dict.fromkeys(texts): # deduplicate, keeping first-seen order
+            vector = self.cache.get(model, text) if self.cache is not None else None
+            if vector is None:
+                missing.append(text)
+            else:
+                vectors[text] = vector
+
+        chunks = self.chunk_texts(missing, chunk_size)
+        if chunks:
+            self.logger.info(f"Prompting Embedding LLM at OpenAI model {model} for {len(missing)} texts in {len(chunks)} chunks ({len(texts) - len(missing)} reused)")
+            # Each chunk runs in a copy of the caller's context so usage records keep their tags
+            contexts = [contextvars.copy_context() for _ in chunks]
+            with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunks)))) as executor:
+                for chunk, chunk_vectors in executor.map(lambda chunk, context: (chunk, context.run(self.embed_chunk, chunk, model)), chunks, contexts):
+                    for text, vector in zip(chunk, chunk_vectors):
+                        vectors[text] = vector
+                        if self.cache is not None:
+                            self.cache.put(model, text, vector)
+
+        return [vectors[text] for text in texts]
+
+    def embed_chunk(self, chunk: list[str], model: str):
+        # Cassette entries are per text, so replay doesn't depend on how texts were chunked when recording
+        cassette_keys = [self.cassette.key("embedding", model=model, input=text) for text in chunk]
+        start = time.perf_counter()
+        if self.cassette.replaying:
+            entries = self.cassette.replay_many(cassette_keys)
+            prompt_tokens = sum(entry["usage"].get("prompt_tokens", 0) for entry in entries)
+            usage_tracker.record(self.caller, model, time.perf_counter() - start, prompt_tokens=prompt_tokens, source="replay")
+            return [entry["response"] for entry in entries]
+
+        embedding = self.client.embeddings.create(
+            input=chunk,
+            model=model
+        )
+        vectors = [data.embedding for data in sorted(embedding.data, key=lambda data: data.index)]
+        latency = time.perf_counter() - start
+        prompt_tokens = embedding.usage.prompt_tokens if embedding.usage else 0
+        usage_tracker.record(self.caller, model, latency, prompt_tokens=prompt_tokens)
+
+        if self.cassette.recording:
+            total_chars = sum(len(text) for text in chunk) or 1
+            for cassette_key, text, vector in zip(cassette_keys, chunk, vectors):
+                # Per-text token counts are apportioned from the chunk total
+                self.cassette.record(cassette_key, "embedding", vector, latency, {"prompt_tokens": round(prompt_tokens * len(text) / total_chars)})
+        return vectors
+
+    def chunk_texts(self, texts: list[str], chunk_size: int, chunk_tokens: int = EMBEDDING_CHUNK_TOKENS):
+        chunks = []
+        current = []
+        current_tokens = 0
+        for text in texts:
+            num_tokens = len(text) // 3 + 1 # conservative estimate, avoids loading a tokeniser for every batch
+            if current and (len(current) >= chunk_size or current_tokens + num_tokens > chunk_tokens):
+                chunks.append(current)
+                current = []
+                current_tokens = 0
+            current.append(text)
+            current_tokens += num_tokens
+        if current:
+            chunks.append(current)
+        return chunks
@@ -0,0 +1,73 @@
+import logging
+import os
+import asyncio
+import threading
+import weakref
+import importlib.util
+from dotenv import load_dotenv
+import httpx
+import openai
+
+load_dotenv()
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", 32))
+OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", 16))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", 60))
+OPENAI_HTTP2 = os.getenv("OPENAI_HTTP2", "true").lower() in ("1", "true", "yes")
+
+logger = logging.getLogger("OpenAIClientRegistry")
+
+_sync_client: openai.OpenAI = None
+_async_clients: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, openai.AsyncOpenAI] = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+def http2_enabled() -> bool:
+    # httpx only speaks HTTP/2 when the optional h2 package is installed
+    return OPENAI_HTTP2 and importlib.util.find_spec("h2") is not None
+
+def http_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+        keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY
+    )
+
+def get_openai_client() -> openai.OpenAI:
+    """Process-wide OpenAI client, so every ChatClient/EmbeddingClient shares one keep-alive connection pool."""
+    global _sync_client
+    with _lock:
+        if _sync_client is None:
+            http2 = http2_enabled()
+            _sync_client = openai.OpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                http_client=openai.DefaultHttpxClient(limits=http_limits(), http2=http2)
+            )
+            logger.info(f"Created shared OpenAI client (max connections {OPENAI_MAX_CONNECTIONS}, HTTP/2 {'on' if http2 else 'off'})")
+        return _sync_client
+
+def get_async_openai_client() -> openai.AsyncOpenAI:
+    """Shared AsyncOpenAI client for the running event loop (async connection pools can't cross loops)."""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        if loop not in _async_clients:
+            _async_clients[loop] = openai.AsyncOpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                http_client=openai.DefaultAsyncHttpxClient(limits=http_limits(), http2=http2_enabled())
+            )
+        return _async_clients[loop]
+
+async def close_async_openai_client():
+    """Close the running loop's shared AsyncOpenAI client, if it has one. Must run before the loop ends, while its sockets can still be closed."""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        client = _async_clients.pop(loop, None)
+    if client is not None:
+        await client.close()
+
+def run_async(coroutine):
+    """asyncio.run for code using the shared async client: the loop's client and connection pool are closed before the loop is."""
+    async def main():
+        try:
+            return await coroutine
+        finally:
+            await close_async_openai_client()
+    return asyncio.run(main())
@@ -0,0 +1,83 @@
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# USD per 1M tokens (input, output), from OpenAI's published pricing. Unknown models are costed as None.
+MODEL_PRICES = {
+    "gpt-5.2-2025-12-11": (1.75, 14.00),
+    "gpt-4.1-2025-04-14": (2.00, 8.00),
+    "gpt-4.1-mini-2025-04-14": (0.40, 1.60),
+    "text-embedding-3-small": (0.02, 0.0),
+}
+
+usage_tags: contextvars.ContextVar[dict[str, any]] = contextvars.ContextVar("usage_tags", default={})
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float | None:
+    if model not in MODEL_PRICES:
+        return None
+    input_price, output_price = MODEL_PRICES[model]
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+class UsageTracker:
+    """Collects one record per LLM call (caller, model, latency, tokens, cost) tagged with the active scope."""
+    def __init__(self):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.records: list[dict[str, any]] = []
+        self.lock = threading.Lock()
+        self.unpriced: set[str] = set() # models already warned about
+
+    @contextmanager
+    def scope(self, **tags):
+        """Tag every call made inside the block, e.g. scope(strategy="row_text", question_id=3). Nested scopes merge."""
+        token = usage_tags.set({**usage_tags.get(), **tags})
+        try:
+            yield
+        finally:
+            usage_tags.reset(token)
+
+    def record(self, caller: str, model: str, latency: float, prompt_tokens: int = 0, completion_tokens: int = 0, source: str = "live"):
+        record = {
+            **usage_tags.get(),
+            "caller": caller,
+            "model": model,
+            "source": source, # live, cache or replay
+            "latency": round(latency, 4),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "cost": estimate_cost(model, prompt_tokens, completion_tokens) if source == "live" else 0.0,
+        }
+        with self.lock:
+            self.records.append(record)
+            warn = record["cost"] is None and model not in self.unpriced
+            if warn:
+                self.unpriced.add(model)
+        if warn:
+            self.logger.warning(f"No price for model {model} in MODEL_PRICES, its cost is reported as NaN")
+        self.logger.debug(f"LLM usage: {record}")
+
+    def select(self, **tags) -> list[dict[str, any]]:
+        with self.lock:
+            return [r for r in self.records if all(r.get(k) == v for k, v in tags.items())]
+
+    def summarise(self, records: list[dict[str, any]] = None, by: tuple[str, ...] = ("caller",)) -> dict[tuple, dict[str, any]]:
+        """Aggregate calls, latency, tokens and cost over the given record fields."""
+        summary = {}
+        for r in (self.select() if records is None else records):
+            group = tuple(r.get(k) for k in by)
+            totals = summary.setdefault(group, {"calls": 0, "latency": 0.0, "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0})
+            totals["calls"] += 1
+            totals["latency"] += r["latency"]
+            totals["prompt_tokens"] += r["prompt_tokens"]
+            totals["completion_tokens"] += r["completion_tokens"]
+            totals["cost"] += float("nan") if r["cost"] is None else r["cost"] # an unpriced call makes the total unknown rather than low
+        for totals in summary.values():
+            totals["latency"] = round(totals["latency"], 4)
+            totals["cost"] = round(totals["cost"], 8)
+        return summary
+
+    def clear(self):
+        with self.lock:
+            self.records.clear()
+
+usage_tracker = UsageTracker()
@@ -2,6 +2,9 @@ import logging
 import sys
 
 from scopes import PropertyTextScopeGraph, ConceptTextScopeGraph, RowTextScopeGraph, RowAllScopeGraph
+from databases.pkl.skb import build_skbs, SKB_PATH
+from databases.pkl.snapshot import convert_pickle
+from databases.chroma_dbs.embedding_store import get_embedding_store
 
 logging.basicConfig(
     level=logging.INFO,
@@ -16,6 +19,22 @@ scope_graphs = {
 }
 
 if __name__ == "__main__":
+    if sys.argv[1:3] == ["all", "skb"] and len(sys.argv) in (3, 4):
+        # One pass over the spreadsheet for every scope, optionally one process per scope
+        build_skbs(
+            scope_graphs,
+            filepath="databases/pkl/fmea_dataset_filled.csv",
+            outpaths={scope: SKB_PATH.format(name=scope) for scope in scope_graphs},
+            processes=sys.argv[3:] == ["parallel"]
+        )
+        exit(0)
+
+    if sys.argv[1:] == ["all", "store"]:
+        # Dedup report for the embedding store shared by every Chroma collection
+        for key, value in get_embedding_store().stats().items():
+            print(f"{key}: {value}")
+        exit(0)
+
     if not len(sys.argv) == 3:
         print("Incorrect number of arguments")
         exit(1)
@@ -31,19 +50,31 @@ if __name__ == "__main__":
         case "skb":
             scope_graph.setup_skb(
                 filepath="databases/pkl/fmea_dataset_filled.csv",
-                outpath=f"databases/pkl/{scope}.pkl"
+                outpath=SKB_PATH.format(name=scope)
             )
         case "chroma":
-            scope_graph.load_skb(skb_file=f"databases/pkl/{scope}.pkl")
+            scope_graph.load_skb(skb_file=SKB_PATH.format(name=scope))
             scope_graph.setup_chroma()
+            scope_graph.chroma.wait_for_garbage_collection() # the replaced version is deleted before exiting, not left for the next run
         case "neo4j":
             if scope == "row_all":
                 print("Not allowed for row_all")
                 exit(1)
 
-            scope_graph.load_skb(skb_file=f"databases/pkl/{scope}.pkl")
+            scope_graph.load_skb(skb_file=SKB_PATH.format(name=scope))
             scope_graph.load_chroma()
             scope_graph.setup_neo4j()
+        case "update": # re-read the spreadsheet and push only what changed since the last SKB
+            scope_graph.update(
+                filepath="databases/pkl/fmea_dataset_filled.csv",
+                skb_file=SKB_PATH.format(name=scope),
+                neo4j=scope != "row_all"
+            )
+        case "gc": # delete collection versions replaced by earlier chroma steps, once their grace period is over
+            scope_graph.load_chroma()
+            scope_graph.chroma.collect_garbage()
+        case "snapshot": # convert an SKB pickle from an earlier run
+            print(convert_pickle(f"databases/pkl/{scope}.pkl", scope_graph.schema))
         case "schema":
             tag_semantic = False
             tag_uniqueness = True if scope == "property_text" or scope == "concept_text" else False
@@ -1,5 +1,4 @@
 import logging
-import csv
 import re
 from pydantic import Field
 
@@ -7,6 +6,9 @@ from databases.pkl.skb import SKB, SKBSchema, SKBNode, SKBGraph
 from databases import Chroma_DB, Neo4j_DB, Te3sEmbeddingFunction
 from llm import ChatClient, EmbeddingClient
 
+SEMANTIC_THRESHOLD = 0.6670
+FUZZY_THRESHOLD = 0.56
+
 class ConceptTextScopeSchema(SKBSchema):
     class SystemComponent(SKBNode):
         name: str = Field(..., id=True, concats_fields="Subsystem, Component, SubComponent")
@@ -35,47 +37,37 @@ class ConceptTextScopeGraph(SKBGraph):
         self.chroma: Chroma_DB
         self.neo4j: Neo4j_DB
 
-    def setup_skb(self, filepath: str, outpath: str, max_rows: int = None):
-        self.skb = SKB(self.schema)
-
-        with open(filepath, 'r', encoding="utf-8") as file:
-            reader = csv.DictReader(file)
-            for i, row in enumerate(reader):
-                if max_rows is not None and i >= max_rows:
-                    break
-
-                system_text = f"Subsystem: {row["Subsystem"].strip()} | Component: {row["Component"].strip()} | SubComponent: {row["Sub-Component"]}"
-                system = self.schema.SystemComponent(name=system_text)
-                system_id = self.skb.add_entity(system)
-
-                controls_str = row["Current Controls"].strip()
-                recommended_str = row["Recommended Action"].strip()
-                control_text = ""
-                if controls_str:
-                    control_text += f"CurrentControls: {controls_str}"
-                if recommended_str:
-                    control_text += " | " if controls_str else ""
-                    control_text += f"RecommendedAction: {recommended_str}"
-
-                actions = []
-                if controls_str or recommended_str:
-                    control = self.schema.ControlAction(description=control_text)
-                    control_id = self.skb.add_entity(control)
-                    actions.append(control_id)
-
-                failure_text = f"FailureMode: {row["Potential Failure Mode"].strip()} | FailureEffect: {row["Potential Effect(s) of Failure"].strip()} | FailureCause: {row["Potential Cause(s) of Failure"].strip()}"
-                failure = self.schema.FailureOccurrence(
-                    for_part=[system_id],
-                    related_to=actions,
-                    description=failure_text,
-                    occurrence=int(row["Occurrence"]),
-                    detection=int(row["Detection"]),
-                    rpn=int(row["RPN"]),
-                    severity=int(row["Severity"])
-                )
-                self.skb.add_entity(failure)
-
-        self.skb.save_pickle(outpath)
+    def add_row(self, row: dict[str, str]):
+        system_text = f"Subsystem: {row["Subsystem"].strip()} | Component: {row["Component"].strip()} | SubComponent: {row["Sub-Component"]}"
+        system = self.schema.SystemComponent(name=system_text)
+        system_id = self.skb.add_entity(system)
+
+        controls_str = row["Current Controls"].strip()
+        recommended_str = row["Recommended Action"].strip()
+        control_text = ""
+        if controls_str:
+            control_text += f"CurrentControls: {controls_str}"
+        if recommended_str:
+            control_text += " | " if controls_str else ""
+            control_text += f"RecommendedAction: {recommended_str}"
+
+        actions = []
+        if controls_str or recommended_str:
+            control = self.schema.ControlAction(description=control_text)
+            control_id = self.skb.add_entity(control)
+            actions.append(control_id)
+
+        failure_text = f"FailureMode: {row["Potential Failure Mode"].strip()} | FailureEffect: {row["Potential Effect(s) of Failure"].strip()} | FailureCause: {row["Potential Cause(s) of Failure"].strip()}"
+        failure = self.schema.FailureOccurrence(
+            for_part=[system_id],
+            related_to=actions,
+            description=failure_text,
+            occurrence=int(row["Occurrence"]),
+            detection=int(row["Detection"]),
+            rpn=int(row["RPN"]),
+            severity=int(row["Severity"])
+        )
+        self.skb.add_entity(failure)
 
 class ConceptTextScopeRetriever:
     def __init__(self, prompt_path: str, allow_descriptive_only: bool):
@@ -85,10 +77,11 @@ class ConceptTextScopeRetriever:
         self.allow_descriptive_only = allow_descriptive_only
 
         self.graph = ConceptTextScopeGraph()
-        self.graph.load_neo4j()
-        self.chat_client = ChatClient()
-        self.embedding_client = EmbeddingClient()
+        self.graph.load_cypher()
+        self.chat_client = ChatClient(caller="cypher-gen")
+        self.embedding_client = EmbeddingClient(caller="semantic-match")
 
+        self.prompt_path = prompt_path
         with open(prompt_path) as f:
             self.prompt = f.read()
 
@@ -115,25 +108,30 @@ class ConceptTextScopeRetriever:
         self.logger.info(f"Prompting LLM using: {prompt}")
 
         # Generate Cypher from LLM
-        raw_response = self.chat_client.chat(prompt=prompt, model=model)
+        raw_response = self.chat_client.chat(prompt=prompt, model=model, prompt_template=self.prompt_path)
         cypher_query = re.sub(r"^```[a-zA-Z]*\s*|```$", "", raw_response, flags=re.MULTILINE).strip() # Remove markdown if present
         return cypher_query
 
     def execute_query(self, query: str):
         original_query = query
 
-        query, params = self.convert_extended_functions(query)
+        if not self.graph.cypher.extended_functions:
+            query, params = self.convert_extended_functions(query)
 
         try:
-            records = self.graph.neo4j.query(query, other_params=params)
+            if self.graph.cypher.extended_functions:
+                # Functions the Neo4j rewrite below would leave alone fail the same way locally
+                records = self.graph.cypher.query(query, semantic_threshold=SEMANTIC_THRESHOLD, fuzzy_threshold=FUZZY_THRESHOLD, allow_fuzzy=self.allow_descriptive_only)
+            else:
+                records = self.graph.cypher.query(query, other_params=params)
 
-            self.logger.info(f"Retrieved {len(records)} records from Neo4j.")
+            self.logger.info(f"Retrieved {len(records)} records.")
             return original_query, records, None
         except Exception as e:
             self.logger.error(f"Error running Cypher: {e}")
             return original_query, [], f"Error during Cypher execution: {e}"
 
-    def convert_extended_functions(self, query: str, semantic_threshold: float = 0.6670, fuzzy_threshold: float = 0.56):
+    def convert_extended_functions(self, query: str, semantic_threshold: float = SEMANTIC_THRESHOLD, fuzzy_threshold: float = FUZZY_THRESHOLD):
         query = self.escape_parens_in_strings(query)
 
         # Semantic match replacement
@@ -143,6 +141,13 @@ class ConceptTextScopeRetriever:
             self.logger.info(f"Converted query to: {query}")
             return query, None
 
+        # Embed every semantic phrase in the query in one batched request
+        search_phrases = [search_phrase[1:-1].strip().lower() # take off apostrophes and normalise
+            for where_match in where_matches
+            for _, search_phrase in re.findall(r"IS_SEMANTIC_MATCH\(([^,]+),\s*([^)]+)\)", where_match.group(0))]
+        self.logger.info(f"Processing embeddings for: {search_phrases}")
+        phrase_vectors = dict(zip(search_phrases, self.embedding_client.embed_many(search_phrases))) if search_phrases else {}
+
         params = {}
         for where_match in where_matches:
             semantic_matches = re.findall(r"IS_SEMANTIC_MATCH\(([^,]+),\s*([^)]+)\)", where_match.group(0))
@@ -152,8 +157,7 @@ class ConceptTextScopeRetriever:
             new_with_clause = "WITH *"
             new_where_clause = where_match.group(0)
             for semantic_match_num, (target, search_phrase) in enumerate(semantic_matches):
-                self.logger.info(f"Processing embedding for: {search_phrase[1:-1].strip().lower()}")
-                vector = self.embedding_client.embed(search_phrase[1:-1].strip().lower()) # take off apostrophes and normalise
+                vector = phrase_vectors[search_phrase[1:-1].strip().lower()]
                 vector_placeholder = f"vector_{semantic_match_num}"
                 similarity_var = f"similarity_{semantic_match_num}"
 
@@ -1,5 +1,4 @@
 import logging
-import csv
 import re
 from pydantic import Field
 
@@ -8,6 +7,9 @@ from databases import Chroma_DB, Neo4j_DB, Te3sEmbeddingFunction
 from llm import ChatClient, EmbeddingClient
 from linking import EntityLinker
 
+SEMANTIC_THRESHOLD = 0.6418
+FUZZY_THRESHOLD = 1.8
+
 class PropertyTextScopeSchema(SKBSchema):
     class Subsystem(SKBNode):
         name: str = Field(..., id=True)
@@ -54,57 +56,46 @@ class PropertyTextScopeGraph(SKBGraph):
         self.chroma: Chroma_DB
         self.neo4j: Neo4j_DB
 
-    def setup_skb(self, filepath: str, outpath: str, max_rows: int = None):
-        self.skb = SKB(self.schema)
-
-        with open(filepath, 'r', encoding="utf-8") as file:
-            reader = csv.DictReader(file)
-            for i, row in enumerate(reader):
-                if max_rows is not None and i >= max_rows:
-                    break
-
-                subsystem = self.schema.Subsystem(name=row["Subsystem"].strip())
-                subsystem_id = self.skb.add_entity(subsystem)
-
-                component = self.schema.Component(part_of=[subsystem_id], name=row["Component"].strip())
-                component_id = self.skb.add_entity(component)
-                self.skb.get_entity_by_id(subsystem_id)._rev_in_subsystem = component_id
-
-                subcomponent = self.schema.SubComponent(part_of=[component_id], name=row["Sub-Component"].strip())
-                subcomponent_id = self.skb.add_entity(subcomponent)
-
-                fe = self.schema.FailureEffect(description=row["Potential Effect(s) of Failure"].strip())
-                fe_id = self.skb.add_entity(fe)
-
-                fc = self.schema.FailureCause(description=row["Potential Cause(s) of Failure"].strip())
-                fc_id = self.skb.add_entity(fc)
-
-                actions = []
-                controls_str = row["Current Controls"].strip()
-                if controls_str:
-                    controls = self.schema.CurrentControls(description=controls_str.strip())
-                    controls_id = self.skb.add_entity(controls)
-                    actions.append(controls_id)
-
-                recommended_str = row["Recommended Action"].strip()
-                if recommended_str:
-                    recommended = self.schema.RecommendedAction(description=recommended_str.strip())
-                    recommended_id = self.skb.add_entity(recommended)
-                    actions.append(recommended_id)
-
-                fm = self.schema.FailureMode(
-                    for_part=[subcomponent_id],
-                    related_to=[fe_id, fc_id],
-                    has_action=actions,
-                    description=row["Potential Failure Mode"].strip(),
-                    occurrence=int(row["Occurrence"]),
-                    detection=int(row["Detection"]),
-                    rpn=int(row["RPN"]),
-                    severity=int(row["Severity"])
-                )
-                self.skb.add_entity(fm)
-
-        self.skb.save_pickle(outpath)
+    def add_row(self, row: dict[str, str]):
+        subsystem = self.schema.Subsystem(name=row["Subsystem"].strip())
+        subsystem_id = self.skb.add_entity(subsystem)
+
+        component = self.schema.Component(part_of=[subsystem_id], name=row["Component"].strip())
+        component_id = self.skb.add_entity(component)
+
+        subcomponent = self.schema.SubComponent(part_of=[component_id], name=row["Sub-Component"].strip())
+        subcomponent_id = self.skb.add_entity(subcomponent)
+
+        fe = self.schema.FailureEffect(description=row["Potential Effect(s) of Failure"].strip())
+        fe_id = self.skb.add_entity(fe)
+
+        fc = self.schema.FailureCause(description=row["Potential Cause(s) of Failure"].strip())
+        fc_id = self.skb.add_entity(fc)
+
+        actions = []
+        controls_str = row["Current Controls"].strip()
+        if controls_str:
+            controls = self.schema.CurrentControls(description=controls_str.strip())
+            controls_id = self.skb.add_entity(controls)
+            actions.append(controls_id)
+
+        recommended_str = row["Recommended Action"].strip()
+        if recommended_str:
+            recommended = self.schema.RecommendedAction(description=recommended_str.strip())
+            recommended_id = self.skb.add_entity(recommended)
+            actions.append(recommended_id)
+
+        fm = self.schema.FailureMode(
+            for_part=[subcomponent_id],
+            related_to=[fe_id, fc_id],
+            has_action=actions,
+            description=row["Potential Failure Mode"].strip(),
+            occurrence=int(row["Occurrence"]),
+            detection=int(row["Detection"]),
+            rpn=int(row["RPN"]),
+            severity=int(row["Severity"])
+        )
+        self.skb.add_entity(fm)
 
 class PropertyTextScopeRetriever:
     def __init__(self, prompt_path: str, allow_linking: bool, allow_extended: bool, allow_descriptive_only: bool):
@@ -115,21 +106,22 @@ class PropertyTextScopeRetriever:
         self.allow_descriptive_only = allow_descriptive_only
 
         self.graph = PropertyTextScopeGraph()
-        self.graph.load_neo4j()
-        self.chat_client = ChatClient()
-        self.embedding_client = EmbeddingClient()
+        self.graph.load_cypher()
+        self.chat_client = ChatClient(caller="cypher-gen")
+        self.embedding_client = EmbeddingClient(caller="semantic-match")
         self.linker = EntityLinker(graph=self.graph)
 
+        self.prompt_path = prompt_path
         with open(prompt_path) as f:
             self.prompt = f.read()
 
-    def retrieve(self, question: str, model: str = None):
+    def retrieve(self, question: str, model: str = None, extraction: list[str] = None):
         self.logger.info(f"Question given: {question}")
 
         # Entity linking
         linker_context = ""
         if self.allow_linking:
-            linker_context = self.linker.get_linked_context(question)
+            linker_context = self.linker.get_linked_context(question, extraction=extraction)
 
         # Get LLM-generated Cypher
         query = self.generate_cypher(question, linker_context=linker_context, model=model)
@@ -151,7 +143,7 @@ class PropertyTextScopeRetriever:
         self.logger.info(f"Prompting LLM using: {prompt}")
 
         # Generate Cypher from LLM
-        raw_response = self.chat_client.chat(prompt=prompt, model=model)
+        raw_response = self.chat_client.chat(prompt=prompt, model=model, prompt_template=self.prompt_path)
         cypher_query = re.sub(r"^```[a-zA-Z]*\s*|```$", "", raw_response, flags=re.MULTILINE).strip() # Remove markdown if present
         return cypher_query
 
@@ -159,21 +151,24 @@ class PropertyTextScopeRetriever:
         original_query = query
 
         params = {}
-        if self.allow_extended and self.embedding_client:
+        if self.allow_extended and self.embedding_client and not self.graph.cypher.extended_functions:
             query, params = self.convert_extended_functions(query)
 
         try:
-            if params:
-                records = self.graph.neo4j.query(query, other_params=params)
+            if self.graph.cypher.extended_functions:
+                # Functions the Neo4j rewrite below would leave alone fail the same way locally
+                records = self.graph.cypher.query(query, semantic_threshold=SEMANTIC_THRESHOLD, fuzzy_threshold=FUZZY_THRESHOLD, allow_semantic=self.allow_extended, allow_fuzzy=self.allow_extended and self.allow_descriptive_only)
+            elif params:
+                records = self.graph.cypher.query(query, other_params=params)
             else:
-                records = self.graph.neo4j.query(query)
-            self.logger.info(f"Retrieved {len(records)} records from Neo4j.")
+                records = self.graph.cypher.query(query)
+            self.logger.info(f"Retrieved {len(records)} records.")
             return original_query, records, None
         except Exception as e:
             self.logger.error(f"Error running Cypher: {e}")
             return original_query, [], f"Error during Cypher execution: {e}"
 
-    def convert_extended_functions(self, query: str, semantic_threshold: float = 0.6418, fuzzy_threshold: float = 1.8):
+    def convert_extended_functions(self, query: str, semantic_threshold: float = SEMANTIC_THRESHOLD, fuzzy_threshold: float = FUZZY_THRESHOLD):
         query = self.escape_parens_in_strings(query)
 
         # Semantic match replacement
@@ -183,6 +178,13 @@ class PropertyTextScopeRetriever:
             self.logger.info(f"Converted query to: {query}")
             return query, None
 
+        # Embed every semantic phrase in the query in one batched request
+        search_phrases = [search_phrase[1:-1].strip().lower() # take off apostrophes and normalise
+            for where_match in where_matches
+            for _, search_phrase in re.findall(r"IS_SEMANTIC_MATCH\(([^,]+),\s*([^)]+)\)", where_match.group(0))]
+        self.logger.info(f"Processing embeddings for: {search_phrases}")
+        phrase_vectors = dict(zip(search_phrases, self.embedding_client.embed_many(search_phrases))) if search_phrases else {}
+
         params = {}
         for where_match in where_matches:
             semantic_matches = re.findall(r"IS_SEMANTIC_MATCH\(([^,]+),\s*([^)]+)\)", where_match.group(0))
@@ -192,8 +194,7 @@ class PropertyTextScopeRetriever:
             new_with_clause = "WITH *"
             new_where_clause = where_match.group(0)
             for semantic_match_num, (target, search_phrase) in enumerate(semantic_matches):
-                self.logger.info(f"Processing embedding for: {search_phrase[1:-1].strip().lower()}")
-                vector = self.embedding_client.embed(search_phrase[1:-1].strip().lower()) # take off apostrophes and normalise
+                vector = phrase_vectors[search_phrase[1:-1].strip().lower()]
                 vector_placeholder = f"vector_{semantic_match_num}"
                 similarity_var = f"similarity_{semantic_match_num}"
 
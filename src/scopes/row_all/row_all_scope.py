@@ -1,5 +1,4 @@
 import logging
-import csv
 import re
 from pydantic import Field
 
@@ -23,22 +22,12 @@ class RowAllScopeGraph(SKBGraph):
         self.chroma: Chroma_DB
         # self.neo4j: Neo4j_DB
 
-    def setup_skb(self, filepath: str, outpath: str, max_rows: int = None):
-        self.skb = SKB(self.schema)
-
-        with open(filepath, 'r', encoding="utf-8") as file:
-            reader = csv.DictReader(file)
-            for i, row in enumerate(reader):
-                if max_rows is not None and i >= max_rows:
-                    break
-
-                row_text = f"Subsystem: {row["Subsystem"].strip()} | Component: {row["Component"].strip()} | SubComponent: {row["Sub-Component"]} | FailureMode: {row["Potential Failure Mode"].strip()} | FailureEffect: {row["Potential Effect(s) of Failure"].strip()} | FailureCause: {row["Potential Cause(s) of Failure"].strip()} | CurrentControls: {row["Current Controls"].strip()} | RecommendedAction: {row["Recommended Action"].strip()} | Occurrence: {row["Occurrence"].strip()} | Detection: {row["Detection"].strip()} | Severity: {row["Severity"].strip()} | RPN: {row["RPN"].strip()}"
-                row = self.schema.Row(
-                    contents=row_text
-                )
-                self.skb.add_entity(row)
-
-        self.skb.save_pickle(outpath)
+    def add_row(self, row: dict[str, str]):
+        row_text = f"Subsystem: {row["Subsystem"].strip()} | Component: {row["Component"].strip()} | SubComponent: {row["Sub-Component"]} | FailureMode: {row["Potential Failure Mode"].strip()} | FailureEffect: {row["Potential Effect(s) of Failure"].strip()} | FailureCause: {row["Potential Cause(s) of Failure"].strip()} | CurrentControls: {row["Current Controls"].strip()} | RecommendedAction: {row["Recommended Action"].strip()} | Occurrence: {row["Occurrence"].strip()} | Detection: {row["Detection"].strip()} | Severity: {row["Severity"].strip()} | RPN: {row["RPN"].strip()}"
+        row = self.schema.Row(
+            contents=row_text
+        )
+        self.skb.add_entity(row)
 
 class RowAllScopeRetriever:
     def __init__(self):
@@ -47,16 +36,16 @@ class RowAllScopeRetriever:
         self.allow_linking = False
 
         self.graph = RowAllScopeGraph()
-        self.graph.load_chroma()
-        self.chat_client = ChatClient()
-        self.embedding_client = EmbeddingClient()
+        self.graph.load_vectors()
+        self.chat_client = ChatClient(caller="cypher-gen")
+        self.embedding_client = EmbeddingClient(caller="semantic-match")
 
     def retrieve(self, question: str, k=25, threshold=None, model: str = None):
         model # not used for baseline vector search
         self.logger.info(f"Question given: {question}")
 
         # No Cypher generation here - just a vector search
-        vector_matches = self.graph.chroma.query(
+        vector_matches = self.graph.vectors.query(
             query=question.strip(),
             k=k,
             threshold=threshold
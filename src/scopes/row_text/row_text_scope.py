@@ -1,5 +1,4 @@
 import logging
-import csv
 import re
 from pydantic import Field
 
@@ -7,6 +6,9 @@ from databases.pkl.skb import SKB, SKBSchema, SKBNode, SKBGraph
 from databases import Chroma_DB, Neo4j_DB, Te3sEmbeddingFunction
 from llm import ChatClient, EmbeddingClient
 
+SEMANTIC_THRESHOLD = 0.6586
+FUZZY_THRESHOLD = 0.42
+
 class RowTextScopeSchema(SKBSchema):
     class Row(SKBNode):
         contents: str = Field(..., id=True, semantic=True, concats_fields="FailureMode, FailureEffect, FailureCause, Subsystem, Component, SubComponent, CurrentControls, RecommendedAction")
@@ -27,26 +29,16 @@ class RowTextScopeGraph(SKBGraph):
         self.chroma: Chroma_DB
         self.neo4j: Neo4j_DB
 
-    def setup_skb(self, filepath: str, outpath: str, max_rows: int = None):
-        self.skb = SKB(self.schema)
-
-        with open(filepath, 'r', encoding="utf-8") as file:
-            reader = csv.DictReader(file)
-            for i, row in enumerate(reader):
-                if max_rows is not None and i >= max_rows:
-                    break
-
-                row_text = f"Subsystem: {row["Subsystem"].strip()} | Component: {row["Component"].strip()} | SubComponent: {row["Sub-Component"]} | FailureMode: {row["Potential Failure Mode"].strip()} | FailureEffect: {row["Potential Effect(s) of Failure"].strip()} | FailureCause: {row["Potential Cause(s) of Failure"].strip()} | CurrentControls: {row["Current Controls"].strip()} | RecommendedAction: {row["Recommended Action"].strip()}"
-                row = self.schema.Row(
-                    contents=row_text,
-                    occurrence=int(row["Occurrence"]),
-                    detection=int(row["Detection"]),
-                    rpn=int(row["RPN"]),
-                    severity=int(row["Severity"])
-                )
-                self.skb.add_entity(row)
-
-        self.skb.save_pickle(outpath)
+    def add_row(self, row: dict[str, str]):
+        row_text = f"Subsystem: {row["Subsystem"].strip()} | Component: {row["Component"].strip()} | SubComponent: {row["Sub-Component"]} | FailureMode: {row["Potential Failure Mode"].strip()} | FailureEffect: {row["Potential Effect(s) of Failure"].strip()} | FailureCause: {row["Potential Cause(s) of Failure"].strip()} | CurrentControls: {row["Current Controls"].strip()} | RecommendedAction: {row["Recommended Action"].strip()}"
+        row = self.schema.Row(
+            contents=row_text,
+            occurrence=int(row["Occurrence"]),
+            detection=int(row["Detection"]),
+            rpn=int(row["RPN"]),
+            severity=int(row["Severity"])
+        )
+        self.skb.add_entity(row)
 
 class RowTextScopeRetriever:
     def __init__(self, prompt_path: str, allow_descriptive_only: bool):
@@ -56,10 +48,11 @@ class RowTextScopeRetriever:
         self.allow_descriptive_only = allow_descriptive_only
 
         self.graph = RowTextScopeGraph()
-        self.graph.load_neo4j()
-        self.chat_client = ChatClient()
-        self.embedding_client = EmbeddingClient()
+        self.graph.load_cypher()
+        self.chat_client = ChatClient(caller="cypher-gen")
+        self.embedding_client = EmbeddingClient(caller="semantic-match")
 
+        self.prompt_path = prompt_path
         with open(prompt_path) as f:
             self.prompt = f.read()
 
@@ -86,25 +79,30 @@ class RowTextScopeRetriever:
         self.logger.info(f"Prompting LLM using: {prompt}")
 
         # Generate Cypher from LLM
-        raw_response = self.chat_client.chat(prompt=prompt, model=model)
+        raw_response = self.chat_client.chat(prompt=prompt, model=model, prompt_template=self.prompt_path)
         cypher_query = re.sub(r"^```[a-zA-Z]*\s*|```$", "", raw_response, flags=re.MULTILINE).strip() # Remove markdown if present
         return cypher_query
 
     def execute_query(self, query: str):
         original_query = query
 
-        query, params = self.convert_extended_functions(query)
+        if not self.graph.cypher.extended_functions:
+            query, params = self.convert_extended_functions(query)
 
         try:
-            records = self.graph.neo4j.query(query, other_params=params)
+            if self.graph.cypher.extended_functions:
+                # Functions the Neo4j rewrite below would leave alone fail the same way locally
+                records = self.graph.cypher.query(query, semantic_threshold=SEMANTIC_THRESHOLD, fuzzy_threshold=FUZZY_THRESHOLD, allow_fuzzy=self.allow_descriptive_only)
+            else:
+                records = self.graph.cypher.query(query, other_params=params)
 
-            self.logger.info(f"Retrieved {len(records)} records from Neo4j.")
+            self.logger.info(f"Retrieved {len(records)} records.")
             return original_query, records, None
         except Exception as e:
             self.logger.error(f"Error running Cypher: {e}")
             return original_query, [], f"Error during Cypher execution: {e}"
 
-    def convert_extended_functions(self, query: str, semantic_threshold: float = 0.6586, fuzzy_threshold: float = 0.42):
+    def convert_extended_functions(self, query: str, semantic_threshold: float = SEMANTIC_THRESHOLD, fuzzy_threshold: float = FUZZY_THRESHOLD):
         query = self.escape_parens_in_strings(query)
 
         # Semantic match replacement
@@ -114,6 +112,13 @@ class RowTextScopeRetriever:
             self.logger.info(f"Converted query to: {query}")
             return query, None
 
+        # Embed every semantic phrase in the query in one batched request
+        search_phrases = [search_phrase[1:-1].strip().lower() # take off apostrophes and normalise
+            for where_match in where_matches
+            for _, search_phrase in re.findall(r"IS_SEMANTIC_MATCH\(([^,]+),\s*([^)]+)\)", where_match.group(0))]
+        self.logger.info(f"Processing embeddings for: {search_phrases}")
+        phrase_vectors = dict(zip(search_phrases, self.embedding_client.embed_many(search_phrases))) if search_phrases else {}
+
         params = {}
         for where_match in where_matches:
             semantic_matches = re.findall(r"IS_SEMANTIC_MATCH\(([^,]+),\s*([^)]+)\)", where_match.group(0))
@@ -123,8 +128,7 @@ class RowTextScopeRetriever:
             new_with_clause = "WITH *"
             new_where_clause = where_match.group(0)
             for semantic_match_num, (target, search_phrase) in enumerate(semantic_matches):
-                self.logger.info(f"Processing embedding for: {search_phrase[1:-1].strip().lower()}")
-                vector = self.embedding_client.embed(search_phrase[1:-1].strip().lower()) # take off apostrophes and normalise
+                vector = phrase_vectors[search_phrase[1:-1].strip().lower()]
                 vector_placeholder = f"vector_{semantic_match_num}"
                 similarity_var = f"similarity_{semantic_match_num}"
 
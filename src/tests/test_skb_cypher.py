@@ -0,0 +1,181 @@
+import pytest
+
+from databases.pkl.skb import SKB
+from databases.cypher_dbs.skb_cypher import SKBCypher_DB, CypherError
+from scopes.property_text.property_text_scope import PropertyTextScopeSchema as Schema, SEMANTIC_THRESHOLD
+
+# Embeddings are picked by hand so each semantic match has a known cosine against the query phrases
+PHRASE_VECTORS = {
+    "restricted flow": [1.0, 0.0, 0.0],
+    "lubrication": [0.0, 1.0, 0.0],
+}
+NODE_VECTORS = {
+    "Blocked": [1.0, 0.0, 0.0], # cosine 1 with 'restricted flow'
+    "Leaking": [0.5, 0.8660254, 0.0], # cosine 0.5: (1 + 0.5) / 2 = 0.75 clears the threshold in Neo4j's normalised score
+    "Fractured": [0.0, 0.0, 1.0], # cosine 0, (1 + 0) / 2 = 0.5 does not
+    "Replace filter element": [1.0, 0.0, 0.0],
+    "Inspect seals": [0.0, 0.0, 1.0],
+    "Check lubrication": [0.0, 1.0, 0.0],
+}
+
+class FakeEmbeddingClient:
+    def embed_many(self, texts: list[str]) -> list[list[float]]:
+        return [PHRASE_VECTORS[text] for text in texts]
+
+class FakeCollection:
+    def __init__(self, entries: dict[str, list[float]]):
+        self.entries = entries
+
+    def get(self, include: list[str]) -> dict[str, list]:
+        return {"ids": list(self.entries), "embeddings": list(self.entries.values())}
+
+class FakeChroma:
+    def __init__(self, entries: dict[str, list[float]]):
+        self.collection = FakeCollection(entries)
+
+def build_skb() -> SKB:
+    skb = SKB(Schema)
+    hydraulic = skb.add_entity(Schema.Subsystem(name="Hydraulic System"))
+    power = skb.add_entity(Schema.Subsystem(name="Power Train"))
+    cylinders = skb.add_entity(Schema.Component(part_of=[hydraulic], name="Hydraulic Cylinders"))
+    gearbox = skb.add_entity(Schema.Component(part_of=[power], name="Gearbox"))
+    seal = skb.add_entity(Schema.SubComponent(part_of=[cylinders], name="Piston Seal"))
+    filter_ = skb.add_entity(Schema.SubComponent(part_of=[cylinders], name="Return Filter"))
+    shaft = skb.add_entity(Schema.SubComponent(part_of=[gearbox], name="Output Shaft"))
+
+    pressure = skb.add_entity(Schema.FailureEffect(description="Loss of pressure"))
+    drive = skb.add_entity(Schema.FailureEffect(description="Loss of drive"))
+    rows = [
+        (filter_, "Blocked", "Contamination", pressure, "Replace filter element", 4, 2, 40, 5),
+        (seal, "Leaking", "Seal wear", pressure, "Inspect seals", 5, 2, 30, 3),
+        (shaft, "Fractured", "Fatigue", drive, "Check lubrication", 5, 2, 60, 6),
+    ]
+    for part, description, cause, effect, action, occurrence, detection, rpn, severity in rows:
+        cause_id = skb.add_entity(Schema.FailureCause(description=cause))
+        action_id = skb.add_entity(Schema.RecommendedAction(description=action))
+        skb.add_entity(Schema.FailureMode(for_part=[part], related_to=[effect, cause_id], has_action=[action_id], description=description,
+            occurrence=occurrence, detection=detection, rpn=rpn, severity=severity))
+    return skb
+
+@pytest.fixture(scope="module")
+def db() -> SKBCypher_DB:
+    skb = build_skb()
+    vectors = {node_id: NODE_VECTORS[node.description] for node_id, node in skb.get_entities().items() if getattr(node, "description", None) in NODE_VECTORS}
+    return SKBCypher_DB(skb, chroma=FakeChroma(vectors), embedding_client=FakeEmbeddingClient())
+
+def unordered(rows: list[dict]) -> list[str]:
+    # Neo4j gives no row order without ORDER BY
+    return sorted(repr(sorted(row.items())) for row in rows)
+
+def test_count(db):
+    rows = db.query(
+        "MATCH (subcomponent:SubComponent)\n"
+        "RETURN COUNT(subcomponent.name) AS subcomponent_count"
+    )
+    assert rows == [{"subcomponent_count": 3}]
+
+def test_path_where_and_grouped_aggregates(db):
+    rows = db.query(
+        "MATCH (subsystem:Subsystem)<-[:PART_OF]-(component:Component)<-[:PART_OF]-(subcomponent:SubComponent)<-[:FOR_PART]-(failuremode:FailureMode)\n"
+        "WHERE failuremode.rpn > 35\n"
+        "RETURN subsystem.name, component.name, COUNT(DISTINCT failuremode) AS failuremode_count, COLLECT(DISTINCT failuremode.description) AS failuremode_descriptions, "
+        "COLLECT(DISTINCT subcomponent.name) AS subcomponents, COLLECT(DISTINCT failuremode.rpn) AS rpn_values"
+    )
+    assert unordered(rows) == unordered([
+        {"subsystem.name": "Hydraulic System", "component.name": "Hydraulic Cylinders", "failuremode_count": 1,
+            "failuremode_descriptions": ["Blocked"], "subcomponents": ["Return Filter"], "rpn_values": [40]},
+        {"subsystem.name": "Power Train", "component.name": "Gearbox", "failuremode_count": 1,
+            "failuremode_descriptions": ["Fractured"], "subcomponents": ["Output Shaft"], "rpn_values": [60]},
+    ])
+
+def test_grouping_collects_per_key(db):
+    rows = db.query(
+        "MATCH (component:Component)<-[:PART_OF]-(subcomponent:SubComponent)<-[:FOR_PART]-(failuremode:FailureMode)\n"
+        "RETURN component.name, COUNT(failuremode) AS failures, SUM(failuremode.rpn) AS total_rpn, AVG(failuremode.severity) AS severity, MAX(failuremode.rpn) AS worst"
+    )
+    assert unordered(rows) == unordered([
+        {"component.name": "Hydraulic Cylinders", "failures": 2, "total_rpn": 70, "severity": 4.0, "worst": 40},
+        {"component.name": "Gearbox", "failures": 1, "total_rpn": 60, "severity": 6.0, "worst": 60},
+    ])
+
+def test_semantic_match_uses_normalised_cosine(db):
+    rows = db.query(
+        "MATCH (subcomponent:SubComponent)<-[:FOR_PART]-(failuremode:FailureMode)\n"
+        "WHERE IS_SEMANTIC_MATCH(failuremode.description, 'restricted flow')\n"
+        "RETURN subcomponent.name, failuremode.description, failuremode.rpn",
+        semantic_threshold=SEMANTIC_THRESHOLD,
+    )
+    # Neo4j keeps vector.similarity.cosine > threshold, i.e. (1 + cosine) / 2, so the cosine 0.5 'Leaking' matches too
+    assert unordered(rows) == unordered([
+        {"subcomponent.name": "Return Filter", "failuremode.description": "Blocked", "failuremode.rpn": 40},
+        {"subcomponent.name": "Piston Seal", "failuremode.description": "Leaking", "failuremode.rpn": 30},
+    ])
+
+def test_fuzzy_and_semantic_match(db):
+    rows = db.query(
+        "MATCH (subsystem:Subsystem)<-[:PART_OF]-(component:Component)<-[:PART_OF]-(subcomponent:SubComponent)<-[:FOR_PART]-(failuremode:FailureMode)-[:HAS_ACTION]->(recommendedaction:RecommendedAction)\n"
+        "WHERE IS_FUZZY_MATCH(subsystem.name, 'power trian')\n"
+        "\tAND IS_SEMANTIC_MATCH(recommendedaction.description, 'lubrication')\n"
+        "RETURN subsystem.name, subcomponent.name, failuremode.description, recommendedaction.description",
+        semantic_threshold=SEMANTIC_THRESHOLD, fuzzy_threshold=0.42,
+    )
+    assert rows == [{"subsystem.name": "Power Train", "subcomponent.name": "Output Shaft", "failuremode.description": "Fractured", "recommendedaction.description": "Check lubrication"}]
+
+def test_fuzzy_threshold_comes_from_the_scope(db):
+    query = "MATCH (subsystem:Subsystem) WHERE IS_FUZZY_MATCH(subsystem.name, 'hydrolic system') RETURN subsystem.name"
+    assert db.query(query, fuzzy_threshold=0.42) == [{"subsystem.name": "Hydraulic System"}]
+    assert db.query(query, fuzzy_threshold=1.8) == []
+
+def test_union_removes_duplicates(db):
+    rows = db.query(
+        "MATCH (component:Component)<-[:PART_OF]-(subcomponent:SubComponent)\n"
+        "WHERE component.name = 'Hydraulic Cylinders'\n"
+        "RETURN subcomponent.name AS name\n"
+        "UNION\n"
+        "MATCH (subcomponent:SubComponent)<-[:FOR_PART]-(failuremode:FailureMode)\n"
+        "WHERE failuremode.rpn >= 30\n"
+        "RETURN subcomponent.name AS name"
+    )
+    assert unordered(rows) == unordered([{"name": "Piston Seal"}, {"name": "Return Filter"}, {"name": "Output Shaft"}])
+
+def test_with_order_by_limit(db):
+    rows = db.query(
+        "MATCH (failuremode:FailureMode)\n"
+        "WITH failuremode, failuremode.rpn AS rpn, failuremode.severity AS severity\n"
+        "ORDER BY rpn DESC, severity DESC\n"
+        "LIMIT 2\n"
+        "RETURN failuremode.description, rpn"
+    )
+    assert rows == [{"failuremode.description": "Fractured", "rpn": 60}, {"failuremode.description": "Blocked", "rpn": 40}]
+
+def test_optional_match_keeps_unmatched_rows(db):
+    rows = db.query(
+        "MATCH (subcomponent:SubComponent)\n"
+        "OPTIONAL MATCH (subcomponent)<-[:FOR_PART]-(failuremode:FailureMode)\n"
+        "WHERE failuremode.rpn > 50\n"
+        "RETURN subcomponent.name, failuremode.description"
+    )
+    assert unordered(rows) == unordered([
+        {"subcomponent.name": "Output Shaft", "failuremode.description": "Fractured"},
+        {"subcomponent.name": "Piston Seal", "failuremode.description": None},
+        {"subcomponent.name": "Return Filter", "failuremode.description": None},
+    ])
+
+def test_filter_ids_parameter(db):
+    node_id = next(node_id for node_id, node in db.skb.get_entities().items() if getattr(node, "name", None) == "Gearbox")
+    rows = db.query("MATCH (component:Component) WHERE component.external_id IN $ids RETURN component.name", filter_ids=[node_id])
+    assert rows == [{"component.name": "Gearbox"}]
+
+def test_ftsearch(db):
+    rows = db.ftsearch("hydraulic cylinder")
+    assert [row["TextValue"] for row in rows] == ["Hydraulic Cylinders"]
+
+def test_unsupported_clause(db):
+    with pytest.raises(CypherError):
+        db.query("CREATE (n:Subsystem {name: 'New'})")
+
+@pytest.mark.parametrize("function, flags", [("IS_SEMANTIC_MATCH", {"allow_semantic": False}), ("IS_FUZZY_MATCH", {"allow_fuzzy": False})])
+def test_disabled_extended_function_is_unknown(db, function, flags):
+    # As in Neo4j, where a scope that doesn't rewrite the function sends it through as is
+    with pytest.raises(CypherError, match=f"Unknown function '{function}'"):
+        db.query(f"MATCH (failuremode:FailureMode) WHERE {function}(failuremode.description, 'lubrication') RETURN failuremode.description", **flags)
@@ -0,0 +1,113 @@
+import numpy as np
+import pytest
+
+from databases.vector_dbs.vector_index import VectorIndex
+
+DIM = 32
+TYPES = ["FailureMode", "FailureCause", "RecommendedAction"]
+
+class FakeCollection:
+    def __init__(self, embeddings: np.ndarray):
+        self.embeddings = embeddings
+
+    def get(self, include: list[str]) -> dict[str, list]:
+        count = len(self.embeddings)
+        return {
+            "ids": [f"id{i}" for i in range(count)],
+            "embeddings": list(self.embeddings),
+            "metadatas": [{"type": TYPES[i % len(TYPES)]} for i in range(count)],
+            "documents": [f"document {i}" for i in range(count)],
+        }
+
+class FakeChroma:
+    collection_name = "vectors"
+
+    def __init__(self, embeddings: np.ndarray):
+        self.collection = FakeCollection(embeddings)
+
+class QueryEmbeddings:
+    """Embedding function returning a fixed random vector per query text."""
+    def __init__(self, seed: int = 1):
+        self.rng = np.random.default_rng(seed)
+        self.vectors = {}
+
+    def __call__(self, texts: list[str]) -> list[np.ndarray]:
+        return [self.vectors.setdefault(text, self.rng.standard_normal(DIM).astype(np.float32)) for text in texts]
+
+def brute_force(embeddings: np.ndarray, vector: np.ndarray, rows: np.ndarray = None) -> list[tuple[str, float]]:
+    """Every row by float32 cosine similarity, best first."""
+    rows = np.arange(len(embeddings)) if rows is None else rows
+    matrix = embeddings[rows] / np.linalg.norm(embeddings[rows], axis=1, keepdims=True)
+    similarities = matrix @ (vector / np.linalg.norm(vector))
+    order = np.argsort(-similarities, kind="stable")
+    return [(f"id{rows[i]}", float(similarities[i])) for i in order]
+
+def open_index(tmp_path, embeddings: np.ndarray, dtype: str) -> VectorIndex:
+    path = str(tmp_path / dtype)
+    VectorIndex.build(FakeChroma(embeddings), path=path, dtype=dtype)
+    return VectorIndex("vectors", QueryEmbeddings(), path=path)
+
+@pytest.fixture(scope="module")
+def embeddings() -> np.ndarray:
+    return np.random.default_rng(0).standard_normal((500, DIM)).astype(np.float32)
+
+QUERIES = [f"query {i}" for i in range(10)]
+
+@pytest.mark.parametrize("dtype", ["float32", "float16", "int8"])
+def test_top_k_matches_brute_force(tmp_path, embeddings, dtype):
+    index = open_index(tmp_path, embeddings, dtype)
+    for query, matches in zip(QUERIES, index.query_many(QUERIES, k=10)):
+        exact = brute_force(embeddings, index.embed_fnc([query])[0])[:10]
+        assert [match[0] for match in matches] == [node_id for node_id, _ in exact]
+        # compact indexes re-score their shortlist at float32, so scores are exact too
+        assert [match[3] for match in matches] == pytest.approx([score for _, score in exact], abs=1e-5)
+
+@pytest.mark.parametrize("dtype", ["float32", "float16", "int8"])
+def test_range_search_matches_brute_force(tmp_path, embeddings, dtype):
+    index = open_index(tmp_path, embeddings, dtype)
+    threshold = 0.3
+    for query, matches in zip(QUERIES, index.query_many(QUERIES, k=None, threshold=threshold)):
+        exact = [node_id for node_id, score in brute_force(embeddings, index.embed_fnc([query])[0]) if score >= threshold]
+        assert [match[0] for match in matches] == exact
+    assert index.range_stats["searches"] == len(QUERIES)
+
+@pytest.mark.parametrize("dtype", ["float32", "int8"])
+def test_filters_match_brute_force(tmp_path, embeddings, dtype):
+    index = open_index(tmp_path, embeddings, dtype)
+    filter_ids = [f"id{i}" for i in range(0, 500, 2)]
+    matches = index.query(QUERIES[0], k=5, filter_entities=["FailureMode"], filter_ids=filter_ids + ["missing"])
+    rows = np.array([i for i in range(0, 500, 2) if TYPES[i % len(TYPES)] == "FailureMode"])
+    exact = brute_force(embeddings, index.embed_fnc([QUERIES[0]])[0], rows)[:5]
+    assert [match[0] for match in matches] == [node_id for node_id, _ in exact]
+    assert all(match[1] == "FailureMode" for match in matches)
+
+@pytest.mark.parametrize("dtype", ["float32", "float16", "int8"])
+def test_k_larger_than_index(tmp_path, embeddings, dtype):
+    index = open_index(tmp_path, embeddings[:7], dtype)
+    matches = index.query(QUERIES[0], k=25)
+    exact = brute_force(embeddings[:7], index.embed_fnc([QUERIES[0]])[0])
+    assert [match[0] for match in matches] == [node_id for node_id, _ in exact]
+
+def test_threshold_cuts_top_k(tmp_path, embeddings):
+    index = open_index(tmp_path, embeddings, "float32")
+    matches = index.query(QUERIES[0], k=50, threshold=0.2)
+    assert matches and all(match[3] >= 0.2 for match in matches)
+    exact = [node_id for node_id, score in brute_force(embeddings, index.embed_fnc([QUERIES[0]])[0])[:50] if score >= 0.2]
+    assert [match[0] for match in matches] == exact
+
+@pytest.mark.parametrize("dtype", ["float32", "int8"])
+def test_empty_index(tmp_path, dtype):
+    index = open_index(tmp_path, np.empty((0, DIM), dtype=np.float32), dtype)
+    assert index.query(QUERIES[0], k=10) == []
+    assert index.query_many(QUERIES[:2], k=None, threshold=0.1) == [[], []]
+
+def test_range_search_needs_threshold(tmp_path, embeddings):
+    index = open_index(tmp_path, embeddings[:10], "float32")
+    with pytest.raises(ValueError):
+        index.query(QUERIES[0], k=None)
+
+@pytest.mark.parametrize("dtype, scanned", [("float32", 4), ("float16", 2), ("int8", 1)])
+def test_disk_bytes_include_float32_copy(tmp_path, embeddings, dtype, scanned):
+    index = open_index(tmp_path, embeddings, dtype)
+    assert index.nbytes >= embeddings.shape[0] * DIM * scanned
+    assert index.disk_bytes == index.nbytes + (0 if dtype == "float32" else embeddings.nbytes)